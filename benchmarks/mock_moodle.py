@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""Servidor Moodle de pega para pruebas y benchmarks sin red.
+
+Implementa lo que usa ``main.py``:
+
+- ``/login/token.php``: acepta cualquier usuario y contrasena.
+- ``/webservice/rest/server.php``: ``core_webservice_get_site_info``,
+  ``core_enrol_get_users_courses``, ``core_course_get_contents``,
+  ``core_course_get_updates_since``, ``tool_mobile_call_external_functions``
+  y, para los adjuntos (``--attachments``), ``mod_assign_get_assignments``,
+  ``mod_forum_get_forums_by_courses`` y ``mod_forum_get_forum_discussions``.
+- ``/tokenpluginfile.php/<clave>/...``: ficheros generados al vuelo, con
+  soporte de ``Range``.
+- ``/__stats__``: peticiones y bytes servidos por tipo (``wsfunction``, ``login``
+  o ``file``), respuestas por codigo HTTP, ficheros servidos y maximo de
+  peticiones simultaneas (JSON).
+
+El catalogo (cursos, secciones, modulos y tamanos) es determinista para una
+misma ``--seed``. Los ficheros no se guardan en memoria: su contenido se
+genera rotando un bloque aleatorio comun.
+
+Tamanos de fichero (``--file-size``):
+
+- ``fixed:256K``: todos iguales.
+- ``uniform:4K-2M``: uniforme entre los dos valores.
+- ``lognormal:256K``: log-normal con esa mediana (sigma 1.5, maximo 64x la mediana).
+
+Uso::
+
+    python benchmarks/mock_moodle.py --port 8765 --courses 5 --file-size lognormal:256K \\
+        --latency 0.02 --error-rate 0.01 --throttle-rate 0.01
+
+Con ``--max-in-flight N`` se comporta como un sitio saturado: mientras sirve N
+peticiones responde al resto con 503 (y ``Retry-After`` si se indica).
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+TOKEN = "0123456789abcdef0123456789abcdef"
+PRIVATE_ACCESS_KEY = "mockprivateaccesskey"
+USER_ID = 2
+BLOCK_SIZE = 1024 * 1024
+WRITE_CHUNK = 64 * 1024
+
+
+def parse_size(value):
+    """Convierte ``"64K"``, ``"2M"`` o ``"1G"`` a bytes."""
+    text = str(value).strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    factor = units.get(text[-1:], 1)
+    if text[-1:] in units:
+        text = text[:-1]
+    try:
+        return int(float(text) * factor)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r} (use e.g. 64K, 2M)")
+
+
+def parse_size_dist(value):
+    """Convierte ``fixed:N``, ``uniform:A-B`` o ``lognormal:MEDIANA`` en una funcion ``rng -> bytes``."""
+    kind, _, spec = str(value).partition(":")
+    kind = kind.strip().lower()
+    if kind == "fixed":
+        size = parse_size(spec)
+        return lambda rng: size
+    if kind == "uniform":
+        low, sep, high = spec.partition("-")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"invalid distribution: {value!r} (use uniform:4K-2M)")
+        low, high = parse_size(low), parse_size(high)
+        return lambda rng: rng.randint(min(low, high), max(low, high))
+    if kind == "lognormal":
+        median = parse_size(spec)
+        return lambda rng: max(1, min(int(rng.lognormvariate(math.log(median), 1.5)), median * 64))
+    raise argparse.ArgumentTypeError(f"invalid distribution: {value!r} (fixed, uniform or lognormal)")
+
+
+def _file_entry(base_url, cmid, area, index, name, size):
+    return {
+        "filename": name,
+        "filepath": "/",
+        "filesize": size,
+        "fileurl": f"{base_url}/webservice/pluginfile.php/{cmid}/{area}/{index}/{name}?forcedownload=1",
+        "timemodified": 1700000000 + index,
+        "mimetype": "application/pdf",
+    }
+
+
+def build_catalog(base_url, courses, sections, modules, files_per_module, size_dist, seed, summary_size=0, attachments=0):
+    """Genera ``(cursos, contenidos_por_curso, ficheros, actividades)`` de forma determinista.
+
+    ``summary_size`` es el tamano del HTML de ``summary`` de cada seccion y de
+    ``description`` de cada modulo (cursos con mucho texto en la portada).
+
+    ``ficheros`` mapea ``(cmid, indice)`` a ``(tamano, desplazamiento)`` dentro
+    del bloque comun usado para generar el contenido. Con ``attachments`` la
+    primera seccion de cada curso tiene ademas una tarea con ese numero de
+    adjuntos en el enunciado y un foro con ese numero de debates con un adjunto;
+    ``actividades`` tiene lo que devuelven ``mod_assign_get_assignments``,
+    ``mod_forum_get_forums_by_courses`` y ``mod_forum_get_forum_discussions``.
+    """
+    rng = random.Random(seed)
+    course_list, contents, files = [], {}, {}
+    activities = {"assignments": {}, "forums": {}, "discussions": {}}
+    html = ("<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n" * (summary_size // 62 + 1))[:summary_size]
+    for c in range(courses):
+        course_id = 100 + c
+        course_list.append({"id": course_id, "shortname": f"C{c}", "fullname": f"MOCK{c}:Curso {c}", "hidden": 0})
+        course_sections = []
+        for s in range(sections):
+            section_modules = []
+            for m in range(modules):
+                cmid = course_id * 10000 + s * 100 + m
+                module_files = []
+                for f in range(files_per_module):
+                    size = size_dist(rng)
+                    files[(cmid, f)] = (size, rng.randrange(BLOCK_SIZE))
+                    name = f"doc_{s}_{m}_{f}.pdf"
+                    module_files.append(
+                        {
+                            "type": "file",
+                            "filename": name,
+                            "filepath": "/",
+                            "filesize": size,
+                            "fileurl": f"{base_url}/webservice/pluginfile.php/{cmid}/mod_resource/content/{f}/{name}?forcedownload=1",
+                            "timemodified": 1700000000 + f,
+                            "mimetype": "application/pdf",
+                        }
+                    )
+                section_modules.append(
+                    {"id": cmid, "name": f"Recurso {s}.{m}", "modname": "resource", "visible": 1, "description": html,
+                     "contents": module_files}
+                )
+            if attachments and s == 0:
+                assign_cmid, forum_cmid = course_id * 10000 + 98, course_id * 10000 + 99
+                brief = []
+                for i in range(attachments):
+                    size = size_dist(rng)
+                    files[(assign_cmid, i)] = (size, rng.randrange(BLOCK_SIZE))
+                    brief.append(_file_entry(base_url, assign_cmid, "mod_assign/introattachment", i, f"enunciado_{i}.pdf", size))
+                activities["assignments"][course_id] = [
+                    {"id": assign_cmid, "cmid": assign_cmid, "course": course_id, "name": "Tarea 1", "introattachments": brief}
+                ]
+                discussions = []
+                for i in range(attachments):
+                    size = size_dist(rng)
+                    files[(forum_cmid, i)] = (size, rng.randrange(BLOCK_SIZE))
+                    discussions.append(
+                        {"id": forum_cmid * 100 + i, "discussion": forum_cmid * 100 + i, "name": f"Debate {i}", "attachment": "1",
+                         "attachments": [_file_entry(base_url, forum_cmid, "mod_forum/attachment", i, "adjunto.pdf", size)]}
+                    )
+                activities["forums"][course_id] = [
+                    {"id": forum_cmid, "cmid": forum_cmid, "course": course_id, "name": "Foro", "numdiscussions": attachments}
+                ]
+                activities["discussions"][forum_cmid] = discussions
+                section_modules.append({"id": assign_cmid, "name": "Tarea 1", "modname": "assign", "visible": 1})
+                section_modules.append({"id": forum_cmid, "name": "Foro", "modname": "forum", "visible": 1})
+            course_sections.append(
+                {"id": course_id * 100 + s, "section": s, "name": f"Tema {s}", "summary": html, "modules": section_modules}
+            )
+        contents[course_id] = course_sections
+    return course_list, contents, files, activities
+
+
+def _ids(arguments, name):
+    """Lista ``name`` de los argumentos, tanto en JSON (agrupadas) como ``name[0]=...`` (REST)."""
+    if isinstance(arguments.get(name), list):
+        return [int(v) for v in arguments[name]]
+    return [int(v) for k, v in sorted(arguments.items()) if re.fullmatch(rf"{name}\[\d+\]", k)]
+
+
+class MockMoodle:
+    """Estado compartido del servidor: catalogo, inyeccion de fallos y contadores."""
+
+    def __init__(self, args):
+        self.args = args
+        self.base_url = f"http://{args.host}:{args.port}"
+        self.courses, self.contents, self.files, self.activities = build_catalog(
+            self.base_url,
+            args.courses,
+            args.sections,
+            args.modules,
+            args.files_per_module,
+            args.file_size,
+            args.seed,
+            args.summary_size,
+            args.attachments,
+        )
+        self.block = random.Random(args.seed).randbytes(BLOCK_SIZE) * 2
+        self._rng = random.Random(args.seed + 1)
+        self._lock = threading.Lock()
+        self.stats = {"requests": {}, "status": {}, "bytes": {}, "files_served": 0, "max_in_flight": 0}
+        self.in_flight = 0
+
+    def count(self, kind, status, nbytes=0):
+        with self._lock:
+            self.stats["requests"][kind] = self.stats["requests"].get(kind, 0) + 1
+            self.stats["status"][str(status)] = self.stats["status"].get(str(status), 0) + 1
+            self.stats["bytes"][kind] = self.stats["bytes"].get(kind, 0) + nbytes
+            if kind == "file" and status in (200, 206):
+                self.stats["files_served"] += 1
+
+    def enter(self):
+        """Empieza una peticion; ``False`` si ya hay ``--max-in-flight`` en curso (respuesta 503)."""
+        with self._lock:
+            if self.args.max_in_flight and self.in_flight >= self.args.max_in_flight:
+                return False
+            self.in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def injected_failure(self):
+        """Devuelve ``500``, ``429`` o ``None`` segun las tasas configuradas."""
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.args.throttle_rate:
+            return 429
+        if roll < self.args.throttle_rate + self.args.error_rate:
+            return 500
+        return None
+
+    def call(self, function, arguments):
+        if function == "core_webservice_get_site_info":
+            return {
+                "sitename": "Mock Moodle",
+                "username": "benchmark",
+                "userid": USER_ID,
+                "userprivateaccesskey": PRIVATE_ACCESS_KEY,
+                "release": "4.1 (Build: 20221128)",
+                "functions": [],
+            }
+        if function == "core_enrol_get_users_courses":
+            return self.courses
+        if function == "core_course_get_contents":
+            course_id = int(arguments.get("courseid", 0))
+            if course_id not in self.contents:
+                return {"exception": "dml_missing_record_exception", "errorcode": "invalidrecord", "message": "Can't find data record in database table course."}
+            return self.contents[course_id]
+        if function == "mod_assign_get_assignments":
+            courses = [{"id": c, "assignments": self.activities["assignments"].get(c, [])} for c in _ids(arguments, "courseids")]
+            return {"courses": courses, "warnings": []}
+        if function == "mod_forum_get_forums_by_courses":
+            return [forum for c in _ids(arguments, "courseids") for forum in self.activities["forums"].get(c, [])]
+        if function == "mod_forum_get_forum_discussions":
+            return {"discussions": self.activities["discussions"].get(int(arguments.get("forumid", 0)), []), "warnings": []}
+        if function == "core_course_get_updates_since":
+            return {"instances": [], "warnings": []}
+        return {"exception": "dml_missing_record_exception", "errorcode": "invalidrecord", "message": f"Can't find data record in database table external_functions. ({function})"}
+
+    def file_chunks(self, size, offset, start, end):
+        """Genera el contenido ``[start, end)`` de un fichero en bloques de ``WRITE_CHUNK``."""
+        view = memoryview(self.block)
+        pos = start
+        while pos < end:
+            block_pos = (offset + pos) % BLOCK_SIZE
+            n = min(WRITE_CHUNK, end - pos, BLOCK_SIZE * 2 - block_pos)
+            yield view[block_pos:block_pos + n]
+            pos += n
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            if mock.args.verbose:
+                super().log_message(*args)
+
+        def send_body(self, kind, status, body, content_type="application/json", headers=()):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            mock.count(kind, status, len(body))
+
+        def send_json(self, kind, obj):
+            self.send_body(kind, 200, json.dumps(obj).encode("utf-8"))
+
+        def send_failure(self, kind, status):
+            headers = [("Retry-After", str(mock.args.retry_after))] if status in (429, 503) else []
+            self.send_body(kind, status, b"Mock failure", "text/plain", headers)
+
+        def limited(self, handler):
+            if not mock.enter():
+                return self.send_failure("overloaded", 503)
+            try:
+                return handler()
+            finally:
+                mock.leave()
+
+        def do_POST(self):
+            return self.limited(self.handle_post)
+
+        def handle_post(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode("utf-8") if length else ""
+            params = {k: v[-1] for k, v in {**parse_qs(url.query), **parse_qs(body)}.items()}
+            time.sleep(mock.args.latency)
+
+            if url.path == "/login/token.php":
+                return self.send_json("login", {"token": TOKEN, "privatetoken": "mockprivatetoken"})
+            if url.path != "/webservice/rest/server.php":
+                return self.send_body("other", 404, b"Not found", "text/plain")
+
+            function = params.get("wsfunction", "")
+            failure = mock.injected_failure()
+            if failure:
+                return self.send_failure(function, failure)
+            if params.get("wstoken") != TOKEN:
+                return self.send_json(function, {"exception": "moodle_exception", "errorcode": "invalidtoken", "message": "Invalid token - token not found"})
+
+            if function == "tool_mobile_call_external_functions":
+                if mock.args.no_batch:
+                    return self.send_json(function, {"exception": "webservice_access_exception", "errorcode": "accessexception", "message": "Access control exception"})
+                responses = []
+                i = 0
+                while f"requests[{i}][function]" in params:
+                    result = mock.call(params[f"requests[{i}][function]"], json.loads(params.get(f"requests[{i}][arguments]") or "{}"))
+                    if isinstance(result, dict) and "exception" in result:
+                        responses.append({"error": True, "exception": result})
+                    else:
+                        responses.append({"error": False, "data": json.dumps(result)})
+                    i += 1
+                return self.send_json(function, {"responses": responses})
+
+            arguments = {k: v for k, v in params.items() if not k.startswith(("ws", "moodlews"))}
+            return self.send_json(function, mock.call(function, arguments))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/__stats__":
+                body = json.dumps(mock.stats).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            return self.limited(self.handle_get)
+
+        def handle_get(self):
+            url = urlparse(self.path)
+            # /tokenpluginfile.php/<key>/<cmid>/mod_<name>/<area>/<index>/<name>
+            match = re.fullmatch(r"/tokenpluginfile\.php/([^/]+)/(\d+)/mod_\w+/\w+/(\d+)/.+", unquote(url.path))
+            if not match:
+                return self.send_body("file", 404, b"Not found", "text/plain")
+            time.sleep(mock.args.file_latency)
+            failure = mock.injected_failure()
+            if failure:
+                return self.send_failure("file", failure)
+            if match.group(1) != PRIVATE_ACCESS_KEY:
+                return self.send_body("file", 403, b"Forbidden", "text/plain")
+            entry = mock.files.get((int(match.group(2)), int(match.group(3))))
+            if entry is None:
+                return self.send_body("file", 404, b"Not found", "text/plain")
+            size, offset = entry
+
+            start, status = 0, 200
+            range_header = self.headers.get("Range", "")
+            if range_header.startswith("bytes="):
+                start = int(range_header[6:].split("-", 1)[0] or 0)
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    mock.count("file", 416)
+                    return
+                status = 206
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(size - start))
+            self.send_header("Last-Modified", self.date_time_string(1700000000))
+            self.send_header("ETag", '"%s"' % hashlib.sha1(f"{match.group(2)}/{match.group(3)}".encode()).hexdigest())
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+            self.end_headers()
+            sent = 0
+            rate = mock.args.file_rate
+            started = time.perf_counter()
+            try:
+                for chunk in mock.file_chunks(size, offset, start, size):
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    if rate:
+                        delay = sent / rate - (time.perf_counter() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            mock.count("file", status, sent)
+
+    return Handler
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--courses", type=int, default=3, help="Enrolled courses (default: 3)")
+    p.add_argument("--sections", type=int, default=4, help="Sections per course (default: 4)")
+    p.add_argument("--modules", type=int, default=5, help="Resource modules per section (default: 5)")
+    p.add_argument("--files-per-module", type=int, default=1, help="Files per module (default: 1)")
+    p.add_argument(
+        "--file-size",
+        type=parse_size_dist,
+        default=parse_size_dist("lognormal:128K"),
+        help="File size distribution: fixed:N, uniform:A-B or lognormal:MEDIAN (default: lognormal:128K)",
+    )
+    p.add_argument(
+        "--summary-size",
+        type=parse_size,
+        default=0,
+        help="Size of the HTML summary of every section and description of every module, e.g. 64K (default: 0)",
+    )
+    p.add_argument(
+        "--attachments",
+        type=int,
+        default=0,
+        help="Add an assignment with N attachments and a forum with N discussions with an attachment to each course",
+    )
+    p.add_argument("--latency", type=float, default=0.0, help="Delay in seconds for every webservice call")
+    p.add_argument("--file-latency", type=float, default=0.0, help="Delay in seconds before each file response")
+    p.add_argument("--file-rate", type=parse_size, default=0, help="Per-connection file bandwidth, e.g. 2M (0 = unlimited)")
+    p.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    p.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    p.add_argument("--retry-after", type=int, default=0, help="Retry-After seconds sent with 429/503 responses (default: 0)")
+    p.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=0,
+        help="Answer HTTP 503 while this many requests are already being served, like an overloaded site (0 = no limit)",
+    )
+    p.add_argument("--no-batch", action="store_true", help="Reject tool_mobile_call_external_functions like sites without it")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--verbose", action="store_true", help="Log every request")
+    return p.parse_args(argv)
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    mock = MockMoodle(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(mock))
+    server.daemon_threads = True
+    total = sum(size for size, _ in mock.files.values())
+    print(
+        f"Mock Moodle on {mock.base_url}: {len(mock.courses)} courses, {len(mock.files)} files, "
+        f"{total / (1024 * 1024):.1f} MB",
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main_cli()
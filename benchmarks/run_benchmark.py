@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Benchmark de extremo a extremo de ``main.py`` contra ``mock_moodle.py``.
+
+Arranca el servidor de pega, ejecuta un volcado completo de todos los cursos
+(``main.py --all-courses``) en un directorio temporal y muestra:
+
+- ficheros/s y MB/s (bytes de fichero servidos por el mock / tiempo total),
+- peticiones al servidor (webservice y ficheros) y respuestas 429/5xx,
+- pico de memoria residente (RSS) del proceso de ``main.py``.
+
+Las opciones que no reconoce este script se pasan al mock (tamano de los
+cursos, distribucion de tamanos, latencia, tasas de error...); las de
+``main.py`` van en ``--main-args``. Uso::
+
+    python benchmarks/run_benchmark.py --runs 3 --incremental \\
+        --courses 10 --file-size lognormal:256K --latency 0.02 --throttle-rate 0.01 \\
+        --main-args "--jobs 8 --enum-jobs 4"
+"""
+
+import argparse
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MOCK = Path(__file__).resolve().parent / "mock_moodle.py"
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"mock server did not start on {host}:{port}")
+
+
+def fetch_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/__stats__", timeout=10) as response:
+        return json.load(response)
+
+
+def stats_delta(before, after):
+    """Resta dos lecturas de ``/__stats__``."""
+    delta = {
+        group: {k: v - before[group].get(k, 0) for k, v in after[group].items() if v - before[group].get(k, 0)}
+        for group in ("requests", "status", "bytes")
+    }
+    delta["files_served"] = after["files_served"] - before["files_served"]
+    return delta
+
+
+def run_main(workdir, base_url, main_args):
+    """Ejecuta ``main.py`` en ``workdir``; devuelve ``(codigo, segundos, pico_rss_bytes)``."""
+    env = dict(
+        os.environ,
+        MOODLE_SITE=base_url,
+        MOODLE_USERNAME="benchmark",
+        MOODLE_PASSWORD="benchmark",
+        # Keep the session cache of the real user untouched.
+        HOME=str(workdir),
+        USERPROFILE=str(workdir),
+    )
+    command = [sys.executable, str(ROOT / "main.py"), "--all-courses", *main_args]
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        command, cwd=workdir, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    if hasattr(os, "wait4"):
+        # wait4() gives the rusage of this child only (not of the mock server).
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in KiB on Linux and in bytes on macOS.
+        peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    else:
+        proc.wait()
+        peak_rss = None
+    return proc.returncode, time.perf_counter() - started, peak_rss
+
+
+def summarize(name, returncode, seconds, peak_rss, delta, dumps_dir):
+    files_on_disk = [p for p in dumps_dir.rglob("*") if p.is_file() and not p.name.startswith(".manifest")]
+    requests = delta["requests"]
+    file_requests = requests.get("file", 0)
+    files_fetched = delta["files_served"]
+    file_bytes = delta["bytes"].get("file", 0)
+    return {
+        "run": name,
+        "exit_code": returncode,
+        "seconds": round(seconds, 3),
+        "files_fetched": files_fetched,
+        "files_on_disk": len(files_on_disk),
+        "file_mb": round(file_bytes / (1024 * 1024), 2),
+        "files_per_second": round(files_fetched / seconds, 2),
+        "mb_per_second": round(file_bytes / (1024 * 1024) / seconds, 2),
+        "ws_requests": sum(n for kind, n in requests.items() if kind not in ("file", "login")),
+        "login_requests": requests.get("login", 0),
+        "file_requests": file_requests,
+        "throttled_429": delta["status"].get("429", 0),
+        "errors_5xx": sum(n for code, n in delta["status"].items() if code.startswith("5")),
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1) if peak_rss is not None else None,
+        "requests_by_kind": requests,
+    }
+
+
+def print_table(results):
+    columns = [
+        ("run", "run", "{}"),
+        ("s", "seconds", "{:.2f}"),
+        ("files", "files_fetched", "{}"),
+        ("files/s", "files_per_second", "{:.1f}"),
+        ("MB", "file_mb", "{:.1f}"),
+        ("MB/s", "mb_per_second", "{:.2f}"),
+        ("ws req", "ws_requests", "{}"),
+        ("file req", "file_requests", "{}"),
+        ("429", "throttled_429", "{}"),
+        ("5xx", "errors_5xx", "{}"),
+        ("RSS MB", "peak_rss_mb", "{}"),
+        ("exit", "exit_code", "{}"),
+    ]
+    print("".join(f"{title:>10}" for title, _, _ in columns))
+    for result in results:
+        print("".join(f"{fmt.format(result[key]) if result[key] is not None else '-':>10}" for _, key, fmt in columns))
+
+
+def main_cli():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--port", type=int, default=8797)
+    p.add_argument("--runs", type=int, default=1, help="Full dumps to run, each in a fresh directory (default: 1)")
+    p.add_argument("--incremental", action="store_true", help="After each full dump, run again on the same directory")
+    p.add_argument("--main-args", default="", help='Extra arguments for main.py, e.g. "--jobs 8 --dedup"')
+    p.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args, mock_args = p.parse_known_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    mock = subprocess.Popen(
+        [sys.executable, str(MOCK), "--port", str(args.port), *mock_args], stdout=subprocess.PIPE, text=True
+    )
+    results = []
+    try:
+        print(mock.stdout.readline().strip(), file=sys.stderr)
+        wait_for_port("127.0.0.1", args.port)
+        main_args = shlex.split(args.main_args)
+        for run in range(1, args.runs + 1):
+            with tempfile.TemporaryDirectory(prefix="moovidump-bench-") as tmp:
+                workdir = Path(tmp)
+                passes = [f"full#{run}"] + ([f"incr#{run}"] if args.incremental else [])
+                for name in passes:
+                    before = fetch_stats(base_url)
+                    returncode, seconds, peak_rss = run_main(workdir, base_url, main_args)
+                    delta = stats_delta(before, fetch_stats(base_url))
+                    results.append(summarize(name, returncode, seconds, peak_rss, delta, workdir / "dumps"))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main_cli()
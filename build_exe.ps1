@@ -13,6 +13,6 @@ if (Test-Path "dist") { Remove-Item -Recurse -Force "dist" }
 if (Test-Path "$Name.spec") { Remove-Item -Force "$Name.spec" }
 
 Write-Host "[3/3] Building EXE..."
-python -m PyInstaller --noconfirm --onefile --windowed --name $Name --add-data "main.py;." run_gui.py
+python -m PyInstaller --noconfirm --onefile --windowed --name $Name --add-data "main.py;." --add-data "moovidump;moovidump" run_gui.py
 
 Write-Host "Done. EXE generated at dist/$Name.exe"
@@ -0,0 +1,38 @@
+"""MooviDump: descarga los ficheros de los cursos de Moodle via el webservice movil.
+
+Uso como libreria::
+
+    from moovidump import Dumper
+
+    dumper = Dumper("https://moovi.uvigo.gal", "usuario", "contrasena")
+    if dumper.login():
+        dumper.download(dumper.list_courses())
+
+Los submodulos se importan al acceder a sus nombres, de modo que ``import
+moovidump`` no carga ``requests`` hasta que se usa ``Dumper``.
+"""
+
+import importlib
+
+__all__ = ["Dumper", "DownloadManifest", "Layout", "Metrics", "MoodleClient"]
+
+_EXPORTS = {
+    "Dumper": "dumper",
+    "DownloadManifest": "manifest",
+    "Layout": "layout",
+    "Metrics": "metrics",
+    "MoodleClient": "client",
+}
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,159 @@
+"""Adjuntos de tareas y foros, que ``core_course_get_contents`` no incluye.
+
+``core_course_get_contents`` solo lista los ficheros de recursos, carpetas,
+paginas... Los enunciados adjuntos de las tareas y los adjuntos de los debates
+de los foros se piden aparte con las funciones "por cursos" de Moodle, una vez
+por bloque de ``ATTACHMENT_COURSES_PER_CALL`` cursos y no una por modulo:
+
+- ``mod_assign_get_assignments``: ``introattachments`` de cada tarea.
+- ``mod_forum_get_forums_by_courses`` y, por cada foro con debates,
+  ``mod_forum_get_forum_discussions`` (agrupadas como el resto de llamadas):
+  ``attachments`` del primer mensaje de cada debate.
+
+``harvest_attachments`` devuelve los ficheros por curso y ``cmid``, y
+``AttachmentSections`` los anade a los ``contents`` del modulo correspondiente,
+asi que pasan por el mismo plan de rutas, manifiesto y descargas que el resto.
+Solo las secciones con tareas o foros esperan a la recogida; las demas siguen
+en cuanto llegan.
+"""
+
+import logging
+
+from .settings import ATTACHMENT_COURSES_PER_CALL
+
+logger = logging.getLogger(__name__)
+
+# Parte del nombre del debate que se antepone a sus adjuntos (sanitize corta a 80)
+_DISCUSSION_PREFIX_LEN = 40
+# Modulos que pueden recibir adjuntos de ``harvest_attachments``
+_ATTACHMENT_MODULES = ("assign", "forum")
+
+
+def _file_content(entry, prefix=None):
+    """Un fichero de ``external_files`` de Moodle en el formato de ``contents``."""
+    filename = entry.get("filename") or "file"
+    if prefix:
+        filename = f"{prefix[:_DISCUSSION_PREFIX_LEN].strip()} - {filename}"
+    return {
+        "type": "file",
+        "filename": filename,
+        "filepath": entry.get("filepath") or "/",
+        "filesize": entry.get("filesize"),
+        "fileurl": entry.get("fileurl"),
+        "timemodified": entry.get("timemodified"),
+        "mimetype": entry.get("mimetype"),
+    }
+
+
+def harvest_attachments(client, course_ids):
+    """Devuelve ``{course_id: {cmid: [ficheros]}}`` con los adjuntos de tareas y foros.
+
+    Una funcion que el sitio no permite o que falla solo deja sin esos
+    adjuntos (el error ya lo registra ``post_webservice``).
+    """
+    course_ids = list(course_ids)
+    files = {}
+
+    def add(course_id, cmid, entries, prefix=None):
+        try:
+            course_id, cmid = int(course_id), int(cmid)
+        except (TypeError, ValueError):
+            return
+        for entry in entries or []:
+            if isinstance(entry, dict) and entry.get("fileurl") and not entry.get("isexternalfile"):
+                files.setdefault(course_id, {}).setdefault(cmid, []).append(_file_content(entry, prefix))
+
+    chunks = [course_ids[i:i + ATTACHMENT_COURSES_PER_CALL] for i in range(0, len(course_ids), ATTACHMENT_COURSES_PER_CALL)]
+    calls = [
+        (function, {"courseids": chunk})
+        for chunk in chunks
+        for function in ("mod_assign_get_assignments", "mod_forum_get_forums_by_courses")
+    ]
+    forums = []
+    for (function, _), result in zip(calls, client.iter_webservice_calls(calls)):
+        if function == "mod_assign_get_assignments" and isinstance(result, dict):
+            for course in result.get("courses") or []:
+                for assignment in course.get("assignments") or []:
+                    add(course.get("id"), assignment.get("cmid"), assignment.get("introattachments"))
+        elif function == "mod_forum_get_forums_by_courses" and isinstance(result, list):
+            forums.extend(f for f in result if isinstance(f, dict) and f.get("cmid") and f.get("numdiscussions") != 0)
+
+    calls = [("mod_forum_get_forum_discussions", {"forumid": forum["id"]}) for forum in forums]
+    for forum, result in zip(forums, client.iter_webservice_calls(calls)):
+        if not isinstance(result, dict):
+            continue
+        for discussion in result.get("discussions") or []:
+            # Discussions in one forum often share attachment names ("enunciado.pdf").
+            prefix = discussion.get("name") or discussion.get("subject") or str(discussion.get("discussion", ""))
+            add(forum.get("course"), forum["cmid"], discussion.get("attachments"), prefix)
+
+    logger.info(
+        "Assignment and forum attachments: %d file(s) in %d course(s)",
+        sum(len(entries) for modules in files.values() for entries in modules.values()),
+        len(files),
+    )
+    return files
+
+
+def merge_attachments(section, files_by_cmid):
+    """Copia de ``section`` con los adjuntos de cada modulo anadidos a sus ``contents``."""
+    if not files_by_cmid:
+        return section
+    modules = []
+    changed = False
+    for module in section.get("modules") or []:
+        extra = files_by_cmid.get(module.get("id"))
+        if extra:
+            contents = list(module.get("contents") or [])
+            known = {c.get("fileurl") for c in contents}
+            contents.extend(c for c in extra if c["fileurl"] not in known)
+            module = {**module, "contents": contents}
+            changed = True
+        modules.append(module)
+    return {**section, "modules": modules} if changed else section
+
+
+def _has_attachment_modules(section):
+    return any(module.get("modname") in _ATTACHMENT_MODULES for module in section.get("modules") or [])
+
+
+class AttachmentSections:
+    """Envuelve las secciones de un curso (``SectionStream``) anadiendo sus adjuntos.
+
+    ``files_by_cmid`` es una funcion que devuelve los adjuntos del curso
+    (esperando a la recogida) y ``ready`` dice si ya estan. Mientras no lo
+    estan, las secciones sin tareas ni foros pasan tal cual y las demas se
+    guardan para el final: el plan de rutas de una seccion necesita todos sus
+    ficheros a la vez. Asi las descargas del resto del curso no esperan a la
+    recogida, aunque esas secciones llegan despues de las siguientes.
+    """
+
+    def __init__(self, sections, files_by_cmid, ready=lambda: True):
+        self.sections = sections
+        self.files_by_cmid = files_by_cmid
+        self.ready = ready
+
+    @property
+    def failed(self):
+        return self.sections.failed
+
+    def __iter__(self):
+        files = None
+        deferred = []
+        for section in self.sections:
+            if files is None and self.ready():
+                files = self.files_by_cmid()
+            if files is None:
+                if _has_attachment_modules(section):
+                    deferred.append(section)
+                else:
+                    yield section
+                continue
+            for pending in deferred:
+                yield merge_attachments(pending, files)
+            deferred = []
+            yield merge_attachments(section, files)
+        if deferred:
+            files = self.files_by_cmid()
+            for pending in deferred:
+                yield merge_attachments(pending, files)
@@ -0,0 +1,624 @@
+"""Linea de comandos: argumentos, credenciales, seleccion de cursos y tablas.
+
+``rich``, ``dotenv`` y el propio ``Dumper`` (con ``requests``) se importan al
+usarse, de modo que ``--help`` o un error de argumentos responden al momento.
+"""
+
+import argparse
+import getpass
+import json
+import logging
+import os
+from pathlib import Path
+
+from .ratelimit import format_rate, parse_host_rate, parse_rate, parse_rate_window
+from .settings import DOWNLOAD_JOBS, ENUM_JOBS, SESSION_CACHE_FILE, WATCH_INTERVAL, WATCH_JITTER, WATCH_MAX_BACKOFF, WS_BATCH_SIZE
+from .watch import parse_interval, parse_jitter
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="MooviDump Enhanced")
+    p.add_argument("--force", action="store_true", help="Force re-download of files even if present")
+    p.add_argument("--verbose", action="store_true", help="Verbose logging (debug)")
+    p.add_argument("--all-courses", action="store_true", help="Download all visible courses without prompting")
+    p.add_argument(
+        "--courses",
+        type=str,
+        default="",
+        help="Comma-separated list of course indexes/IDs to download without prompting",
+    )
+    p.add_argument(
+        "--jobs",
+        type=int,
+        default=DOWNLOAD_JOBS,
+        help=f"Number of concurrent file downloads (default: {DOWNLOAD_JOBS})",
+    )
+    p.add_argument(
+        "--max-rate",
+        type=parse_rate,
+        default=None,
+        help="Global download bandwidth limit shared by all workers, e.g. 500K or 2M (bytes/s)",
+    )
+    p.add_argument(
+        "--host-rate",
+        type=parse_host_rate,
+        action="append",
+        default=[],
+        metavar="HOST=RATE",
+        help="Bandwidth limit for downloads from one host (repeatable)",
+    )
+    p.add_argument(
+        "--rate-schedule",
+        type=parse_rate_window,
+        action="append",
+        default=[],
+        metavar="HH:MM-HH:MM=RATE",
+        help="Global bandwidth limit during a time-of-day window, overriding --max-rate (repeatable; 0 = unlimited)",
+    )
+    p.add_argument(
+        "--enum-jobs",
+        type=int,
+        default=ENUM_JOBS,
+        help=f"Number of courses whose contents are fetched concurrently (default: {ENUM_JOBS})",
+    )
+    p.add_argument(
+        "--no-session-cache",
+        action="store_true",
+        help=f"Always log in again instead of reusing the token cached in {SESSION_CACHE_FILE}",
+    )
+    p.add_argument(
+        "--full-sync",
+        action="store_true",
+        help="Fetch the contents of every course even if Moodle reports no updates since the last run",
+    )
+    p.add_argument(
+        "--tidy",
+        action="store_true",
+        help="Also collapse single-file folders and remove empty folders left by older runs in the processed courses",
+    )
+    p.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Hardlink identical files (same URL or same content hash) instead of downloading/storing them twice",
+    )
+    p.add_argument(
+        "--ws-batch-size",
+        type=int,
+        default=WS_BATCH_SIZE,
+        help=f"Webservice calls grouped per tool_mobile_call_external_functions request, 1 disables (default: {WS_BATCH_SIZE})",
+    )
+    p.add_argument(
+        "--stream-contents",
+        action="store_true",
+        help="Request each course's contents on its own and decode it section by section: memory stays flat on "
+        "huge courses, but it costs one round trip per course instead of one per --ws-batch-size courses "
+        "(always used when batching is off or the site does not allow it)",
+    )
+    p.add_argument(
+        "--no-attachments",
+        dest="attachments",
+        action="store_false",
+        help="Do not fetch assignment and forum attachments (mod_assign_get_assignments, "
+        "mod_forum_get_forums_by_courses and their discussions), only the files listed by core_course_get_contents",
+    )
+    p.add_argument(
+        "--no-adaptive",
+        dest="adaptive",
+        action="store_false",
+        help="Keep --jobs/--enum-jobs requests in flight even when the server answers 429/503 or slows down, "
+        "instead of adapting the limit (AIMD) and pausing on Retry-After",
+    )
+    p.add_argument(
+        "--dry-run",
+        "--plan",
+        dest="dry_run",
+        action="store_true",
+        help="Enumerate the selected courses and show what would be downloaded (files, bytes, ETA, free space) without downloading",
+    )
+    p.add_argument(
+        "--json",
+        action="store_true",
+        help="With --dry-run, print the plan as JSON on stdout (everything else goes to stderr)",
+    )
+    p.add_argument(
+        "--metrics-json",
+        metavar="PATH",
+        default=None,
+        help="Write a JSON summary of the run (latency per wsfunction, HTTP statuses, retries, throughput, phases)",
+    )
+    p.add_argument(
+        "--prometheus-textfile",
+        metavar="PATH",
+        default=None,
+        help="Write the same metrics in Prometheus text format (for node_exporter's textfile collector)",
+    )
+    p.add_argument(
+        "--profile",
+        nargs="?",
+        const="profile",
+        default=None,
+        metavar="DIR",
+        help="Profile each phase with cProfile and tracemalloc; writes .prof/.txt stats and allocations.txt to DIR "
+        "(default: ./profile) and prints a wall/CPU/peak memory table",
+    )
+    p.add_argument(
+        "--events-file",
+        metavar="PATH",
+        default=None,
+        help="Write structured progress events (file started/finished, bytes, per-course counters) as JSON Lines to PATH",
+    )
+    p.add_argument(
+        "--profiles",
+        metavar="FILE",
+        default=None,
+        help="Run every account/site listed in a JSON profiles file concurrently, sharing the --jobs download budget "
+        "(see moovidump/profiles.py for the format)",
+    )
+    p.add_argument(
+        "--watch",
+        nargs="?",
+        const=WATCH_INTERVAL,
+        type=parse_interval,
+        default=None,
+        metavar="INTERVAL",
+        help="Keep running and sync again every INTERVAL (e.g. 900, 30s, 15m, 1h; default: "
+        f"{WATCH_INTERVAL // 60}m) reusing the same session; only new or changed files are downloaded",
+    )
+    p.add_argument(
+        "--watch-jitter",
+        type=parse_jitter,
+        default=WATCH_JITTER,
+        metavar="FRACTION",
+        help=f"Random variation of the --watch interval, e.g. 0.1 or 10%% (default: {WATCH_JITTER:g})",
+    )
+    p.add_argument(
+        "--watch-max-backoff",
+        type=parse_interval,
+        default=WATCH_MAX_BACKOFF,
+        metavar="INTERVAL",
+        help=f"Longest wait after consecutive failed --watch cycles (default: {WATCH_MAX_BACKOFF // 3600}h)",
+    )
+    p.add_argument(
+        "--watch-summary",
+        metavar="PATH",
+        default=None,
+        help="Append a JSON line with the summary of every --watch cycle to PATH",
+    )
+    p.add_argument(
+        "--watch-cycles",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Stop --watch after N cycles (default: 0 = run until interrupted)",
+    )
+    args = p.parse_args(argv)
+    if args.profiles and (args.profile or args.prometheus_textfile):
+        p.error("--profiles cannot be combined with --profile or --prometheus-textfile")
+    if args.watch and (args.dry_run or args.profiles):
+        p.error("--watch cannot be combined with --dry-run or --profiles")
+    return args
+
+
+def prompt_for_credentials():
+    """Prompt the user for site, username and password and export them to os.environ.
+
+    This helper is used when the user chooses to provide credentials interactively
+    instead of using `.env` or `example.env`.
+    """
+    site = input("MOODLE site URL (e.g. https://moovi.uvigo.gal): ").strip()
+    username = input("MOODLE username: ").strip()
+    password = getpass.getpass("MOODLE password: ")
+    if site:
+        os.environ["MOODLE_SITE"] = site
+    if username:
+        os.environ["MOODLE_USERNAME"] = username
+    if password:
+        os.environ["MOODLE_PASSWORD"] = password
+
+
+def choose_config(console):
+    """Load configuration from environment or prompt the user.
+
+    Behavior:
+    - If `MOODLE_*` variables are already present (e.g. from `.env`), they are used.
+    - If an `example.env` file exists, the user can choose to load it or enter
+      temporary credentials.
+    - Placeholders in `example.env` force an interactive prompt to avoid accidental
+      use of example values.
+    """
+    from dotenv import load_dotenv
+
+    ex = Path("example.env")
+    # Load local .env first (created by setup) so existing credentials are respected
+    load_dotenv()
+    # If all required env vars are already provided, use them (non-interactive/CI)
+    if os.getenv("MOODLE_SITE") and os.getenv("MOODLE_USERNAME") and os.getenv("MOODLE_PASSWORD"):
+        logger.info("Using credentials from environment/.env.")
+        return
+
+    if ex.exists():
+        console.print("Se ha detectado `example.env`. Elige una opción:", style="yellow")
+        console.print("  1) Usar example.env (valores de ejemplo).", style="dim")
+        console.print("  2) Introducir credenciales para acceso temporal (no se guardan).", style="dim")
+        choice = input("Opción [1/2]: ").strip() or "1"
+        if choice == "1":
+            load_dotenv(dotenv_path=ex)
+            # If example.env contains placeholders, force prompt for credentials
+            env_site = os.getenv("MOODLE_SITE", "")
+            env_user = os.getenv("MOODLE_USERNAME", "")
+            env_pass = os.getenv("MOODLE_PASSWORD", "")
+            placeholders = ("PLACEHOLDER", "username", "password", "YOUR_")
+            if (
+                (not env_site)
+                or (not env_user)
+                or (not env_pass)
+                or any(p in env_user.upper() for p in [ph.upper() for ph in placeholders])
+                or any(p in env_pass.upper() for p in [ph.upper() for ph in placeholders])
+            ):
+                console.print("El example.env contiene valores de ejemplo o vacíos. Introduce credenciales reales:", style="red")
+                prompt_for_credentials()
+            else:
+                logger.info("Loaded example.env.")
+        else:
+            prompt_for_credentials()
+    else:
+        logger.info("No example.env found. Enter credentials for temporary access.")
+        prompt_for_credentials()
+
+
+def print_download_plan(plan, console, dedup=False):
+    """Muestra el informe de ``Dumper.plan()`` como tabla."""
+    from rich.table import Table
+
+    table = Table(show_header=True, header_style="bold green", title="Plan de descarga")
+    table.add_column("Course ID", width=10)
+    table.add_column("Name")
+    table.add_column("Files", justify="right")
+    table.add_column("Download", justify="right")
+    table.add_column("MB", justify="right")
+    table.add_column("Skipped", justify="right")
+    if dedup:
+        table.add_column("Dedup", justify="right")
+    for c in plan["courses"]:
+        if c["unchanged"]:
+            row = [str(c["id"]), c["name"], "-", "0", "0.00", "sin cambios"]
+        elif c["failed"] is None:
+            row = [str(c["id"]), c["name"], "-", "-", "-", "error"]
+        else:
+            row = [str(c["id"]), c["name"], str(c["files"]), str(c["download_files"]),
+                   f"{c['download_bytes'] / (1024 * 1024):.2f}", str(c["skipped"])]
+        if dedup:
+            row.append(str(c["deduplicated"]) if not c["unchanged"] and c["failed"] is not None else "-")
+        table.add_row(*row)
+    console.print(table)
+
+    totals, disk = plan["totals"], plan["disk"]
+    console.print(
+        f"Total: {totals['download_files']} de {totals['files']} ficheros, "
+        f"{totals['download_bytes'] / (1024 * 1024):.2f} MB por descargar"
+    )
+    if plan["eta_seconds"] is None:
+        console.print("ETA: desconocida (sin ejecuciones anteriores registradas)")
+    else:
+        eta = int(plan["eta_seconds"])
+        console.print(
+            f"ETA: {eta // 3600:d}h {eta % 3600 // 60:02d}m {eta % 60:02d}s "
+            f"(caudal medido: {format_rate(plan['throughput']['bytes_per_second'])})"
+        )
+    console.print(
+        f"Espacio libre en {disk['path']}: {disk['free_bytes'] / (1024 * 1024):.2f} MB",
+        style=None if disk["fits"] else "bold red",
+    )
+
+
+def parse_course_selection(text, visible_courses, warn=False):
+    """Convierte ``"1,3,1680"`` en IDs de curso.
+
+    Un numero dentro del rango de ``visible_courses`` se toma como su indice
+    (empezando en 1); cualquier otro, como un ID de curso.
+    """
+    selected_set = set()
+    for p in (p.strip() for p in text.split(",")):
+        if not p:
+            continue
+        if p.isdigit():
+            # could be index or id; prefer index if within range
+            idx = int(p)
+            if 1 <= idx <= len(visible_courses):
+                selected_set.add(visible_courses[idx - 1].get("id"))
+            else:
+                selected_set.add(int(p))
+        else:
+            try:
+                selected_set.add(int(p))
+            except ValueError:
+                if warn:
+                    logger.warning("Ignoring invalid course selector: %s", p)
+    return list(selected_set)
+
+
+def print_profile(profiler, console):
+    """Escribe los perfiles de ``--profile`` y muestra la tabla por fase."""
+    from rich.table import Table
+
+    table = Table(show_header=True, header_style="bold green", title="Perfil por fase")
+    table.add_column("Phase")
+    table.add_column("Calls", justify="right")
+    table.add_column("Wall s", justify="right")
+    table.add_column("CPU s", justify="right")
+    table.add_column("Peak MB", justify="right")
+    for name, calls, wall, cpu, peak in profiler.report():
+        table.add_row(name, str(calls), f"{wall:.2f}", f"{cpu:.2f}", "-" if peak is None else f"{peak / (1024 * 1024):.1f}")
+    console.print(table)
+    logger.info("Profiles saved to %s (open the .prof files with pstats or snakeviz)", profiler.out_dir)
+
+
+def write_metrics(args, metrics):
+    """Escribe las metricas pedidas por ``--metrics-json``/``--prometheus-textfile``."""
+    for path, writer in ((args.metrics_json, metrics.write_json), (args.prometheus_textfile, metrics.write_prometheus)):
+        if not path:
+            continue
+        try:
+            writer(path)
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", path, e)
+
+
+def main(argv=None, layout=None):
+    """Punto de entrada de ``python main.py``. Devuelve el codigo de salida.
+
+    ``layout`` (un ``Layout``) permite fijar ``DUMP_ALL``, ``FULL_SANITIZER`` y
+    los alias de curso configurados en ``main.py``.
+    """
+    # Parse CLI args early so verbose affects initial messages
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    if args.verbose:
+        logging.getLogger("moovidump").setLevel(logging.DEBUG)
+
+    from rich.console import Console
+
+    # Con --json, stdout queda reservado para el JSON del plan.
+    console = Console(stderr=args.json)
+
+    if args.profiles:
+        return main_profiles(args, console, layout)
+
+    choose_config(console)
+    site = os.getenv("MOODLE_SITE")
+    if not site:
+        logger.error("Missing MOODLE_SITE in environment.")
+        return 1
+
+    from .dumper import Dumper
+    from .events import EventWriter
+    from .metrics import Metrics, PhaseProfiler
+
+    metrics = Metrics()
+    metrics.gauges["success"] = False
+    if args.profile:
+        metrics.profiler = PhaseProfiler(args.profile)
+    events = EventWriter(args.events_file) if args.events_file else None
+    try:
+        dumper = Dumper(
+            site,
+            os.getenv("MOODLE_USERNAME"),
+            os.getenv("MOODLE_PASSWORD"),
+            jobs=args.jobs,
+            enum_jobs=args.enum_jobs,
+            ws_batch_size=args.ws_batch_size,
+            stream_contents=args.stream_contents,
+            attachments=args.attachments,
+            force=args.force,
+            full_sync=args.full_sync,
+            dedup=args.dedup,
+            tidy=args.tidy,
+            session_cache=not args.no_session_cache,
+            adaptive=args.adaptive,
+            max_rate=args.max_rate,
+            host_rates=args.host_rate,
+            rate_schedule=args.rate_schedule,
+            layout=layout,
+            metrics=metrics,
+            events=events,
+        )
+        return run(args, dumper, console)
+    finally:
+        # Also on early exits (login failure, no space...) so failed runs are visible.
+        if metrics.profiler is not None:
+            print_profile(metrics.profiler, console)
+        write_metrics(args, metrics)
+        if events is not None:
+            events.close()
+
+
+def run(args, dumper, console):
+    from rich.table import Table
+
+    if not dumper.login():
+        return 1
+
+    courses = dumper.list_courses()
+    if not courses:
+        logger.error("No courses found or error fetching courses.")
+        return 1
+
+    logger.info("Found %d course(s)", len(courses))
+
+    # Present courses and ask whether to download all or select specific ones
+    visible_courses = [c for c in courses if not c.get("hidden")]
+    logger.info("Available courses:")
+    table = Table(show_header=True, header_style="bold green")
+    table.add_column("#", width=4)
+    table.add_column("Course ID", width=10)
+    table.add_column("Name")
+    for i, c in enumerate(visible_courses, start=1):
+        full_name = c.get("fullname", "") or ""
+        display = (full_name.split(":", 1)[1].strip() if ":" in full_name else full_name.strip()) or f"course_{c.get('id')}"
+        table.add_row(str(i), str(c.get('id')), display)
+    console.print(table)
+
+    selected_ids = []
+    if args.all_courses:
+        selected_ids = [c.get("id") for c in visible_courses]
+        logger.info("Non-interactive mode: downloading all visible courses.")
+    elif args.courses:
+        selected_ids = parse_course_selection(args.courses, visible_courses, warn=True)
+        logger.info("Non-interactive mode: %d course(s) selected.", len(selected_ids))
+    else:
+        choice = input("\nDescargar todos los cursos? [y/N]: ").strip().lower() or "n"
+        if choice == "y":
+            selected_ids = [c.get("id") for c in visible_courses]
+        else:
+            sel = input("Introduce números (1,2,3) o IDs separados por comas (vacío para cancelar): ").strip()
+            if not sel:
+                console.print("Operación cancelada.", style="yellow")
+                return 0
+            selected_ids = parse_course_selection(sel, visible_courses)
+
+    if not selected_ids:
+        logger.warning("No courses selected. Exiting.")
+        return 0
+
+    # Filter courses to only selected ones
+    courses = [c for c in courses if c.get("id") in selected_ids]
+
+    if args.dry_run:
+        # Same enumeration and skip rules as a real run, but nothing is written.
+        plan = dumper.plan(courses)
+        if args.json:
+            print(json.dumps(plan, ensure_ascii=False, indent=2))
+        else:
+            print_download_plan(plan, console, dedup=dumper.dedup)
+        if not plan["disk"]["fits"]:
+            logger.error("Not enough free space for this download in %s", plan["disk"]["path"])
+            return 1
+        return 0
+
+    if args.watch:
+        return watch(args, dumper, courses, selected_ids)
+
+    stats = dumper.download(courses)
+    return 1 if stats["out_of_space"] else 0
+
+
+def watch(args, dumper, courses, selected_ids):
+    """``--watch``: repite la sincronizacion de los cursos elegidos hasta Ctrl+C/SIGTERM."""
+    import signal
+    import threading
+
+    from .watch import Watcher, format_delay
+
+    def select_courses(current):
+        # --all-courses also picks up courses enrolled after startup.
+        if args.all_courses:
+            return [c for c in current if not c.get("hidden")]
+        return [c for c in current if c.get("id") in selected_ids]
+
+    watcher = Watcher(
+        dumper,
+        select_courses,
+        args.watch,
+        jitter=args.watch_jitter,
+        max_backoff=args.watch_max_backoff,
+        max_cycles=args.watch_cycles,
+        summary_path=args.watch_summary,
+        on_cycle=lambda summary: write_metrics(args, dumper.metrics),
+    )
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    logger.info("Watch mode: syncing every %s (Ctrl+C to exit)", format_delay(args.watch))
+    try:
+        return watcher.run(courses)
+    except KeyboardInterrupt:
+        logger.info("Watch mode stopped.")
+        return 0
+
+
+def main_profiles(args, console, layout=None):
+    """``--profiles``: ejecuta todos los perfiles del fichero y muestra un resumen por perfil."""
+    from rich.table import Table
+
+    from .events import EventWriter
+    from .profiles import ProfileError, load_profiles, run_profiles
+
+    defaults = {
+        "jobs": args.jobs,
+        "enum_jobs": args.enum_jobs,
+        "ws_batch_size": args.ws_batch_size,
+        "stream_contents": args.stream_contents,
+        "attachments": args.attachments,
+        "force": args.force,
+        "full_sync": args.full_sync,
+        "tidy": args.tidy,
+        "dedup": args.dedup,
+        "session_cache": not args.no_session_cache,
+        "adaptive": args.adaptive,
+        "max_rate": args.max_rate,
+        "host_rates": args.host_rate,
+        "rate_schedule": args.rate_schedule,
+    }
+    if layout is not None:
+        defaults.update(dump_all=layout.dump_all, full_sanitizer=layout.full_sanitizer, course_aliases=layout.aliases)
+    try:
+        options, profiles = load_profiles(args.profiles, defaults)
+    except ProfileError as e:
+        logger.error("%s", e)
+        return 2
+
+    events = EventWriter(args.events_file) if args.events_file else None
+    try:
+        results = run_profiles(options, profiles, dry_run=args.dry_run, events=events)
+    finally:
+        if events is not None:
+            events.close()
+    for result in results:
+        result["metrics"].gauges.setdefault("success", result["ok"])
+    if args.metrics_json:
+        try:
+            path = Path(args.metrics_json)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            summaries = {r["name"]: r["metrics"].summary() for r in results}
+            path.write_text(json.dumps({"profiles": summaries}, indent=2, ensure_ascii=False), encoding="utf-8")
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", args.metrics_json, e)
+
+    if args.dry_run:
+        if args.json:
+            print(json.dumps({r["name"]: r.get("plan") for r in results}, ensure_ascii=False, indent=2))
+        else:
+            for result in results:
+                console.print(f"Perfil: {result['name']}", style="bold")
+                if result.get("plan"):
+                    print_download_plan(result["plan"], console, dedup=options.get("dedup", False))
+                else:
+                    console.print(f"Error: {result['error']}", style="bold red")
+        return 0 if all(r["ok"] for r in results) else 1
+
+    table = Table(show_header=True, header_style="bold green", title="Resumen por perfil")
+    table.add_column("Profile")
+    table.add_column("Downloaded", justify="right")
+    table.add_column("Skipped", justify="right")
+    table.add_column("Failed", justify="right")
+    table.add_column("Dedup", justify="right")
+    table.add_column("MB", justify="right")
+    table.add_column("Status")
+    for result in results:
+        stats = result.get("stats")
+        if stats is None:
+            table.add_row(result["name"], "-", "-", "-", "-", "-", f"error: {result['error']}")
+            continue
+        status = "sin espacio" if stats["out_of_space"] else "ok"
+        table.add_row(
+            result["name"],
+            str(stats["downloaded"]),
+            str(stats["skipped"]),
+            str(stats["failed"]),
+            str(stats["deduplicated"]),
+            f"{stats['bytes_downloaded'] / (1024 * 1024):.2f}",
+            status,
+        )
+    console.print(table)
+    return 0 if all(r["ok"] for r in results) else 1
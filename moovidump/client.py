@@ -0,0 +1,604 @@
+"""Cliente del webservice de Moodle: login, llamadas REST y llamadas agrupadas."""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .congestion import AdaptiveAdapter, AdaptiveRetry, ConcurrencyController
+from .jsonstream import JSONArrayExpected, iter_json_array
+from .metrics import Metrics
+from .sessions import clear_cached_session, save_cached_session
+from .settings import (
+    CONTENTS_STREAM_QUEUE,
+    CONTENTS_STREAM_STALL,
+    DOWNLOAD_CHUNK_SIZE,
+    ENUM_JOBS,
+    FULL_SYNC_INTERVAL,
+    HEADERS,
+    RETRIES,
+    SYNC_CLOCK_SKEW,
+    TIMEOUT,
+    WS_BATCH_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def build_session(pool_size=10, controller=None):
+    """Crea la sesion HTTP con reintentos.
+
+    El pool de conexiones se dimensiona para los workers de descarga y de
+    enumeracion, de modo que las descargas concurrentes reutilizan conexiones
+    en vez de descartarlas cuando el pool esta lleno. Con ``controller``
+    (``ConcurrencyController``) las peticiones en curso se adaptan a la carga
+    del servidor.
+    """
+    session = requests.Session()
+    retry_options = dict(total=RETRIES, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["HEAD", "GET", "OPTIONS", "POST"])
+    if controller is not None:
+        adapter = AdaptiveAdapter(controller, max_retries=AdaptiveRetry(controller=controller, **retry_options), pool_maxsize=max(pool_size, 10))
+    else:
+        adapter = HTTPAdapter(max_retries=Retry(**retry_options), pool_maxsize=max(pool_size, 10))  # type: ignore
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+def flatten_ws_arguments(arguments, prefix=""):
+    """Convierte listas/dicts anidados al formato REST de Moodle (``ids[0]``, ``opts[0][name]``)."""
+    flat = {}
+    items = enumerate(arguments) if isinstance(arguments, (list, tuple)) else arguments.items()
+    for key, value in items:
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if isinstance(value, (list, tuple, dict)):
+            flat.update(flatten_ws_arguments(value, name))
+        else:
+            flat[name] = value
+    return flat
+
+
+def _is_invalid_token(data):
+    return isinstance(data, dict) and data.get("errorcode") == "invalidtoken"
+
+
+class WebserviceError(Exception):
+    """Una llamada en streaming fallo; el motivo ya esta en el log."""
+
+
+_END = object()
+
+
+class SectionStream:
+    """Secciones de un curso a medida que llegan (ver ``stream_course_contents``).
+
+    Se recorre una sola vez. Al terminar, ``failed`` indica si la respuesta
+    fallo o llego cortada; en ese caso las secciones generadas son solo una
+    parte del curso. ``close()`` descarta el resto y libera la conexion.
+
+    Como mucho ``maxsize`` secciones esperan al consumidor; si este no saca
+    ninguna en ``CONTENTS_STREAM_STALL`` segundos, el resto del curso se guarda
+    en memoria (``spilled``) para terminar de leer la respuesta en vez de tener
+    la conexion abierta hasta que el servidor la corte a medias.
+    """
+
+    def __init__(self, course_id, maxsize=CONTENTS_STREAM_QUEUE):
+        self.course_id = course_id
+        self.maxsize = maxsize
+        self.failed = False
+        self.closed = False
+        self.spilled = False
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_contents(cls, course_id, contents):
+        """Envuelve un ``contents`` ya decodificado (``None`` = llamada fallida)."""
+        stream = cls(course_id, maxsize=0)
+        for section in contents or []:
+            stream.put(section)
+        stream.finish(failed=contents is None)
+        return stream
+
+    def put(self, section):
+        """Encola una seccion; ``False`` si el consumidor ya cerro el stream."""
+        with self._cond:
+            deadline = time.monotonic() + CONTENTS_STREAM_STALL
+            while self.maxsize and len(self._items) >= self.maxsize and not self.spilled and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.spilled = True
+                    logger.debug("Course %s: contents consumer stalled; buffering the rest of the response", self.course_id)
+                    break
+                self._cond.wait(remaining)
+            if self.closed:
+                return False
+            self._items.append(section)
+            self._cond.notify_all()
+            return True
+
+    def finish(self, failed=False):
+        self.failed = failed
+        self.put(_END)
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._items.clear()
+            self._cond.notify_all()
+
+    def __iter__(self):
+        while True:
+            with self._cond:
+                while not self._items and not self.closed:
+                    self._cond.wait()
+                if self.closed:
+                    return
+                section = self._items.popleft()
+                self._cond.notify_all()
+            if section is _END:
+                return
+            yield section
+
+
+class MoodleClient:
+    """Sesion con el webservice movil de un sitio Moodle.
+
+    Guarda el token y los datos del usuario (``user_id``,
+    ``private_access_key``) y hace las llamadas al webservice, agrupandolas con
+    ``tool_mobile_call_external_functions`` cuando el sitio lo permite. Es
+    seguro usarlo desde varios hilos: si el token caduca, el primer hilo que lo
+    detecta vuelve a iniciar sesion y el resto reutiliza el token nuevo.
+    """
+
+    def __init__(
+        self,
+        site,
+        username=None,
+        password=None,
+        pool_size=10,
+        ws_batch_size=WS_BATCH_SIZE,
+        enum_jobs=ENUM_JOBS,
+        use_session_cache=True,
+        metrics=None,
+        adaptive=True,
+    ):
+        self.site = site.rstrip("/")
+        self.webservice_url = f"{self.site}/webservice/rest/server.php"
+        self.username = username
+        self.password = password
+        self.ws_batch_size = max(1, int(ws_batch_size or 1))
+        self.enum_jobs = max(1, int(enum_jobs or 1))
+        self.use_session_cache = use_session_cache
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.token = None
+        self.private_token = None
+        self.user_id = None
+        self.private_access_key = None
+        # Se desactiva si el sitio no permite tool_mobile_call_external_functions
+        self.mobile_batch_available = True
+        # Serializa la renovacion del token cuando varios hilos detectan que ha caducado
+        self._session_lock = threading.Lock()
+        # Limite adaptativo de peticiones en curso (None = siempre pool_size)
+        self.concurrency = ConcurrencyController(pool_size, metrics=self.metrics) if adaptive else None
+        self.session = build_session(pool_size, self.concurrency)
+        self.session.hooks["response"].append(self.metrics.observe_response)
+
+    def session_data(self):
+        """Token y datos del usuario, en el formato de la cache de sesiones."""
+        return {
+            "token": self.token,
+            "privatetoken": self.private_token,
+            "userid": self.user_id,
+            "userprivateaccesskey": self.private_access_key,
+        }
+
+    def restore_session(self, data):
+        """Reutiliza una sesion guardada (``load_cached_session``); el token se valida en la primera llamada."""
+        self.token = data["token"]
+        self.private_token = data.get("privatetoken")
+        self.user_id = data["userid"]
+        self.private_access_key = data.get("userprivateaccesskey")
+
+    def login(self, username, password):
+        logger.info("Attempting login to %s...", self.site)
+        try:
+            response = self.session.post(
+                f"{self.site}/login/token.php?lang=en",
+                data={"username": username, "password": password, "service": "moodle_mobile_app"},
+                timeout=TIMEOUT,
+            )
+
+            if response.status_code == 200:
+                try:
+                    data = response.json()
+                except json.JSONDecodeError:
+                    logger.error("Login: invalid JSON response")
+                    return False
+
+                # Check for Moodle error responses
+                if "error" in data:
+                    logger.error("Login error: %s", data.get('error', 'Unknown error'))
+                    if "errorcode" in data:
+                        logger.debug("Error code: %s", data['errorcode'])
+                    if "stacktrace" in data:
+                        logger.debug("Details: %s", data.get('message', ''))
+                    return False
+
+                self.token = data.get("token")
+                self.private_token = data.get("privatetoken")
+
+                if not self.token:
+                    logger.error("No token received from server")
+                    logger.debug("Response data: %s", json.dumps(data, indent=2))
+                    return False
+
+                logger.info("Token received: %s...", self.token[:20])
+                return True
+            else:
+                logger.error("HTTP error %s: %s", response.status_code, response.text)
+                return False
+        except requests.exceptions.Timeout:
+            logger.error("Connection timeout. Check your internet connection and MOODLE_SITE URL.")
+            return False
+        except requests.exceptions.ConnectionError:
+            logger.error("Cannot connect to %s. Check the URL in your .env file.", self.site)
+            return False
+        except Exception as e:
+            logger.exception("Unexpected error during login: %s", e)
+            return False
+
+    def post_webservice(self, function, arguments=None, retry_auth=True):
+        params = {"moodlewsrestformat": "json", "wsfunction": function, "wstoken": self.token}
+
+        if arguments:
+            params.update(flatten_ws_arguments(arguments))
+
+        try:
+            response = self.session.post(
+                self.webservice_url,
+                params=params,
+                data={"moodlewssettingfilter": "true", "moodlewssettingfileurl": "true", "moodlewssettinglang": "en"},
+                timeout=TIMEOUT,
+            )
+
+            if response.status_code == 200:
+                try:
+                    data = response.json()
+                except json.JSONDecodeError:
+                    logger.error("Invalid JSON from webservice %s", function)
+                    return None
+
+                # A cached or expired token: log in again once and repeat the call
+                if retry_auth and _is_invalid_token(data) and self.refresh_session(params["wstoken"]):
+                    return self.post_webservice(function, arguments, retry_auth=False)
+
+                # Check for Moodle error in response
+                if isinstance(data, dict) and "exception" in data:
+                    logger.error("API Error calling %s: %s", function, data.get('exception', 'Unknown'))
+                    logger.debug("API message: %s", data.get('message', 'No message'))
+                    if "errorcode" in data:
+                        logger.debug("Error code: %s", data['errorcode'])
+                    return None
+
+                return data
+            else:
+                logger.error("HTTP %s calling %s: %s", response.status_code, function, response.text[:200])
+                return None
+        except requests.exceptions.Timeout:
+            logger.error("Timeout calling %s", function)
+            return None
+        except Exception as e:
+            logger.exception("Error calling %s: %s", function, e)
+            return None
+
+    def iter_webservice_list(self, function, arguments=None, retry_auth=True):
+        """Como ``post_webservice`` para funciones que devuelven una lista.
+
+        Lee la respuesta en streaming y genera cada elemento en cuanto llega
+        completo, sin tener el cuerpo entero en memoria. Los errores (HTTP,
+        excepcion de Moodle, JSON cortado) se registran como en
+        ``post_webservice`` y terminan con ``WebserviceError``.
+        """
+        params = {"moodlewsrestformat": "json", "wsfunction": function, "wstoken": self.token}
+        if arguments:
+            params.update(flatten_ws_arguments(arguments))
+
+        try:
+            response = self.session.post(
+                self.webservice_url,
+                params=params,
+                data={"moodlewssettingfilter": "true", "moodlewssettingfileurl": "true", "moodlewssettinglang": "en"},
+                timeout=TIMEOUT,
+                stream=True,
+            )
+        except requests.exceptions.Timeout:
+            logger.error("Timeout calling %s", function)
+            raise WebserviceError(function)
+        except requests.exceptions.RequestException as e:
+            logger.error("Error calling %s: %s", function, e)
+            raise WebserviceError(function)
+
+        with response:
+            if response.status_code != 200:
+                logger.error("HTTP %s calling %s: %s", response.status_code, function, response.text[:200])
+                raise WebserviceError(function)
+            try:
+                yield from iter_json_array(response.iter_content(DOWNLOAD_CHUNK_SIZE))
+                return
+            except JSONArrayExpected as e:
+                data = e.value
+            except (ValueError, requests.exceptions.RequestException) as e:
+                logger.error("Invalid or truncated JSON from webservice %s: %s", function, e)
+                raise WebserviceError(function)
+
+        # A cached or expired token: log in again once and repeat the call
+        if retry_auth and _is_invalid_token(data) and self.refresh_session(params["wstoken"]):
+            yield from self.iter_webservice_list(function, arguments, retry_auth=False)
+            return
+        if isinstance(data, dict) and "exception" in data:
+            logger.error("API Error calling %s: %s", function, data.get('exception', 'Unknown'))
+            logger.debug("API message: %s", data.get('message', 'No message'))
+            if "errorcode" in data:
+                logger.debug("Error code: %s", data['errorcode'])
+        else:
+            logger.error("Unexpected response from webservice %s", function)
+        raise WebserviceError(function)
+
+    def get_site_info(self, retry_auth=True):
+        return self.post_webservice("core_webservice_get_site_info", retry_auth=retry_auth)
+
+    def start_session(self):
+        """Inicia sesion con ``username``/``password`` y carga los datos del usuario.
+
+        Obtiene un token con ``login()``, lee ``userid`` y ``userprivateaccesskey``
+        de ``core_webservice_get_site_info`` y guarda todo en la cache de sesiones.
+        Devuelve ``True`` si la sesion queda lista para usarse.
+        """
+        if not (self.username and self.password):
+            logger.error("Missing MOODLE_USERNAME or MOODLE_PASSWORD. Set them in .env.")
+            return False
+        with self.metrics.phase("login"):
+            logged_in = self.login(self.username, self.password)
+        if not logged_in:
+            logger.error("login failed")
+            return False
+        logger.info("login successful")
+
+        logger.info("Fetching site info...")
+        with self.metrics.phase("site_info"):
+            site_info = self.get_site_info(retry_auth=False)
+
+        if site_info is None:
+            logger.error("Failed to fetch site info. Check your credentials and permissions.")
+            return False
+
+        if not site_info.get("userid"):
+            logger.error("No user ID in site info")
+            logger.debug("Site info: %s", json.dumps(site_info, indent=2))
+            return False
+
+        self.user_id = site_info.get("userid")
+        self.private_access_key = site_info.get("userprivateaccesskey")
+        if self.use_session_cache:
+            save_cached_session(self.site, self.username, self.session_data())
+        return True
+
+    def refresh_session(self, stale_token):
+        """Renueva la sesion despues de que el servidor rechace ``stale_token``.
+
+        Si otro hilo ya la renovo, no vuelve a iniciar sesion. Devuelve ``True``
+        si hay un token nuevo con el que reintentar la llamada.
+        """
+        with self._session_lock:
+            if self.token != stale_token:
+                return self.token is not None
+            logger.warning("The server rejected the session token; logging in again")
+            clear_cached_session(self.site, self.username)
+            return self.start_session()
+
+    def call_moodle_mobile_functions(self, requests_list, retry_auth=True):
+        """Ejecuta varias funciones del webservice en una sola peticion HTTP.
+
+        Devuelve el JSON de ``tool_mobile_call_external_functions`` (con la lista
+        ``responses``) o ``None`` si la peticion o el propio plugin fallan.
+        """
+        data = {
+            "moodlewsrestformat": "json",
+            "wsfunction": "tool_mobile_call_external_functions",
+            "wstoken": self.token,
+            "moodlewssettinglang": "en",
+        }
+
+        for i, req in enumerate(requests_list):
+            data[f"requests[{i}][function]"] = req["function"]
+            data[f"requests[{i}][arguments]"] = json.dumps(req.get("arguments", {}))
+            data[f"requests[{i}][settingfilter]"] = str(req.get("settingfilter", 1))
+            data[f"requests[{i}][settingfileurl]"] = str(req.get("settingfileurl", 1))
+
+        try:
+            response = self.session.post(self.webservice_url, data=data, timeout=TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error calling tool_mobile_call_external_functions: %s", e)
+            return None
+
+        if response.status_code != 200:
+            logger.warning("HTTP %s calling tool_mobile_call_external_functions", response.status_code)
+            return None
+
+        try:
+            result = response.json()
+        except json.JSONDecodeError:
+            logger.error("Invalid JSON from tool_mobile_call_external_functions")
+            return None
+
+        if retry_auth and _is_invalid_token(result) and self.refresh_session(data["wstoken"]):
+            return self.call_moodle_mobile_functions(requests_list, retry_auth=False)
+
+        if isinstance(result, dict) and "exception" in result:
+            logger.warning(
+                "tool_mobile_call_external_functions unavailable: %s (%s)",
+                result.get("errorcode", result.get("exception")),
+                result.get("message", ""),
+            )
+            return None
+        if not isinstance(result, dict) or len(result.get("responses") or []) != len(requests_list):
+            logger.warning("Unexpected response from tool_mobile_call_external_functions")
+            return None
+        return result
+
+    def post_webservice_batch(self, calls, batch_size=None):
+        """Ejecuta una lista de llamadas ``(function, arguments)`` agrupandolas.
+
+        Las llamadas se envian en bloques de ``batch_size`` mediante
+        ``tool_mobile_call_external_functions``. Si el plugin no esta disponible, o
+        una subllamada devuelve error, esa llamada se repite individualmente con
+        ``post_webservice`` para conservar su manejo de errores. Devuelve la lista
+        de resultados en el mismo orden que ``calls`` (``None`` en los fallos).
+        """
+        calls = list(calls)
+        size = max(1, batch_size or self.ws_batch_size)
+        results = []
+
+        for start in range(0, len(calls), size):
+            chunk = calls[start:start + size]
+            if len(chunk) == 1 or size == 1 or not self.mobile_batch_available:
+                results.extend(self.post_webservice(function, arguments) for function, arguments in chunk)
+                continue
+
+            batch = self.call_moodle_mobile_functions(
+                [{"function": function, "arguments": arguments or {}} for function, arguments in chunk]
+            )
+            if batch is None:
+                logger.info("Batched webservice calls disabled; falling back to individual requests")
+                self.mobile_batch_available = False
+                results.extend(self.post_webservice(function, arguments) for function, arguments in chunk)
+                continue
+
+            logger.debug("Batched %d webservice call(s) in one request", len(chunk))
+            for (function, arguments), sub in zip(chunk, batch["responses"]):
+                data = None
+                if isinstance(sub, dict) and not sub.get("error"):
+                    try:
+                        data = json.loads(sub.get("data") or "null")
+                    except (TypeError, json.JSONDecodeError):
+                        data = None
+                if data is None or (isinstance(data, dict) and "exception" in data):
+                    logger.debug("Batched call %s failed; retrying individually", function)
+                    data = self.post_webservice(function, arguments)
+                results.append(data)
+
+        return results
+
+    def iter_webservice_calls(self, calls, max_workers=None):
+        """Ejecuta ``calls`` (``(function, arguments)``) en bloques pedidos en paralelo.
+
+        Las llamadas se agrupan en bloques de ``ws_batch_size`` (ver
+        ``post_webservice_batch``) y hasta ``max_workers`` bloques se piden a la
+        vez. Genera los resultados en el mismo orden que ``calls`` en cuanto cada
+        bloque esta disponible (``None`` en las llamadas que fallaron).
+        """
+        calls = list(calls)
+        if not calls:
+            return
+
+        size = self.ws_batch_size
+        chunks = [calls[i:i + size] for i in range(0, len(calls), size)]
+        workers = max(1, min(max_workers or self.enum_jobs, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enumerate") as pool:
+            batch = self.metrics.profiled("enumerate_workers", self.post_webservice_batch)
+            futures = [pool.submit(batch, chunk) for chunk in chunks]
+            for future in futures:
+                yield from future.result()
+
+    def fetch_course_contents(self, course_ids, max_workers=None):
+        """Pide ``core_course_get_contents`` de varios cursos en paralelo.
+
+        Genera tuplas ``(course_id, contents)`` en el mismo orden que ``course_ids``
+        en cuanto cada curso esta disponible, de modo que el curso N puede empezar a
+        procesarse mientras los siguientes aun se estan descargando. ``contents`` es
+        ``None`` si la llamada fallo (el error ya lo registra ``post_webservice``).
+        """
+        course_ids = list(course_ids)
+        calls = [("core_course_get_contents", {"courseid": cid}) for cid in course_ids]
+        yield from zip(course_ids, self.iter_webservice_calls(calls, max_workers))
+
+    def stream_course_contents(self, course_ids, max_workers=None):
+        """Como ``fetch_course_contents``, pero genera ``(course_id, SectionStream)``.
+
+        Cada curso se pide aparte (hasta ``max_workers`` a la vez) y su respuesta
+        se decodifica en streaming, de modo que las primeras secciones se pueden
+        procesar antes de que llegue el resto. Cada curso tiene como mucho
+        ``CONTENTS_STREAM_QUEUE`` secciones leidas por delante del consumidor (salvo
+        si este se atasca, ver ``SectionStream``), asi que la memoria no crece con
+        el tamano del curso.
+        """
+        course_ids = list(course_ids)
+        if not course_ids:
+            return
+        streams = [SectionStream(course_id) for course_id in course_ids]
+        workers = max(1, min(max_workers or self.enum_jobs, len(streams)))
+        fill = self.metrics.profiled("enumerate_workers", self._fill_section_stream)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enumerate") as pool:
+            for stream in streams:
+                pool.submit(fill, stream)
+            try:
+                for stream in streams:
+                    yield stream.course_id, stream
+            finally:
+                # The consumer may stop early (e.g. out of space): release the workers.
+                for stream in streams:
+                    stream.close()
+
+    def _fill_section_stream(self, stream):
+        if stream.closed:
+            return
+        failed = True
+        sections = self.iter_webservice_list("core_course_get_contents", {"courseid": stream.course_id})
+        try:
+            for section in sections:
+                if not stream.put(section):
+                    return
+            failed = False
+        except WebserviceError:
+            pass
+        except Exception as e:
+            logger.exception("Error reading contents of course %s: %s", stream.course_id, e)
+        finally:
+            sections.close()
+            # Always end the stream, so the consumer never waits for a dead worker.
+            stream.finish(failed=failed)
+
+    def find_unchanged_courses(self, course_ids, sync_state, now=None):
+        """Devuelve los cursos sin cambios desde su ultima sincronizacion.
+
+        Para cada curso con una sincronizacion previa se pregunta a Moodle con
+        ``core_course_get_updates_since``; si no hay instancias actualizadas no hace
+        falta volver a pedir ``core_course_get_contents``. Si la API no esta
+        disponible (o falla) el curso se considera modificado, igual que cuando su
+        ultima enumeracion completa tiene mas de ``FULL_SYNC_INTERVAL`` segundos.
+        """
+        now = int(now or time.time())
+        candidates = []
+        for course_id in course_ids:
+            state = sync_state.get(course_id)
+            if state is None or now - state[1] > FULL_SYNC_INTERVAL:
+                continue
+            candidates.append((course_id, state[0]))
+
+        calls = [
+            ("core_course_get_updates_since", {"courseid": course_id, "since": max(0, last_sync - SYNC_CLOCK_SKEW)})
+            for course_id, last_sync in candidates
+        ]
+        unchanged = set()
+        for (course_id, _), result in zip(candidates, self.iter_webservice_calls(calls)):
+            if isinstance(result, dict) and isinstance(result.get("instances"), list) and not result["instances"]:
+                unchanged.add(course_id)
+        return unchanged
@@ -0,0 +1,256 @@
+"""Control adaptativo de las peticiones simultaneas a un sitio (AIMD).
+
+``--jobs`` y ``--enum-jobs`` fijan cuantos hilos pueden hacer peticiones;
+``ConcurrencyController`` decide cuantas de ellas estan en curso a la vez
+(llamadas al webservice y descargas, que ocupan su hueco hasta leer el
+ultimo byte):
+
+- Empieza con todos los hilos y, mientras el servidor va bien, el limite crece
+  en uno tras ``limite`` respuestas seguidas sin problemas y como pronto cada
+  ``CONCURRENCY_GROW_INTERVAL`` segundos (aumento aditivo). Va bien si la
+  latencia hasta las cabeceras no pasa de ``CONCURRENCY_LATENCY_FACTOR`` veces
+  la minima observada y la tasa de errores (5xx, timeouts, conexiones
+  cortadas) no pasa de ``CONCURRENCY_MAX_ERROR_RATE``.
+- Un 429 o 503 multiplica el limite por ``CONCURRENCY_DECREASE`` (una vez por
+  episodio: las respuestas de las peticiones que ya estaban en curso no
+  vuelven a recortarlo) y, si trae ``Retry-After``, ninguna peticion nueva
+  sale hasta que pase ese tiempo.
+
+``AdaptiveRetry`` (los 429/503 y errores que reintenta urllib3) y
+``AdaptiveAdapter`` (el hueco de cada peticion y su respuesta final) conectan
+el controlador con la sesion de ``requests``.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .settings import (
+    CONCURRENCY_DECREASE,
+    CONCURRENCY_GROW_INTERVAL,
+    CONCURRENCY_LATENCY_FACTOR,
+    CONCURRENCY_MAX_ERROR_RATE,
+    CONCURRENCY_MAX_PAUSE,
+    CONCURRENCY_MIN,
+)
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_STATUSES = (429, 503)
+# Latencias por debajo de esto son ruido (servidor local, respuestas en cache)
+_LATENCY_FLOOR = 0.05
+# Peso de cada respuesta en las medias moviles de latencia y errores
+_SMOOTHING = 0.1
+
+
+def parse_retry_after(value):
+    """Segundos de una cabecera ``Retry-After`` (numero o fecha HTTP); ``None`` si no vale."""
+    if not value:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def request_kind(url):
+    """``webservice`` o ``download``: cada tipo tiene su propia latencia de referencia."""
+    return "webservice" if "/webservice/" in url or "/login/" in url else "download"
+
+
+class ConcurrencyController:
+    """Limite AIMD de peticiones en curso, compartido por todos los hilos de una sesion.
+
+    ``slot()`` reserva un hueco (esperando si no hay o si el servidor pidio una
+    pausa); es reentrante, asi que una descarga puede reservarlo para todo el
+    fichero y las peticiones que haga dentro no piden otro. ``limit`` es el
+    limite vigente y ``lowest`` el minimo alcanzado desde el ultimo ``report``.
+    """
+
+    def __init__(self, maximum, minimum=CONCURRENCY_MIN, metrics=None):
+        self.maximum = max(1, int(maximum))
+        self.minimum = max(1, min(int(minimum), self.maximum))
+        self.metrics = metrics
+        self.in_flight = 0
+        self.lowest = self.maximum
+        self.throttled = 0
+        self.paused = 0.0
+        self.limit = self.maximum
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._paused_until = 0.0
+        self._last_cut = 0.0
+        self._last_change = 0.0
+        self._healthy = 0
+        self._baseline = {}
+        self._latency = {}
+        self._errors = 0.0
+
+    @contextmanager
+    def slot(self):
+        if getattr(self._local, "held", False):
+            yield
+            return
+        with self._cond:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.limit:
+                    break
+                self._cond.wait(wait if wait > 0 else None)
+            self.in_flight += 1
+        self._local.held = True
+        try:
+            yield
+        finally:
+            self._local.held = False
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def observe(self, status, seconds=None, kind="webservice", retry_after=None):
+        """Registra una respuesta; ``seconds`` es su latencia (``None`` si hubo reintentos)."""
+        if status in OVERLOAD_STATUSES:
+            self.overloaded(status, retry_after)
+            return
+        if status >= 500:
+            self.failed()
+            return
+        now = time.monotonic()
+        with self._cond:
+            self._errors *= 1 - _SMOOTHING
+            if seconds is not None:
+                baseline = max(_LATENCY_FLOOR, min(self._baseline.get(kind, seconds), seconds))
+                self._baseline[kind] = baseline
+                latency = self._latency.get(kind, seconds)
+                self._latency[kind] = latency = latency + _SMOOTHING * (seconds - latency)
+                if latency > baseline * CONCURRENCY_LATENCY_FACTOR:
+                    self._healthy = 0
+                    return
+            if self._errors > CONCURRENCY_MAX_ERROR_RATE or self.limit >= self.maximum:
+                self._healthy = 0
+                return
+            self._healthy += 1
+            if self._healthy < self.limit or now - self._last_change < CONCURRENCY_GROW_INTERVAL:
+                return
+            old = self.limit
+            self.limit += 1
+            self._healthy = 0
+            self._last_change = now
+            self._cond.notify_all()
+        logger.info("Concurrent requests: %d -> %d", old, self.limit)
+
+    def failed(self):
+        """Un error de red o un 5xx que no es de saturacion: el limite deja de crecer un tiempo."""
+        with self._cond:
+            self._errors = self._errors * (1 - _SMOOTHING) + _SMOOTHING
+
+    def overloaded(self, status, retry_after=None):
+        """429/503: recorta el limite y respeta ``Retry-After`` para todas las peticiones nuevas."""
+        now = time.monotonic()
+        pause = min(retry_after, CONCURRENCY_MAX_PAUSE) if retry_after else 0.0
+        with self._cond:
+            self.throttled += 1
+            if now + pause > self._paused_until:
+                self.paused += now + pause - max(now, self._paused_until)
+                self._paused_until = now + pause
+            # Answers to requests sent before the last cut belong to the same episode.
+            window = max(1.0, max(self._latency.values(), default=0.0))
+            if now - self._last_cut < window + pause:
+                return
+            self._last_cut = self._last_change = now
+            self._healthy = 0
+            old = self.limit
+            self.limit = max(self.minimum, int(self.limit * CONCURRENCY_DECREASE))
+            self.lowest = min(self.lowest, self.limit)
+            # Start growing from a clean slate once the server recovers.
+            self._latency.clear()
+        logger.warning(
+            "Server overloaded (HTTP %s): concurrent requests %d -> %d%s",
+            status,
+            old,
+            self.limit,
+            f"; pausing {pause:.0f} s (Retry-After)" if pause else "",
+        )
+
+    def report(self):
+        """Guarda el estado en ``metrics`` (``concurrency_*``) y empieza un periodo nuevo."""
+        with self._cond:
+            limit, lowest, throttled, paused = self.limit, self.lowest, self.throttled, self.paused
+            self.lowest = limit
+            self.throttled = 0
+            self.paused = 0.0
+        if throttled:
+            logger.info(
+                "Concurrent requests: limit %d (lowest %d of %d), 429/503 responses: %d, Retry-After pauses: %.0f s",
+                limit,
+                lowest,
+                self.maximum,
+                throttled,
+                paused,
+            )
+        if self.metrics is not None:
+            self.metrics.gauges.update(
+                concurrency_limit=limit,
+                concurrency_limit_min=lowest,
+                concurrency_limit_max=self.maximum,
+                throttled_responses=throttled,
+                retry_after_seconds=round(paused, 3),
+            )
+
+
+class AdaptiveRetry(Retry):
+    """``Retry`` que avisa a ``controller`` de cada 429/503 o error que reintenta urllib3.
+
+    urllib3 ya espera el ``Retry-After`` antes de repetir la peticion; el
+    controlador ademas frena las peticiones nuevas de los demas hilos.
+    """
+
+    def __init__(self, *args, controller=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.controller = controller
+
+    def new(self, **kw):
+        kw.setdefault("controller", self.controller)
+        return super().new(**kw)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if self.controller is not None:
+            if response is not None and response.status in OVERLOAD_STATUSES:
+                self.controller.overloaded(response.status, parse_retry_after(response.headers.get("Retry-After")))
+            elif error is not None or (response is not None and response.status >= 500):
+                self.controller.failed()
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class AdaptiveAdapter(HTTPAdapter):
+    """``HTTPAdapter`` que envia cada peticion dentro de ``controller.slot()``."""
+
+    def __init__(self, controller, **kwargs):
+        self.controller = controller
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        controller = self.controller
+        with controller.slot():
+            started = time.monotonic()
+            try:
+                response = super().send(request, **kwargs)
+            except Exception:
+                controller.failed()
+                raise
+        retried = getattr(getattr(response.raw, "retries", None), "history", None)
+        controller.observe(
+            response.status_code,
+            None if retried else time.monotonic() - started,
+            request_kind(request.url),
+            parse_retry_after(response.headers.get("Retry-After")),
+        )
+        return response
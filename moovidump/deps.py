@@ -0,0 +1,126 @@
+"""Instalacion de dependencias con cache: evita ``pip install`` si nada cambio.
+
+Tras una instalacion correcta se guarda una huella de ``requirements.txt`` y
+del interprete (ruta y version) en ``DEPS_CACHE_FILENAME``, junto al
+``requirements.txt``. Mientras la huella coincida y los modulos de
+``REQUIRED_MODULES`` se importen, ``run.py`` y ``run_gui.py`` no llaman a pip.
+``MOOVIDUMP_REINSTALL=1`` (o ``run.py --reinstall``) fuerza la reinstalacion.
+
+Cuando el interprete que va a instalar (``python``) no es el que ejecuta
+``run.py``, su version y sus modulos se consultan ejecutandolo.
+
+Solo usa la libreria estandar: se ejecuta antes de que esten instaladas las
+dependencias.
+"""
+
+import hashlib
+import importlib
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+DEPS_CACHE_FILENAME = ".deps-cache.json"
+# Modulos importables de requirements.txt (python-dotenv se importa como dotenv)
+REQUIRED_MODULES = ("dotenv", "requests", "rich")
+REINSTALL_ENV = "MOOVIDUMP_REINSTALL"
+
+
+def _interpreter_key(python):
+    # Not realpath: a venv's python is a symlink to the base interpreter.
+    return os.path.abspath(python)
+
+
+def _is_current(python):
+    return _interpreter_key(python) == _interpreter_key(sys.executable)
+
+
+def interpreter_version(python=None):
+    """``sys.version`` de ``python``; ``OSError`` si no se puede ejecutar."""
+    python = python or sys.executable
+    if _is_current(python):
+        return sys.version
+    result = subprocess.run(
+        [python, "-c", "import sys; print(sys.version)"], capture_output=True, text=True, check=False
+    )
+    if result.returncode != 0:
+        raise OSError(f"{python} exited with code {result.returncode}")
+    return result.stdout.strip()
+
+
+def requirements_fingerprint(requirements_path, python=None, version=None):
+    """Huella de ``requirements_path`` y del interprete que va a instalarlos."""
+    python = python or sys.executable
+    hasher = hashlib.sha256()
+    hasher.update(Path(requirements_path).read_bytes())
+    hasher.update(_interpreter_key(python).encode())
+    hasher.update((version or interpreter_version(python)).encode())
+    return hasher.hexdigest()
+
+
+def reinstall_requested():
+    return os.getenv(REINSTALL_ENV, "").strip().lower() in ("1", "true", "yes", "y")
+
+
+def _cache_path(requirements_path):
+    return Path(requirements_path).with_name(DEPS_CACHE_FILENAME)
+
+
+def _read_cache(requirements_path):
+    try:
+        data = json.loads(_cache_path(requirements_path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def modules_importable(modules=REQUIRED_MODULES, python=None):
+    """``True`` si ``python`` (por defecto el interprete actual) puede importar ``modules``."""
+    python = python or sys.executable
+    if not _is_current(python):
+        try:
+            result = subprocess.run([python, "-c", "import " + ", ".join(modules)], capture_output=True, check=False)
+        except OSError:
+            return False
+        return result.returncode == 0
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            return False
+    return True
+
+
+def requirements_satisfied(requirements_path, python=None):
+    """``True`` si la ultima instalacion con este interprete sigue valiendo."""
+    python = python or sys.executable
+    try:
+        fingerprint = requirements_fingerprint(requirements_path, python)
+    except OSError:
+        return False
+    entry = _read_cache(requirements_path).get(_interpreter_key(python))
+    if not isinstance(entry, dict) or entry.get("fingerprint") != fingerprint:
+        return False
+    # The stamp can outlive the packages (venv recreated, manual uninstall...).
+    return modules_importable(python=python)
+
+
+def record_requirements(requirements_path, python=None):
+    """Guarda la huella tras un ``pip install`` correcto."""
+    python = python or sys.executable
+    try:
+        version = interpreter_version(python)
+        fingerprint = requirements_fingerprint(requirements_path, python, version)
+    except OSError:
+        return
+    data = _read_cache(requirements_path)
+    data[_interpreter_key(python)] = {"fingerprint": fingerprint, "python": version.split()[0]}
+    path = _cache_path(requirements_path)
+    tmp = path.with_suffix(".tmp")
+    try:
+        tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        tmp.replace(path)
+    except OSError:
+        # Without the cache the next launch simply runs pip again.
+        pass
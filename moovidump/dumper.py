@@ -0,0 +1,895 @@
+"""``Dumper``: login, listado de cursos, plan y descarga, sin interfaz de usuario."""
+
+import logging
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from .attachments import AttachmentSections, harvest_attachments
+from .client import MoodleClient, SectionStream
+from .layout import Layout, collapse_single_file_dirs, pluginfile_to_token_url, remove_empty_dirs
+from .manifest import DownloadManifest
+from .metrics import Metrics
+from .pipeline import Pipeline
+from .ratelimit import BandwidthLimiter, format_rate
+from .sessions import clear_cached_session, load_cached_session
+from .settings import (
+    DISK_FREE_MARGIN,
+    DOWNLOAD_JOBS,
+    DOWNLOAD_QUEUE_FACTOR,
+    ENUM_JOBS,
+    PIPELINE_RESULTS_QUEUE,
+    PIPELINE_SECTIONS_QUEUE,
+    THROUGHPUT_HISTORY_RUNS,
+    WS_BATCH_SIZE,
+)
+from .snapshots import SnapshotLog
+from .transfer import download_to_path, link_or_copy
+
+logger = logging.getLogger(__name__)
+
+
+def disk_space_report(path, required):
+    """Compara el espacio libre del volumen de ``path`` con ``required`` bytes."""
+    path = Path(path).resolve()
+    while not path.exists() and path.parent != path:
+        path = path.parent
+    free = shutil.disk_usage(path).free
+    return {
+        "path": str(path),
+        "free_bytes": free,
+        "required_bytes": required,
+        "margin_bytes": DISK_FREE_MARGIN,
+        "fits": not required or required + DISK_FREE_MARGIN <= free,
+    }
+
+
+def check_free_space(path, required):
+    """Devuelve ``False`` (y lo registra) si ``required`` bytes no caben en ``path``."""
+    report = disk_space_report(path, required)
+    if not report["fits"]:
+        logger.error(
+            "Not enough free space in %s: %.2f MB needed (+%.0f MB margin), %.2f MB free",
+            report["path"],
+            required / (1024 * 1024),
+            DISK_FREE_MARGIN / (1024 * 1024),
+            report["free_bytes"] / (1024 * 1024),
+        )
+    return report["fits"]
+
+
+class SharedDedup:
+    """Ficheros remotos descargados (o en curso) por varios ``Dumper`` a la vez.
+
+    Con ``--profiles`` es habitual que dos cuentas vean la misma asignatura. La
+    clave es ``(sitio, fileurl, tamano, fecha)`` y el valor un ``Future`` que se
+    resuelve con la ruta del fichero descargado, o con ``None`` si la descarga
+    fallo; en ese caso el siguiente perfil que lo reclame lo descarga el mismo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def claim(self, key):
+        """Devuelve ``(future, leader)``; con ``leader`` quien llama debe descargarlo."""
+        with self._lock:
+            future = self._files.get(key)
+            if future is not None and not (future.done() and future.result() is None):
+                return future, False
+            future = self._files[key] = Future()
+            return future, True
+
+
+class Dumper:
+    """Descarga los ficheros de los cursos de un usuario de Moodle a ``dumps_dir``.
+
+    Es la API de libreria que usa la CLI::
+
+        dumper = Dumper("https://campus.example.org", "user", "secret")
+        if dumper.login():
+            courses = dumper.list_courses()
+            stats = dumper.download(courses)
+
+    No escribe en la consola ni termina el proceso: informa con ``logging`` y
+    devuelve resultados (``False``/``None`` en los errores).
+
+    Varios ``Dumper`` pueden trabajar a la vez en un mismo proceso compartiendo
+    ``executor`` (presupuesto global de descargas), ``limiter`` y
+    ``shared_dedup``; cada uno tiene su propia sesion y su ``dumps_dir``.
+
+    Con ``adaptive`` (por defecto) ``jobs + enum_jobs`` es solo el maximo de
+    peticiones en curso: el limite real lo ajusta ``ConcurrencyController``
+    segun los 429/503, ``Retry-After``, la latencia y los errores del sitio.
+    """
+
+    def __init__(
+        self,
+        site,
+        username=None,
+        password=None,
+        dumps_dir="dumps",
+        *,
+        jobs=DOWNLOAD_JOBS,
+        enum_jobs=ENUM_JOBS,
+        ws_batch_size=WS_BATCH_SIZE,
+        stream_contents=False,
+        attachments=True,
+        force=False,
+        full_sync=False,
+        dedup=False,
+        tidy=False,
+        session_cache=True,
+        adaptive=True,
+        max_rate=None,
+        host_rates=(),
+        rate_schedule=(),
+        layout=None,
+        metrics=None,
+        events=None,
+        executor=None,
+        limiter=None,
+        shared_dedup=None,
+    ):
+        self.jobs = max(1, int(jobs or 1))
+        self.force = bool(force)
+        self.full_sync = bool(full_sync) or self.force
+        self.dedup = bool(dedup)
+        self.tidy = bool(tidy)
+        # core_course_get_contents en streaming (una peticion por curso) aunque se pueda agrupar
+        self.stream_contents = bool(stream_contents)
+        # Adjuntos de tareas y foros (mod_assign/mod_forum), que get_contents no incluye
+        self.attachments = bool(attachments)
+        self.dumps_dir = Path(dumps_dir)
+        self.layout = layout if layout is not None else Layout()
+        self.metrics = metrics if metrics is not None else Metrics()
+        # Receptor de eventos de progreso (``EventWriter`` u objeto con ``emit(event, **fields)``)
+        self.events = events
+        self.client = MoodleClient(
+            site,
+            username,
+            password,
+            pool_size=self.jobs + max(1, int(enum_jobs or 1)),
+            ws_batch_size=ws_batch_size,
+            enum_jobs=enum_jobs,
+            use_session_cache=session_cache,
+            metrics=self.metrics,
+            adaptive=adaptive,
+        )
+        self.host_rates = list(host_rates or ())
+        self.limiter = limiter
+        if limiter is None and (max_rate or self.host_rates or rate_schedule):
+            self.limiter = BandwidthLimiter(max_rate, self.host_rates, rate_schedule)
+        self.executor = executor
+        self.shared_dedup = shared_dedup if self.dedup else None
+        self._cached_token = None
+
+    @property
+    def site(self):
+        return self.client.site
+
+    def _emit(self, event, **fields):
+        if self.events is not None:
+            self.events.emit(event, **fields)
+
+    @staticmethod
+    def _totals(stats):
+        return {key: stats[key] for key in ("downloaded", "skipped", "failed", "deduplicated", "bytes_downloaded")}
+
+    def login(self):
+        """Reutiliza la sesion guardada o inicia una nueva. Devuelve ``True`` si hay sesion."""
+        client = self.client
+        # A cached token is validated by the first webservice call; if the
+        # server rejects it, post_webservice() logs in again transparently.
+        cached_session = load_cached_session(client.site, client.username) if client.use_session_cache else None
+        if cached_session:
+            client.restore_session(cached_session)
+            self._cached_token = client.token
+            logger.info("Using cached session for %s (token: %s...)", client.username, client.token[:20])
+        elif not client.start_session():
+            return False
+
+        logger.info("User ID: %s", client.user_id)
+        if client.private_access_key:
+            logger.info("Private access key available (truncated): %s...", client.private_access_key[:20])
+        else:
+            logger.warning("No private access key (file downloads may fail)")
+        return True
+
+    def list_courses(self):
+        """Cursos en los que esta matriculado el usuario (``None`` si la llamada falla)."""
+        client = self.client
+        logger.info("Fetching courses for user %s...", client.user_id)
+        with self.metrics.phase("courses"):
+            courses = client.post_webservice("core_enrol_get_users_courses", {"userid": client.user_id, "returnusercount": "0"})
+        if courses is None and self._cached_token is not None and client.token == self._cached_token:
+            # The cached token looked valid but the call failed for another reason
+            # (e.g. the cached userid is stale); retry once with a fresh session.
+            self._cached_token = None
+            clear_cached_session(client.site, client.username)
+            if not client.start_session():
+                return None
+            with self.metrics.phase("courses"):
+                courses = client.post_webservice("core_enrol_get_users_courses", {"userid": client.user_id, "returnusercount": "0"})
+        return courses
+
+    def resolve_file_task(self, course_id, planned, manifest, scheduled_paths, adopt=True):
+        """Aplica las reglas de omision a un fichero de ``Layout.plan_section_files()``.
+
+        Devuelve ``(task, None)`` si hay que descargarlo o ``(None, motivo)`` si se
+        omite: ``"unchanged"`` (el manifiesto dice que no cambio), ``"exists"`` (ya
+        estaba en disco), ``"queued"`` (otra tarea escribe la misma ruta) o
+        ``"no_url"`` (falta la URL o la clave de acceso). Con ``adopt=False`` no se
+        registran en el manifiesto los ficheros encontrados en disco (``plan()``).
+        """
+        content = planned["content"]
+        target_path = planned["target_path"]
+        file_name = target_path.name
+        file_url = content.get("fileurl")
+        remote_size = content.get("filesize")
+        remote_mtime = content.get("timemodified")
+        file_key = DownloadManifest.file_key(course_id, planned["module_id"], file_url)
+
+        # The manifest knows where the file ended up and whether it changed remotely.
+        entry = manifest.lookup(file_key)
+        if entry is not None:
+            if entry["path"].exists():
+                target_path = entry["path"]
+            if not self.force and DownloadManifest.is_current(entry, remote_size, remote_mtime):
+                logger.debug("Skipping download; unchanged since last run: %s", target_path)
+                return None, "unchanged"
+            if not self.force:
+                logger.info("File changed since last run; downloading again: %s", target_path)
+        elif not self.force:
+            # Files from runs without a manifest: look for them in the planned
+            # location and in the module/section folders older layouts used,
+            # and adopt them if the size still matches the remote one.
+            for candidate in planned["legacy_paths"]:
+                if candidate.is_file():
+                    target_path = candidate
+                    break
+            if target_path.is_file() and (remote_size is None or target_path.stat().st_size == remote_size):
+                logger.info("Skipping download; file already exists: %s", target_path)
+                if adopt:
+                    manifest.record(file_key, target_path, remote_size, remote_mtime)
+                return None, "exists"
+
+        # Another module already queued this exact path during this run
+        if target_path in scheduled_paths:
+            logger.info("Skipping download; already queued: %s", target_path)
+            return None, "queued"
+
+        download_url = pluginfile_to_token_url(file_url, self.client.private_access_key)
+        if not download_url:
+            logger.warning("Skipping download: missing access key or URL for %s", file_name)
+            return None, "no_url"
+
+        scheduled_paths.add(target_path)
+        task = {
+            "course_id": course_id,
+            "file_name": file_name,
+            "target_path": target_path,
+            "download_url": download_url,
+            "file_url": file_url,
+            "key": file_key,
+            "remote_size": remote_size,
+            "remote_mtime": remote_mtime,
+            "followers": [],
+        }
+        return task, None
+
+    def materialize_duplicate(self, source_path, task, manifest, stats):
+        """Crea ``task["target_path"]`` a partir de una copia local identica y la registra."""
+        target_path = task["target_path"]
+        try:
+            link_or_copy(source_path, target_path)
+            manifest.record(task["key"], target_path, task["remote_size"], task["remote_mtime"])
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Could not deduplicate %s from %s: %s", target_path, source_path, e)
+            self.metrics.count("files_failed", "dedup")
+            stats["failed"] += 1
+            stats["failed_courses"].add(task["course_id"])
+            self._emit("file_finished", course_id=task["course_id"], file=task["file_name"], ok=False, bytes=0,
+                       reused=True, totals=self._totals(stats))
+            return
+        size = target_path.stat().st_size
+        stats["deduplicated"] += 1
+        stats["bytes_saved"] += size
+        logger.info("Deduplicated %s -> %s", target_path, source_path)
+        self._emit("file_finished", course_id=task["course_id"], file=task["file_name"], ok=True, bytes=size,
+                   reused=True, totals=self._totals(stats))
+
+    def _download_file(self, task):
+        """Descarga ``task`` (en ``executor`` si se compartio uno) y devuelve ``(ok, bytes, sha256)``.
+
+        Si ``task`` lleva ``shared_future`` (este ``Dumper`` reclamo el fichero en
+        ``shared_dedup``) lo resuelve con la ruta descargada o con ``None``.
+        """
+        # Use ASCII-only text to avoid encoding issues on legacy Windows consoles.
+        logger.info("Downloading: %s", task["file_name"])
+        self._emit("file_started", course_id=task["course_id"], file=task["file_name"], size=task["remote_size"])
+        download = self.metrics.profiled("download_workers", self._download_to_path)
+        args = (
+            self.client.session,
+            task["download_url"],
+            task["target_path"],
+            task["remote_size"],
+            task["remote_mtime"],
+            "sha256" if self.dedup else None,
+            self.limiter,
+        )
+        try:
+            if self.executor is not None:
+                result = self.executor.submit(download, *args).result()
+            else:
+                result = download(*args)
+        except Exception as e:
+            logger.exception("Unexpected error in download worker for %s: %s", task["file_name"], e)
+            result = False, 0, None
+        shared_future = task.pop("shared_future", None)
+        if shared_future is not None and not shared_future.done():
+            shared_future.set_result(task["target_path"] if result[0] else None)
+        return result
+
+    def _download_to_path(self, *args):
+        concurrency = self.client.concurrency
+        if concurrency is None:
+            return download_to_path(*args)
+        # The whole transfer counts as one request in flight, not just its headers.
+        with concurrency.slot():
+            return download_to_path(*args)
+
+    def course_sections(self, course_ids):
+        """Genera ``(course_id, SectionStream)`` con el contenido de cada curso.
+
+        Por defecto se piden agrupados con ``tool_mobile_call_external_functions``
+        (``ws_batch_size`` cursos por peticion) y cada curso se decodifica entero.
+        Con ``stream_contents``, o si no se puede agrupar (``ws_batch_size`` 1 o
+        un sitio sin el plugin), cada curso es una peticion que se lee en
+        streaming seccion a seccion: mas idas y vueltas, pero la memoria no crece
+        con el tamano del curso. Con ``attachments`` las secciones llevan ademas los adjuntos de
+        tareas y foros (``harvest_attachments``) en los modulos correspondientes.
+        """
+        course_ids = list(course_ids)
+        client = self.client
+        batched = client.ws_batch_size > 1 and client.mobile_batch_available and len(course_ids) > 1
+        if self.stream_contents or not batched:
+            # One request per course either way: streaming costs no extra round trips.
+            course_sections = self.client.stream_course_contents(course_ids)
+        else:
+            course_sections = (
+                (course_id, SectionStream.from_contents(course_id, contents))
+                for course_id, contents in self.client.fetch_course_contents(course_ids)
+            )
+        if not self.attachments or not course_ids:
+            return course_sections
+        return self._with_attachments(course_ids, course_sections)
+
+    def _with_attachments(self, course_ids, course_sections):
+        def harvest():
+            started = time.perf_counter()
+            try:
+                return harvest_attachments(self.client, course_ids)
+            except Exception as e:
+                # Only the attachments are lost: the course contents still download.
+                logger.exception("Error collecting assignment and forum attachments: %s", e)
+                return {}
+            finally:
+                self.metrics.record_phase("attachments", time.perf_counter() - started)
+
+        # The bulk calls run alongside the enumeration of the first courses.
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="attachments") as pool:
+            future = pool.submit(self.metrics.profiled("attachment_workers", harvest))
+            try:
+                for course_id, sections in course_sections:
+                    yield course_id, AttachmentSections(
+                        sections, lambda course_id=course_id: future.result().get(course_id, {}), future.done
+                    )
+            finally:
+                course_sections.close()
+
+    def _enumerate(self, course_ids):
+        """Etapa de enumeracion de ``download``: el contenido de ``course_ids`` seccion a seccion.
+
+        Genera ``("course_start", id, None)``, un ``("section", id, seccion)`` por
+        seccion y ``("course_end", id, incompleto)`` por cada curso.
+        """
+        course_contents = self.course_sections(course_ids)
+        try:
+            for course_id, sections in self.metrics.timed_iter("enumeration", course_contents):
+                yield "course_start", course_id, None
+                for section in self.metrics.timed_iter("enumeration", sections):
+                    yield "section", course_id, section
+                yield "course_end", course_id, sections.failed
+        finally:
+            course_contents.close()
+
+    def plan(self, courses):
+        """Enumera ``courses`` y aplica las reglas de omision sin descargar nada.
+
+        Devuelve el informe de ``--dry-run``: ficheros y bytes por curso (segun el
+        ``filesize`` de ``core_course_get_contents``), totales, caudal medido en
+        ejecuciones anteriores, ETA y comprobacion de espacio libre.
+        """
+        dumps_dir = self.dumps_dir
+        manifest = DownloadManifest(dumps_dir, readonly=True)
+        courses_by_id = {c["id"]: c for c in courses if not c.get("hidden")}
+        unchanged_courses = set()
+        if not self.full_sync:
+            unchanged_courses = self.client.find_unchanged_courses(courses_by_id, manifest.course_sync_state())
+
+        with self.metrics.phase("plan"):
+            report = {
+                course_id: {
+                    "id": course_id,
+                    "name": self.layout.course_folder_name(course)[0],
+                    "unchanged": course_id in unchanged_courses,
+                    "files": 0,
+                    "download_files": 0,
+                    "download_bytes": 0,
+                    "skipped": 0,
+                    "deduplicated": 0,
+                    "failed": 0,
+                }
+                for course_id, course in courses_by_id.items()
+            }
+            scheduled_paths = set()
+            queued_urls = set()
+            course_contents = self.course_sections(c for c in courses_by_id if c not in unchanged_courses)
+            for course_id, sections in course_contents:
+                entry = report[course_id]
+                folder_name = self.layout.course_folder_name(courses_by_id[course_id])[1]
+                planned_files = (
+                    planned for section in sections for planned in self.layout.plan_section_files(dumps_dir / folder_name, section)
+                )
+                for planned in planned_files:
+                    entry["files"] += 1
+                    task, reason = self.resolve_file_task(course_id, planned, manifest, scheduled_paths, adopt=False)
+                    if reason == "no_url":
+                        entry["failed"] += 1
+                    elif task is None:
+                        entry["skipped"] += 1
+                    elif self.dedup and (task["key"][2] in queued_urls or manifest.find_copy(
+                            task["file_url"], task["remote_size"], task["remote_mtime"]) not in (None, task["target_path"])):
+                        entry["deduplicated"] += 1
+                    else:
+                        queued_urls.add(task["key"][2])
+                        entry["download_files"] += 1
+                        entry["download_bytes"] += task["remote_size"] or 0
+                if sections.failed:
+                    entry["failed"] = None
+
+            report = list(report.values())
+            totals = {key: sum(c[key] or 0 for c in report)
+                      for key in ("files", "download_files", "download_bytes", "skipped", "deduplicated", "failed")}
+            measured = manifest.throughput(THROUGHPUT_HISTORY_RUNS)
+            manifest.close()
+        if self.client.concurrency is not None:
+            self.client.concurrency.report()
+        eta = None
+        if measured:
+            bytes_per_second, files_per_second = measured
+            eta = max(totals["download_bytes"] / bytes_per_second if bytes_per_second else 0,
+                      totals["download_files"] / files_per_second if files_per_second else 0)
+        return {
+            "generated_at": int(time.time()),
+            "site": self.site,
+            "dumps_dir": str(dumps_dir.resolve()),
+            "courses": report,
+            "totals": totals,
+            "throughput": {"bytes_per_second": measured[0], "files_per_second": measured[1]} if measured else None,
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "disk": disk_space_report(dumps_dir, totals["download_bytes"]),
+        }
+
+    def download(self, courses):
+        """Descarga los ficheros de ``courses`` a ``dumps_dir``.
+
+        Es una tuberia (``pipeline.Pipeline``) de cuatro etapas unidas por colas
+        acotadas: enumeracion (``_enumerate``, que ya reparte los cursos entre
+        ``enum_jobs`` peticiones), plan de rutas y reglas de omision (un hilo),
+        ``jobs`` descargas y registro en el manifiesto (un hilo). Cuando una etapa
+        se atasca las anteriores esperan, asi que la memoria no crece con el
+        numero de cursos. Los cursos sin novedades desde la ultima sincronizacion
+        no se vuelven a enumerar. Devuelve los contadores de la ejecucion
+        (``downloaded``, ``skipped``, ``failed``, ``deduplicated``,
+        ``bytes_downloaded``, ``bytes_saved``, ``failed_courses`` y
+        ``out_of_space``) y los deja tambien en ``metrics.gauges``.
+        """
+        metrics = self.metrics
+        client = self.client
+        dumps_dir = self.dumps_dir
+        dumps_dir.mkdir(parents=True, exist_ok=True)
+        manifest = DownloadManifest(dumps_dir)
+
+        logger.info("Concurrent downloads: %d", self.jobs)
+        if self.limiter is not None:
+            logger.info("Bandwidth limit: %s", format_rate(self.limiter.allowed_rate()))
+            for host, rate in self.host_rates:
+                logger.info("Limit for %s: %s", host, format_rate(rate))
+
+        courses_by_id = {c["id"]: c for c in courses or [] if not c.get("hidden")}
+
+        # Sincronizacion incremental: los cursos sin novedades desde la ultima
+        # ejecucion no vuelven a pedir core_course_get_contents.
+        sync_started_at = int(time.time())
+        unchanged_courses = set()
+        if not self.full_sync:
+            unchanged_courses = client.find_unchanged_courses(courses_by_id, manifest.course_sync_state())
+        for course_id in unchanged_courses:
+            logger.info("Course [%s] unchanged since last sync; skipping enumeration", course_id)
+        self._emit("run_started", courses=len(courses_by_id), unchanged=len(unchanged_courses), jobs=self.jobs)
+        run = _DownloadRun(self, manifest, courses_by_id)
+        stats = run.stats
+
+        # "enumeration" only counts the time spent waiting for course contents;
+        # "download" is the whole pipeline until the last file is recorded.
+        with metrics.phase("download"):
+            pipeline = Pipeline("download")
+            course_ids = [c for c in courses_by_id if c not in unchanged_courses]
+            run.sections = pipeline.source("enumerate", self._enumerate(course_ids), PIPELINE_SECTIONS_QUEUE)
+            tasks = pipeline.stage(
+                "plan", metrics.profiled("pipeline_plan", run.plan), run.sections, self.jobs * DOWNLOAD_QUEUE_FACTOR
+            )
+            results = pipeline.stage("download", run.download, tasks, PIPELINE_RESULTS_QUEUE, workers=self.jobs)
+            pipeline.sink("finalize", metrics.profiled("pipeline_finalize", run.finalize), results)
+            try:
+                pipeline.join()
+                # Files other profiles were still downloading for us.
+                run.collect_shared(block=True)
+            finally:
+                run.release_claims()
+                # Keep what was recorded even if the pipeline failed or was interrupted.
+                manifest.flush()
+        download_seconds = metrics.phases["download"]
+        self._emit("run_finished", seconds=round(download_seconds, 3), out_of_space=stats["out_of_space"],
+                   courses_failed=len(stats["failed_courses"]), **self._totals(stats))
+        if stats["downloaded"]:
+            # Throughput history for the ETA shown by --dry-run.
+            manifest.record_run(stats["downloaded"], stats["bytes_downloaded"], download_seconds)
+
+        with metrics.phase("cleanup"):
+            # Only courses whose files all made it to disk move their sync timestamp.
+            for course_id in run.fetched_courses:
+                if course_id not in stats["failed_courses"]:
+                    manifest.mark_course_synced(course_id, sync_started_at, full=True)
+            for course_id in unchanged_courses:
+                manifest.mark_course_synced(course_id, sync_started_at, full=False)
+
+            # El plan ya decide las rutas finales; tidy reorganiza ademas carpetas de
+            # ejecuciones antiguas, pero solo dentro de los cursos procesados ahora.
+            if self.tidy:
+                collapsed = removed = 0
+                for course_dir in run.processed_course_dirs:
+                    # With dump_all every module keeps its own folder (see plan_section_files).
+                    if not self.layout.dump_all:
+                        collapsed += collapse_single_file_dirs(course_dir, min_depth=2, on_move=manifest.move)
+                    removed += remove_empty_dirs(course_dir)
+                logger.info("Collapsed folders: %d, empty folders removed: %d", collapsed, removed)
+            manifest.close()
+
+        metrics.gauges.update(
+            success=not stats["failed"] and not stats["out_of_space"],
+            files={
+                "downloaded": stats["downloaded"],
+                "skipped": stats["skipped"],
+                "failed": stats["failed"],
+                "deduplicated": stats["deduplicated"],
+            },
+            bytes_downloaded=stats["bytes_downloaded"],
+            bytes_saved=stats["bytes_saved"],
+            download_bytes_per_second=round(stats["bytes_downloaded"] / download_seconds, 1) if download_seconds else 0,
+            courses_failed=len(stats["failed_courses"]),
+        )
+
+        logger.info(
+            "Download summary -> downloaded: %d, skipped: %d, failed: %d",
+            stats["downloaded"],
+            stats["skipped"],
+            stats["failed"],
+        )
+        if self.limiter is not None:
+            logger.info(
+                "Bandwidth -> allowed: %s, achieved: %s, time waiting for the limit: %.1f s",
+                format_rate(self.limiter.allowed_rate()),
+                format_rate(self.limiter.achieved_rate()),
+                self.limiter.waited,
+            )
+        if self.dedup:
+            logger.info(
+                "Deduplication -> files reused: %d, space/download saved: %.2f MB",
+                stats["deduplicated"],
+                stats["bytes_saved"] / (1024 * 1024),
+            )
+        if client.concurrency is not None:
+            client.concurrency.report()
+        return stats
+
+
+class _DownloadRun:
+    """Estado de una ejecucion de ``Dumper.download`` y las etapas de su tuberia.
+
+    Los elementos que circulan son tuplas ``(tipo, a, b)``. ``plan`` y
+    ``finalize`` corren cada una en un solo hilo: ``plan`` es la unica que toca
+    ``scheduled_paths``, las instantaneas y los datos del curso en curso, y
+    ``finalize`` la unica que actualiza ``stats`` y registra las descargas; solo
+    lo que comparten (``queued_by_url`` y los bytes por escribir) va con
+    ``_lock``. ``download`` corre en ``jobs`` hilos.
+    """
+
+    def __init__(self, dumper, manifest, courses_by_id):
+        self.dumper = dumper
+        self.manifest = manifest
+        self.courses_by_id = courses_by_id
+        self.stats = {
+            "downloaded": 0,
+            "skipped": 0,
+            "failed": 0,
+            "deduplicated": 0,
+            "bytes_saved": 0,
+            "bytes_downloaded": 0,
+            "failed_courses": set(),
+            "out_of_space": False,
+        }
+        self.fetched_courses = []
+        self.processed_course_dirs = []
+        self.scheduled_paths = set()
+        # Cola de la etapa de enumeracion; se cancela si no queda espacio
+        self.sections = None
+        self.course = None
+        # fileurl -> tarea en curso, para que dedup no descargue dos veces lo mismo
+        self.queued_by_url = {}
+        # Bytes de las descargas planificadas que aun no se han registrado
+        self.pending_bytes = 0
+        # Futures de shared_dedup que este Dumper debe resolver, y tareas que
+        # esperan a la descarga de otro perfil
+        self.claimed = []
+        self.shared_waits = []
+        self._lock = threading.Lock()
+
+    # -- plan --------------------------------------------------------------
+
+    def plan(self, item):
+        """Etapa de plan: rutas, reglas de omision, dedup y preflight de espacio."""
+        kind, course_id, payload = item
+        if kind == "course_start":
+            self._start_course(course_id)
+            return []
+        if kind == "course_end":
+            return self._end_course(payload)
+
+        dumper = self.dumper
+        course = self.course
+        counts = course["counts"]
+        if not course["fetched"]:
+            course["fetched"] = True
+            self.fetched_courses.append(course_id)
+            self.processed_course_dirs.append(course["dir"])
+        if dumper.layout.dump_all:
+            if course["snapshots"] is None:
+                course["snapshots"] = SnapshotLog(course["dir"]).open_record(course_id)
+            course["snapshots"].add(payload)
+
+        out = []
+        section_tasks = []
+        for planned in dumper.layout.plan_section_files(course["dir"], payload):
+            counts["files"] += 1
+            task, reason = dumper.resolve_file_task(course_id, planned, self.manifest, self.scheduled_paths)
+            if reason == "no_url":
+                counts["failed"] += 1
+                out.append(("failed", course_id, reason))
+            elif task is None:
+                counts["skipped"] += 1
+                out.append(("skipped", course_id, reason))
+            else:
+                section_tasks.append(task)
+
+        # Preflight de espacio: lo que falta por escribir de esta seccion mas lo
+        # que sigue en cola tiene que caber en el volumen de destino.
+        needed = sum(t["remote_size"] or 0 for t in section_tasks)
+        with self._lock:
+            needed += self.pending_bytes
+        if needed and not check_free_space(dumper.dumps_dir, needed):
+            logger.error("Stopping in course [%s]; finishing queued downloads", course_id)
+            if course["snapshots"] is not None:
+                course["snapshots"].abort()
+            # Stop the enumeration; what is already planned still downloads.
+            self.sections.cancel()
+            out.append(("out_of_space", course_id, None))
+            return out
+        course["queued"] += len(section_tasks)
+        course["queued_bytes"] += sum(t["remote_size"] or 0 for t in section_tasks)
+        for task in section_tasks:
+            out.extend(self._schedule(task))
+        return out
+
+    def _start_course(self, course_id):
+        cleaned_name, folder_name = self.dumper.layout.course_folder_name(self.courses_by_id[course_id])
+        course_dir = self.dumper.dumps_dir / folder_name
+        logger.info("Processing course [%s] %s", course_id, cleaned_name)
+        logger.debug("Output directory: %s", course_dir)
+        self.course = {
+            "id": course_id,
+            "name": cleaned_name,
+            "dir": course_dir,
+            "fetched": False,
+            "snapshots": None,
+            "counts": {"files": 0, "skipped": 0, "failed": 0},
+            "queued": 0,
+            "queued_bytes": 0,
+        }
+
+    def _end_course(self, failed):
+        course, self.course = self.course, None
+        course_id = course["id"]
+        snapshots = course["snapshots"]
+        if snapshots is not None:
+            # Only complete contents become a record (and the base for the next delta).
+            if failed:
+                snapshots.abort()
+            else:
+                snapshots.close()
+                logger.debug("Snapshot of course %s: %d changed item(s)", course_id, snapshots.changed)
+        if not course["fetched"]:
+            logger.warning("No contents found for course %s", course_id)
+            return []
+        if failed:
+            # Partial contents: keep the files already queued, but do not
+            # mark the course as synced so the next run enumerates it again.
+            logger.warning("Contents of course %s arrived incomplete; it will be enumerated again", course_id)
+        return [("course", course_id, {**course, "failed": failed})]
+
+    def _schedule(self, task):
+        """Decide si ``task`` se descarga, espera a otra copia o reutiliza una ya descargada."""
+        dumper = self.dumper
+        if dumper.dedup:
+            url = task["key"][2]
+            with self._lock:
+                # Same fileurl linked from another section/course: reuse it.
+                leader = self.queued_by_url.get(url)
+                if leader is not None:
+                    leader["followers"].append(task)
+                    return []
+                existing = self.manifest.find_copy(task["file_url"], task["remote_size"], task["remote_mtime"])
+                if existing is not None and existing != task["target_path"]:
+                    return [("duplicate", task, existing)]
+                self.queued_by_url[url] = task
+        with self._lock:
+            self.pending_bytes += task["remote_size"] or 0
+
+        if dumper.shared_dedup is not None:
+            # Another profile may already be downloading the same remote file.
+            shared_key = (dumper.site, task["file_url"], task["remote_size"], task["remote_mtime"])
+            shared_future, leader = dumper.shared_dedup.claim(shared_key)
+            if not leader:
+                logger.info("Shared with another profile; reusing its download of %s", task["file_name"])
+                return [("shared", task, shared_future)]
+            task["shared_future"] = shared_future
+            self.claimed.append(shared_future)
+        return [("download", task, None)]
+
+    # -- download ----------------------------------------------------------
+
+    def download(self, item):
+        """Etapa de descarga; el resto de elementos pasan tal cual a ``finalize``."""
+        kind, task, _ = item
+        if kind == "download":
+            return [("downloaded", task, self.dumper._download_file(task))]
+        return [item]
+
+    # -- finalize ----------------------------------------------------------
+
+    def finalize(self, item):
+        """Etapa final: contadores, manifiesto, hardlinks de dedup y eventos de progreso."""
+        kind, a, b = item
+        dumper = self.dumper
+        stats = self.stats
+        if kind == "downloaded":
+            self._finish_download(a, b)
+        elif kind == "skipped":
+            dumper.metrics.count("files_skipped", b)
+            stats["skipped"] += 1
+        elif kind == "failed":
+            dumper.metrics.count("files_failed", b)
+            stats["failed"] += 1
+            stats["failed_courses"].add(a)
+        elif kind == "duplicate":
+            dumper.materialize_duplicate(b, a, self.manifest, stats)
+        elif kind == "shared":
+            self.shared_waits.append((a, b))
+        elif kind == "course":
+            if b["failed"]:
+                stats["failed_courses"].add(a)
+            dumper._emit("course", course_id=a, name=b["name"], queued=b["queued"], queued_bytes=b["queued_bytes"],
+                         **b["counts"])
+        elif kind == "out_of_space":
+            stats["failed_courses"].add(a)
+            stats["out_of_space"] = True
+        if self.shared_waits:
+            self.collect_shared()
+
+    def _release(self, task):
+        """Saca ``task`` de ``queued_by_url`` y devuelve las tareas que esperaban su fichero."""
+        with self._lock:
+            self.pending_bytes -= task["remote_size"] or 0
+            url = task["key"][2]
+            if self.queued_by_url.get(url) is task:
+                del self.queued_by_url[url]
+            return list(task["followers"])
+
+    def _finish_download(self, task, result):
+        """Registra una descarga terminada.
+
+        Con ``dedup`` una descarga cuyo contenido ya existia se sustituye por un
+        hardlink, y las tareas que esperaban al mismo ``fileurl`` (``followers``)
+        se materializan a partir del fichero recien descargado.
+        """
+        dumper = self.dumper
+        stats = self.stats
+        manifest = self.manifest
+        ok, bytes_written, digest = result
+        file_name = task["file_name"]
+        target_path = task["target_path"]
+        if not ok:
+            followers = self._release(task)
+            dumper.metrics.count("files_failed", "download", 1 + len(followers))
+            stats["failed"] += 1 + len(followers)
+            stats["failed_courses"].update(t["course_id"] for t in [task, *followers])
+            for failed in [task, *followers]:
+                dumper._emit("file_finished", course_id=failed["course_id"], file=failed["file_name"], ok=False,
+                             bytes=0, reused=failed is not task, totals=dumper._totals(stats))
+            return
+
+        stats["downloaded"] += 1
+        stats["bytes_downloaded"] += bytes_written
+        logger.info("Downloaded %s (%.2f MB)", file_name, bytes_written / (1024 * 1024))
+        try:
+            if digest is not None:
+                existing = manifest.find_blob(digest, bytes_written)
+                if existing is not None and existing != target_path and link_or_copy(existing, target_path):
+                    stats["bytes_saved"] += bytes_written
+                    logger.info("Identical content already stored; hardlinked %s -> %s", target_path, existing)
+                else:
+                    manifest.record_blob(digest, target_path)
+            manifest.record(task["key"], target_path, task["remote_size"], task["remote_mtime"])
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Could not record %s in manifest: %s", target_path, e)
+        # Only now: a later copy of the same fileurl finds it with find_copy().
+        followers = self._release(task)
+        dumper._emit("file_finished", course_id=task["course_id"], file=file_name, ok=True, bytes=bytes_written,
+                     reused=False, totals=dumper._totals(stats))
+        for follower in followers:
+            dumper.materialize_duplicate(target_path, follower, manifest, stats)
+
+    def collect_shared(self, block=False):
+        """Materializa los ficheros que otro perfil ya termino de descargar.
+
+        Los que siguen en curso se quedan en ``shared_waits`` (no ocupan un hilo
+        de descarga: dos perfiles esperandose mutuamente se bloquearian). Con
+        ``block`` se espera a todos y se descargan aqui los que el otro perfil
+        no consiguio.
+        """
+        waiting = []
+        for task, shared_future in self.shared_waits:
+            if not block and not (shared_future.done() and shared_future.result() is not None):
+                waiting.append((task, shared_future))
+                continue
+            source_path = shared_future.result()
+            if source_path is None:
+                # The other profile could not download it: try ourselves.
+                self._finish_download(task, self.dumper._download_file(task))
+                continue
+            followers = self._release(task)
+            self.dumper.materialize_duplicate(source_path, task, self.manifest, self.stats)
+            for follower in followers:
+                self.dumper.materialize_duplicate(task["target_path"], follower, self.manifest, self.stats)
+        self.shared_waits = waiting
+
+    def release_claims(self):
+        """Resuelve con ``None`` las descargas reclamadas que no llegaron a hacerse (error o Ctrl+C)."""
+        for shared_future in self.claimed:
+            if not shared_future.done():
+                shared_future.set_result(None)
@@ -0,0 +1,42 @@
+"""Canal de eventos de progreso en JSON Lines (``--events-file``).
+
+Cada linea es un objeto con ``event`` (tipo), ``t`` (``time.time()``) y los
+campos propios del evento. Los emite ``Dumper.download()``:
+
+- ``run_started``: ``courses``, ``unchanged``, ``jobs``.
+- ``course``: ``course_id``, ``name``, ``files``, ``queued``, ``queued_bytes``,
+  ``skipped``, ``failed``; se emite al terminar de planificar cada curso.
+- ``file_started``: ``course_id``, ``file``, ``size``.
+- ``file_finished``: ``course_id``, ``file``, ``ok``, ``bytes``, ``reused``
+  (hardlink/copia de otro fichero en vez de descarga) y ``totals`` con los
+  contadores acumulados de la ejecucion.
+- ``run_finished``: los contadores finales y ``seconds``.
+- ``cycle``: con ``--watch``, el resumen de cada ciclo (``cycle``, ``ok``,
+  ``error``, contadores, ``seconds`` y ``next_in``).
+
+La interfaz grafica lee este fichero mientras la descarga avanza, sin tener
+que interpretar el log.
+"""
+
+import json
+import threading
+import time
+
+
+class EventWriter:
+    """Escribe eventos en ``path`` (uno por linea), seguro entre hilos."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8", buffering=1)
+
+    def emit(self, event, **fields):
+        line = json.dumps({"event": event, "t": round(time.time(), 3), **fields}, ensure_ascii=False, default=str)
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,110 @@
+"""Lectura incremental de respuestas JSON grandes.
+
+``core_course_get_contents`` devuelve una lista de secciones que, en cursos
+con muchos modulos o resumenes HTML largos, ocupa varios MB. ``iter_json_array``
+genera cada elemento de la lista en cuanto llega completo, sin esperar (ni
+guardar) el cuerpo entero: cada elemento se decodifica con
+``JSONDecoder.raw_decode`` sobre un buffer al que solo se anade lo pendiente.
+"""
+
+import codecs
+import json
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]"
+_decoder = json.JSONDecoder()
+
+
+class JSONArrayExpected(ValueError):
+    """El documento no es una lista (p. ej. un error de Moodle); ``value`` es el documento decodificado."""
+
+    def __init__(self, value):
+        super().__init__("JSON document is not an array")
+        self.value = value
+
+
+def _skip_whitespace(buffer, index):
+    while index < len(buffer) and buffer[index] in _WHITESPACE:
+        index += 1
+    return index
+
+
+def iter_json_array(chunks, encoding="utf-8"):
+    """Genera los elementos de la lista JSON que forman los bytes de ``chunks``.
+
+    Si el documento no es una lista lo lee entero y lanza ``JSONArrayExpected``
+    con su valor. Un documento mal formado o cortado lanza ``ValueError``
+    (``json.JSONDecodeError``), quiza despues de generar algunos elementos.
+    """
+    text = codecs.getincrementaldecoder(encoding)()
+    chunks = iter(chunks)
+    buffer = ""
+    index = 0
+    finished = False
+
+    def fill(at_least=1):
+        """Anade al buffer al menos ``at_least`` caracteres; ``False`` si ya no hay mas."""
+        nonlocal buffer, index, finished
+        parts = []
+        size = 0
+        while size < at_least and not finished:
+            chunk = next(chunks, None)
+            if chunk is None:
+                part = text.decode(b"", final=True)
+                finished = True
+            else:
+                part = text.decode(chunk)
+            parts.append(part)
+            size += len(part)
+        if parts:
+            # Joining once per fill keeps a huge element from being copied per chunk.
+            buffer = buffer[index:] + "".join(parts)
+            index = 0
+        return size > 0
+
+    # Cabecera: "[" o cualquier otro documento.
+    while True:
+        index = _skip_whitespace(buffer, index)
+        if index < len(buffer) or not fill():
+            break
+    if index >= len(buffer) or buffer[index] != "[":
+        while fill(1 << 20):
+            pass
+        raise JSONArrayExpected(json.loads(buffer))
+    index += 1
+    expect_value = True
+    first = True
+
+    while True:
+        index = _skip_whitespace(buffer, index)
+        if index >= len(buffer):
+            if not fill():
+                raise json.JSONDecodeError("Unterminated array", buffer, index)
+            continue
+        char = buffer[index]
+        if char == "]" and (first or not expect_value):
+            return
+        if not expect_value:
+            if char != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, index)
+            index += 1
+            expect_value = True
+            continue
+
+        try:
+            value, end = _decoder.raw_decode(buffer, index)
+        except json.JSONDecodeError:
+            if finished:
+                raise
+            # Incomplete element: wait until the pending text doubles before
+            # trying again, so a huge element is not decoded once per chunk.
+            fill(len(buffer) - index)
+            continue
+        if not finished and not isinstance(value, (dict, list)) and (end >= len(buffer) or buffer[end] not in _DELIMITERS):
+            # A number cut by the chunk boundary ("12" of "12.5e3") decodes too.
+            fill()
+            continue
+        index = end
+        expect_value = False
+        first = False
+        yield value
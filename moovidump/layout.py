@@ -0,0 +1,208 @@
+"""Rutas de salida: nombres de carpeta, plan de ficheros y limpieza de ``dumps/``."""
+
+import logging
+import os
+import re
+import shutil
+from pathlib import Path
+from urllib.parse import urlparse, urlunparse
+
+logger = logging.getLogger(__name__)
+
+
+def sanitize(name, max_len=80, full=False):
+    s = str(name).strip()
+    s = re.sub(r'[<>:"/\\|?*\x00-\x1F]', "_", s)
+    if full:
+        s = re.sub(r"\s+", "_", s)
+    s = s.rstrip(" .")
+    if len(s) > max_len:
+        s = s[:max_len].rstrip(" .")
+    return s or "item"
+
+
+# /tokenpluginfile.php/{private_access_key}/{context_id}/mod_{"resource"|"folder"}/content/0/{file_name}
+def pluginfile_to_token_url(file_url, private_access_key):
+    if not file_url or not private_access_key:
+        return None
+    parsed = urlparse(file_url)
+    new_path = parsed.path.replace("/webservice/pluginfile.php/", f"/tokenpluginfile.php/{private_access_key}/", 1)
+    return urlunparse(parsed._replace(path=new_path, query=""))
+
+
+class Layout:
+    """Nombres de carpeta y rutas de destino de los ficheros de un curso.
+
+    ``dump_all`` guarda ademas los JSON de cada curso/seccion/modulo y prefija
+    las carpetas con su id/orden; ``full_sanitizer`` cambia tambien los espacios
+    por ``_``; ``aliases`` mapea ``course_id`` a un nombre de carpeta.
+    """
+
+    def __init__(self, dump_all=False, full_sanitizer=False, aliases=None):
+        self.dump_all = dump_all
+        self.full_sanitizer = full_sanitizer
+        self.aliases = dict(aliases or {})
+
+    def sanitize(self, name, max_len=80):
+        return sanitize(name, max_len, full=self.full_sanitizer)
+
+    def course_folder_name(self, course):
+        """Devuelve ``(nombre_limpio, carpeta)`` de un curso segun ``aliases``."""
+        course_id = course["id"]
+        alias = self.aliases.get(course_id)
+        if alias:
+            cleaned_name = alias
+        else:
+            full_name = course.get("fullname", "") or ""
+            cleaned_name = (full_name.split(":", 1)[1].strip() if ":" in full_name else full_name.strip()) or f"course_{course_id}"
+
+        folder_name = self.sanitize(cleaned_name)
+        if self.dump_all:
+            folder_name = f"{course_id}_{self.sanitize(cleaned_name)}"
+        return cleaned_name, folder_name
+
+    def section_folder_name(self, section):
+        section_number = section.get("section", 0)
+        section_name = section.get("name")
+        if self.dump_all:
+            return f"{int(section_number):02d}_{self.sanitize(section_name or f'section_{section_number}')}"
+        return self.sanitize(section_name or f"section_{section_number}")
+
+    def module_folder_name(self, module, module_index):
+        module_name = module.get("name")
+        if self.dump_all:
+            return f"{module_index:03d}_{self.sanitize(module_name or f'module_{module_index}')}"
+        return self.sanitize(module_name or f"module_{module_index}")
+
+    def plan_section_files(self, course_dir, section):
+        """Resuelve la ruta final de cada fichero de una seccion sin tocar el disco.
+
+        Aplica de antemano lo que antes hacia ``collapse_single_file_dirs()`` tras
+        descargar: un modulo con un unico fichero lo deja directamente en la
+        carpeta de la seccion, salvo que ese nombre lo reclame ya otro modulo de la
+        misma seccion o coincida con la carpeta de otro modulo (las reglas no
+        dependen de las demas secciones). Con ``dump_all`` no se colapsa nada:
+        cada modulo tiene su carpeta, donde ``python -m moovidump.snapshots``
+        puede reconstruir su ``module.json``.
+
+        Devuelve una lista de dicts con ``content``, ``module_id``, ``target_path``
+        y ``legacy_paths`` (rutas donde ejecuciones anteriores pudieron dejar el
+        fichero). Las carpetas se crean despues, solo al escribir cada fichero.
+        """
+        sections_root = course_dir / "sections" if self.dump_all else course_dir
+        section_dir = sections_root / self.section_folder_name(section)
+        modules = []
+        for module_index, module in enumerate(section.get("modules", [])):
+            files = [c for c in module.get("contents", []) if c.get("type") == "file"]
+            names = {self.sanitize(c.get("filename") or "file") for c in files}
+            modules.append((module, section_dir / self.module_folder_name(module, module_index), files, names))
+
+        collapsed = {}
+        if not self.dump_all:
+            module_dirs = {module_dir.name for _, module_dir, _, names in modules if len(names) > 1}
+            for index, (_, _, _, names) in enumerate(modules):
+                if len(names) != 1:
+                    continue
+                name = next(iter(names))
+                if name not in collapsed and name not in module_dirs:
+                    collapsed[name] = index
+
+        plan = []
+        for index, (module, module_dir, files, names) in enumerate(modules):
+            for content in files:
+                file_name = self.sanitize(content.get("filename") or "file")
+                in_module = module_dir / file_name
+                in_section = section_dir / file_name
+                target_path = in_section if collapsed.get(file_name) == index else in_module
+                plan.append(
+                    {
+                        "content": content,
+                        "module_id": module.get("id"),
+                        "target_path": target_path,
+                        "legacy_paths": list(dict.fromkeys((target_path, in_module, in_section))),
+                    }
+                )
+        return plan
+
+
+def remove_empty_dirs(root_path):
+    """Recorre `root_path` de forma descendente y elimina directorios vacíos.
+
+    Devuelve el número de directorios eliminados.
+    """
+    root = Path(root_path)
+    if not root.exists():
+        return 0
+
+    removed = 0
+    # Recorremos en modo bottom-up para eliminar subdirectorios antes que padres
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        p = Path(dirpath)
+        try:
+            # si no hay entradas (ni ficheros ni subdirs), rmdir funciona
+            if not any(p.iterdir()):
+                p.rmdir()
+                logger.info("Removed empty directory: %s", p)
+                removed += 1
+        except Exception as e:
+            logger.debug("Could not remove %s: %s", p, e)
+    return removed
+
+
+def collapse_single_file_dirs(root_path, min_depth=3, on_move=None):
+    """Aplana carpetas hoja con un unico archivo moviendolo al directorio padre.
+
+    Solo colapsa directorios con profundidad relativa >= ``min_depth`` para
+    evitar mover carpetas de nivel superior (por ejemplo, las de curso).
+    ``on_move(src, dst)`` se llama tras cada movimiento (p. ej. para que el
+    manifiesto siga la nueva ruta del fichero).
+
+    Devuelve el numero de carpetas colapsadas.
+    """
+    root = Path(root_path)
+    if not root.exists():
+        return 0
+
+    collapsed = 0
+
+    for dirpath, _, _ in os.walk(root, topdown=False):
+        p = Path(dirpath)
+        if p == root:
+            continue
+
+        rel_depth = len(p.relative_to(root).parts)
+        if rel_depth < min_depth:
+            continue
+
+        try:
+            entries = list(p.iterdir())
+        except Exception as e:
+            logger.debug("Could not inspect %s: %s", p, e)
+            continue
+
+        files = [e for e in entries if e.is_file()]
+        dirs = [e for e in entries if e.is_dir()]
+
+        if len(files) != 1 or dirs:
+            continue
+
+        src = files[0]
+        dst = p.parent / src.name
+
+        if dst.exists():
+            logger.warning("Cannot collapse %s; destination exists: %s", p, dst)
+            continue
+
+        try:
+            shutil.move(str(src), str(dst))
+            p.rmdir()
+            logger.info("Collapsed single-file directory: %s -> %s", p, dst)
+            collapsed += 1
+        except Exception as e:
+            logger.debug("Could not collapse %s: %s", p, e)
+            continue
+
+        if on_move is not None:
+            on_move(src, dst)
+
+    return collapsed
@@ -0,0 +1,259 @@
+"""Manifiesto SQLite de ``dumps/``: ficheros descargados, sincronizaciones y caudal."""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+from .settings import MANIFEST_COMMIT_EVERY, MANIFEST_COMMIT_SECONDS, MANIFEST_FILENAME
+
+
+class DownloadManifest:
+    """Registro persistente (SQLite) de los ficheros descargados.
+
+    Cada fichero se identifica por ``(course_id, module_id, fileurl)`` y guarda
+    el ``filesize``/``timemodified`` que anuncio Moodle junto con la ruta, el
+    tamano y el mtime locales tras descargarlo. Las rutas se guardan relativas a
+    ``root`` para que el manifiesto siga siendo valido si se mueve ``dumps/``.
+
+    Los ficheros registrados se confirman en lotes (``MANIFEST_COMMIT_EVERY``
+    registros o ``MANIFEST_COMMIT_SECONDS``), no uno a uno: la primera
+    ejecucion sobre un ``dumps/`` grande adopta miles de ficheros y cada commit
+    es un fsync. ``flush()`` y ``close()`` confirman lo pendiente; si el proceso
+    muere antes, esos ficheros solo se vuelven a comprobar en la siguiente.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS files (
+            course_id INTEGER NOT NULL,
+            module_id INTEGER NOT NULL,
+            fileurl TEXT NOT NULL,
+            path TEXT NOT NULL,
+            remote_size INTEGER,
+            remote_mtime INTEGER,
+            local_size INTEGER,
+            local_mtime_ns INTEGER,
+            updated_at REAL,
+            PRIMARY KEY (course_id, module_id, fileurl)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS files_path ON files (path)",
+        "CREATE INDEX IF NOT EXISTS files_url ON files (fileurl)",
+        """
+        CREATE TABLE IF NOT EXISTS course_sync (
+            course_id INTEGER PRIMARY KEY,
+            last_sync INTEGER NOT NULL,
+            last_full_sync INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            local_mtime_ns INTEGER,
+            PRIMARY KEY (sha256, size)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS runs (
+            finished_at REAL NOT NULL,
+            files INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            seconds REAL NOT NULL
+        )
+        """,
+    )
+
+    def __init__(self, root, readonly=False):
+        """Abre (o crea) el manifiesto de ``root``.
+
+        Con ``readonly`` no se escribe nada en disco: si el manifiesto existe se
+        abre en solo lectura y si no, se usa uno vacio en memoria (``--dry-run``).
+        """
+        self.root = Path(root)
+        self.path = self.root / MANIFEST_FILENAME
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        if readonly and self.path.exists():
+            self._conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self._conn = sqlite3.connect(":memory:" if readonly else str(self.path), check_same_thread=False)
+        for statement in self.SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+
+    def _commit(self):
+        """Confirma lo pendiente (con ``_lock`` tomado)."""
+        self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def _written(self):
+        """Cuenta una escritura por lotes y confirma si toca (con ``_lock`` tomado)."""
+        self._pending += 1
+        if self._pending >= MANIFEST_COMMIT_EVERY or time.monotonic() - self._last_commit >= MANIFEST_COMMIT_SECONDS:
+            self._commit()
+
+    def flush(self):
+        """Confirma los registros pendientes del lote actual."""
+        with self._lock:
+            self._commit()
+
+    @staticmethod
+    def file_key(course_id, module_id, file_url):
+        """Clave estable de un fichero: la URL sin query (``?forcedownload=1``, tokens...)."""
+        return int(course_id or 0), int(module_id or 0), urlparse(file_url or "")._replace(query="").geturl()
+
+    def _relative(self, path):
+        return Path(path).relative_to(self.root).as_posix()
+
+    def lookup(self, key):
+        """Devuelve el registro de ``key`` como dict (con ``path`` absoluto) o ``None``."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, remote_size, remote_mtime, local_size, local_mtime_ns FROM files "
+                "WHERE course_id = ? AND module_id = ? AND fileurl = ?",
+                key,
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "path": self.root / row[0],
+            "remote_size": row[1],
+            "remote_mtime": row[2],
+            "local_size": row[3],
+            "local_mtime_ns": row[4],
+        }
+
+    @staticmethod
+    def is_current(entry, remote_size, remote_mtime):
+        """True si el fichero local registrado sigue igual que en remoto y en disco."""
+        if entry["remote_size"] != remote_size or entry["remote_mtime"] != remote_mtime:
+            return False
+        try:
+            st = entry["path"].stat()
+        except OSError:
+            return False
+        return st.st_size == entry["local_size"] and st.st_mtime_ns == entry["local_mtime_ns"]
+
+    def record(self, key, path, remote_size, remote_mtime):
+        """Registra (o actualiza) un fichero ya presente en ``path``."""
+        st = Path(path).stat()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (course_id, module_id, fileurl, path, remote_size, remote_mtime, "
+                "local_size, local_mtime_ns, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, self._relative(path), remote_size, remote_mtime, st.st_size, st.st_mtime_ns, time.time()),
+            )
+            self._written()
+
+    def find_copy(self, file_url, remote_size, remote_mtime):
+        """Busca una copia local vigente del mismo ``fileurl`` (en cualquier curso/modulo)."""
+        url = urlparse(file_url or "")._replace(query="").geturl()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, remote_size, remote_mtime, local_size, local_mtime_ns FROM files "
+                "WHERE fileurl = ? AND remote_size IS ? AND remote_mtime IS ?",
+                (url, remote_size, remote_mtime),
+            ).fetchall()
+        for row in rows:
+            entry = dict(zip(("path", "remote_size", "remote_mtime", "local_size", "local_mtime_ns"), row))
+            entry["path"] = self.root / entry["path"]
+            if self.is_current(entry, remote_size, remote_mtime):
+                return entry["path"]
+        return None
+
+    def find_blob(self, sha256, size):
+        """Ruta de un fichero ya almacenado con el mismo contenido, o ``None``."""
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT path, local_mtime_ns FROM blobs WHERE sha256 = ? AND size = ?", (sha256, size)
+                ).fetchone()
+            except sqlite3.OperationalError:
+                # Read-only manifest created before the blobs table existed.
+                return None
+        if row is None:
+            return None
+        path = self.root / row[0]
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        # The file was replaced since it was indexed; its content is unknown.
+        if st.st_size != size or st.st_mtime_ns != row[1]:
+            return None
+        return path
+
+    def record_blob(self, sha256, path):
+        st = Path(path).stat()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs (sha256, size, path, local_mtime_ns) VALUES (?, ?, ?, ?)",
+                (sha256, st.st_size, self._relative(path), st.st_mtime_ns),
+            )
+            self._written()
+
+    def course_sync_state(self):
+        """Devuelve ``{course_id: (last_sync, last_full_sync)}`` de las sincronizaciones previas."""
+        with self._lock:
+            try:
+                rows = self._conn.execute("SELECT course_id, last_sync, last_full_sync FROM course_sync").fetchall()
+            except sqlite3.OperationalError:
+                # Read-only manifest created before the course_sync table existed.
+                return {}
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def mark_course_synced(self, course_id, synced_at, full):
+        """Registra que ``course_id`` quedo al dia en ``synced_at`` (enumeracion completa si ``full``)."""
+        with self._lock:
+            if full:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO course_sync (course_id, last_sync, last_full_sync) VALUES (?, ?, ?)",
+                    (course_id, synced_at, synced_at),
+                )
+            else:
+                self._conn.execute("UPDATE course_sync SET last_sync = ? WHERE course_id = ?", (synced_at, course_id))
+            self._commit()
+
+    def record_run(self, files, nbytes, seconds):
+        """Guarda el caudal de una ejecucion para estimar la duracion de las siguientes."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO runs (finished_at, files, bytes, seconds) VALUES (?, ?, ?, ?)",
+                (time.time(), files, nbytes, seconds),
+            )
+            self._commit()
+
+    def throughput(self, last_runs=10):
+        """Caudal medido en las ultimas ejecuciones: ``(bytes/s, ficheros/s)`` o ``None``."""
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT SUM(files), SUM(bytes), SUM(seconds) FROM "
+                    "(SELECT files, bytes, seconds FROM runs ORDER BY finished_at DESC LIMIT ?)",
+                    (last_runs,),
+                ).fetchone()
+            except sqlite3.OperationalError:
+                # Read-only manifest created before the runs table existed.
+                return None
+        if not row or not row[2]:
+            return None
+        return row[1] / row[2], row[0] / row[2]
+
+    def move(self, src, dst):
+        """Actualiza las entradas que apuntaban a ``src`` tras mover el fichero a ``dst``."""
+        with self._lock:
+            self._conn.execute("UPDATE files SET path = ? WHERE path = ?", (self._relative(dst), self._relative(src)))
+            self._conn.execute("UPDATE blobs SET path = ? WHERE path = ?", (self._relative(dst), self._relative(src)))
+            self._written()
+
+    def close(self):
+        with self._lock:
+            if self._pending:
+                self._commit()
+            self._conn.close()
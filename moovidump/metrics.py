@@ -0,0 +1,373 @@
+"""Metricas de la ejecucion (``--metrics-json``, ``--prometheus-textfile``) y perfilado (``--profile``)."""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from .settings import METRICS_LATENCY_BUCKETS
+
+
+class Metrics:
+    """Metricas de una ejecucion para ``--metrics-json`` y ``--prometheus-textfile``.
+
+    ``observe_response`` se engancha como hook de ``session`` y ve todas las
+    respuestas HTTP (ya con los reintentos de urllib3 aplicados): latencia por
+    ``wsfunction``, codigos HTTP y reintentos por tipo de peticion (``login``,
+    ``webservice`` o ``download``). El resto son contadores con etiqueta
+    (``count``), valores sueltos (``gauges``) y duracion de fases (``phase``).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.latency = {}
+        self.counters = {}
+        self.gauges = {}
+        self.phases = {}
+        # PhaseProfiler de --profile (None = sin perfilar)
+        self.profiler = None
+
+    def reset(self):
+        """Empieza una ejecucion nueva (cada ciclo de ``--watch``); conserva ``profiler``."""
+        with self._lock:
+            self.started_at = time.time()
+            self.latency = {}
+            self.counters = {}
+            self.gauges = {}
+            self.phases = {}
+
+    def count(self, name, label, n=1):
+        with self._lock:
+            values = self.counters.setdefault(name, {})
+            values[label] = values.get(label, 0) + n
+
+    def record_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            with self.profiler.phase(name) if self.profiler is not None else nullcontext():
+                yield
+        finally:
+            self.record_phase(name, time.perf_counter() - started)
+
+    def profiled(self, name, func):
+        """Devuelve ``func`` perfilada como ``name`` en el hilo que la ejecute (solo con ``--profile``)."""
+        return func if self.profiler is None else self.profiler.wrap(name, func)
+
+    def timed_iter(self, name, iterable):
+        """Recorre ``iterable`` sumando a la fase ``name`` solo el tiempo de espera de cada elemento."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def observe_response(self, response, *args, **kwargs):
+        request = response.request
+        path = urlparse(request.url).path
+        if path.endswith("/login/token.php"):
+            kind, function = "login", "login"
+        elif path.endswith("/webservice/rest/server.php"):
+            kind = "webservice"
+            params = parse_qs(urlparse(request.url).query)
+            if "wsfunction" not in params and request.body:
+                body = request.body.decode("utf-8", "replace") if isinstance(request.body, bytes) else str(request.body)
+                params = parse_qs(body)
+            function = (params.get("wsfunction") or ["unknown"])[0]
+        else:
+            kind, function = "download", None
+
+        retries = getattr(getattr(response.raw, "retries", None), "history", None) or ()
+        with self._lock:
+            codes = self.counters.setdefault("http_responses", {})
+            codes[(kind, response.status_code)] = codes.get((kind, response.status_code), 0) + 1
+            if retries:
+                retried = self.counters.setdefault("http_retries", {})
+                retried[kind] = retried.get(kind, 0) + len(retries)
+            if function is None:
+                return
+            seconds = response.elapsed.total_seconds()
+            entry = self.latency.setdefault(
+                function, {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(METRICS_LATENCY_BUCKETS)}
+            )
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            for i, bound in enumerate(METRICS_LATENCY_BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+
+    def summary(self):
+        with self._lock:
+            latency = {
+                function: {
+                    "count": e["count"],
+                    "sum_seconds": round(e["sum"], 6),
+                    "mean_seconds": round(e["sum"] / e["count"], 6) if e["count"] else None,
+                    "max_seconds": round(e["max"], 6),
+                    "buckets": {str(b): n for b, n in zip(METRICS_LATENCY_BUCKETS, e["buckets"])},
+                }
+                for function, e in sorted(self.latency.items())
+            }
+            responses = {}
+            for (kind, code), n in sorted(self.counters.get("http_responses", {}).items()):
+                responses.setdefault(kind, {})[str(code)] = n
+            return {
+                "started_at": int(self.started_at),
+                "finished_at": int(time.time()),
+                "phases_seconds": {name: round(sec, 3) for name, sec in self.phases.items()},
+                "webservice_latency": latency,
+                "http_responses": responses,
+                "http_retries": dict(self.counters.get("http_retries", {})),
+                "skip_reasons": dict(self.counters.get("files_skipped", {})),
+                "fail_reasons": dict(self.counters.get("files_failed", {})),
+                **self.gauges,
+            }
+
+    def write_json(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.summary(), indent=2, ensure_ascii=False), encoding="utf-8")
+
+    def write_prometheus(self, path):
+        """Escribe las metricas en formato texto de Prometheus (textfile collector de node_exporter)."""
+        data = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP moovidump_{name} {help_text}")
+            lines.append(f"# TYPE moovidump_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"moovidump_{name}{{{label_text}}} {value}" if label_text else f"moovidump_{name} {value}")
+
+        metric("last_run_timestamp_seconds", "gauge", "End of the last run (unix time).", [({}, data["finished_at"])])
+        metric("last_run_success", "gauge", "1 if the last run finished without errors.", [({}, int(bool(data.get("success"))))])
+        metric(
+            "phase_duration_seconds",
+            "gauge",
+            "Wall time spent in each phase of the last run.",
+            [({"phase": name}, sec) for name, sec in data["phases_seconds"].items()],
+        )
+        lines.append("# HELP moovidump_webservice_request_duration_seconds Webservice request latency.")
+        lines.append("# TYPE moovidump_webservice_request_duration_seconds histogram")
+        for function, e in data["webservice_latency"].items():
+            # Buckets are already cumulative (each counts requests <= its bound).
+            for bound, n in e["buckets"].items():
+                lines.append(f'moovidump_webservice_request_duration_seconds_bucket{{function="{function}",le="{bound}"}} {n}')
+            lines.append(f'moovidump_webservice_request_duration_seconds_bucket{{function="{function}",le="+Inf"}} {e["count"]}')
+            lines.append(f'moovidump_webservice_request_duration_seconds_sum{{function="{function}"}} {e["sum_seconds"]}')
+            lines.append(f'moovidump_webservice_request_duration_seconds_count{{function="{function}"}} {e["count"]}')
+        metric(
+            "http_responses_total",
+            "counter",
+            "HTTP responses by request kind and status code.",
+            [({"kind": kind, "code": code}, n) for kind, codes in data["http_responses"].items() for code, n in codes.items()],
+        )
+        metric(
+            "http_retries_total",
+            "counter",
+            "Requests retried by urllib3 (errors, 429, 5xx).",
+            [({"kind": kind}, n) for kind, n in data["http_retries"].items()],
+        )
+        metric(
+            "files_skipped_total",
+            "counter",
+            "Files not downloaded, by reason.",
+            [({"reason": reason}, n) for reason, n in data["skip_reasons"].items()],
+        )
+        metric(
+            "files_failed_total",
+            "counter",
+            "Files that could not be downloaded, by reason.",
+            [({"reason": reason}, n) for reason, n in data["fail_reasons"].items()],
+        )
+        if "files" in data:
+            metric(
+                "files",
+                "gauge",
+                "Files of the last run by result.",
+                [({"result": result}, n) for result, n in data["files"].items()],
+            )
+        for name, help_text in (
+            ("courses_failed", "Courses with at least one file that could not be downloaded."),
+            ("bytes_downloaded", "Bytes downloaded in the last run."),
+            ("download_bytes_per_second", "Average download throughput of the last run."),
+            ("bytes_saved", "Bytes not stored/downloaded thanks to --dedup."),
+            ("concurrency_limit", "Requests allowed in flight at the end of the last run (adaptive limit)."),
+            ("concurrency_limit_min", "Lowest adaptive limit of requests in flight during the last run."),
+            ("throttled_responses", "HTTP 429/503 responses (including retried ones) in the last run."),
+            ("retry_after_seconds", "Seconds new requests were paused because of Retry-After."),
+        ):
+            if name in data:
+                metric(name, "gauge", help_text, [({}, data[name])])
+
+        # Write-and-rename so node_exporter never reads a half-written file.
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        tmp.replace(path)
+
+
+class PhaseProfiler:
+    """Perfilado de ``--profile``: cProfile y tracemalloc por fase.
+
+    Las fases del hilo principal (``Metrics.phase``) pueden anidarse; el tiempo
+    de CPU de cProfile se atribuye solo a la fase mas interna, mientras que la
+    duracion y el pico de memoria de una fase incluyen los de sus fases
+    internas. El trabajo de los pools de hilos se perfila aparte con ``wrap``,
+    igual que las fases que se abren en otros hilos (la enumeracion corre en
+    un hilo de la tuberia de descarga).
+    """
+
+    def __init__(self, out_dir, top=25):
+        self.out_dir = Path(out_dir)
+        self.top = top
+        self.phases = {}
+        self.workers = {}
+        self._stack = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        tracemalloc.start()
+
+    def _checkpoint(self):
+        """Atribuye el pico de memoria desde el ultimo checkpoint a las fases abiertas."""
+        peak = tracemalloc.get_traced_memory()[1]
+        for name in self._stack:
+            self.phases[name]["peak"] = max(self.phases[name]["peak"], peak)
+        tracemalloc.reset_peak()
+
+    @staticmethod
+    def _enable(profile):
+        """``profile.enable()``; ``False`` si ya hay otro perfilador activo."""
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows a single active profiler per interpreter.
+            return False
+        return True
+
+    @contextmanager
+    def phase(self, name):
+        if threading.current_thread() is not threading.main_thread():
+            # Phases of pipeline threads (e.g. the enumeration) are profiled like ``wrap``.
+            with self._thread_call(name):
+                yield
+            return
+        entry = self.phases.setdefault(
+            name, {"profile": cProfile.Profile(), "calls": 0, "wall": 0.0, "cpu": 0.0, "peak": 0, "allocations": None}
+        )
+        self._checkpoint()
+        outer = self.phases[self._stack[-1]] if self._stack else None
+        if outer is not None:
+            outer["profile"].disable()
+        # Allocation snapshots are slow: only for top-level phases.
+        before = tracemalloc.take_snapshot() if outer is None else None
+        self._stack.append(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        active = self._enable(entry["profile"])
+        try:
+            yield
+        finally:
+            if active:
+                entry["profile"].disable()
+            entry["calls"] += 1
+            entry["wall"] += time.perf_counter() - wall
+            entry["cpu"] += time.process_time() - cpu
+            self._checkpoint()
+            self._stack.pop()
+            if before is not None:
+                diff = tracemalloc.take_snapshot().compare_to(before, "lineno")
+                entry["allocations"] = diff[: self.top]
+            if outer is not None:
+                self._enable(outer["profile"])
+
+    @contextmanager
+    def _thread_call(self, name):
+        """Perfila el bloque con el cProfile del hilo actual agrupado como ``name``."""
+        profile = getattr(self._local, name, None)
+        if profile is None:
+            profile = cProfile.Profile()
+            setattr(self._local, name, profile)
+            with self._lock:
+                self.workers.setdefault(name, {"profiles": [], "calls": 0, "wall": 0.0, "cpu": 0.0})["profiles"].append(profile)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        active = self._enable(profile)
+        try:
+            yield
+        finally:
+            if active:
+                profile.disable()
+            with self._lock:
+                entry = self.workers[name]
+                entry["calls"] += 1
+                entry["wall"] += time.perf_counter() - wall
+                entry["cpu"] += time.thread_time() - cpu
+
+    def wrap(self, name, func):
+        """Perfila las llamadas a ``func`` con un cProfile por hilo agrupado como ``name``."""
+
+        def run(*args, **kwargs):
+            with self._thread_call(name):
+                return func(*args, **kwargs)
+
+        return run
+
+    def _write_stats(self, name, stats):
+        stats.dump_stats(self.out_dir / f"{name}.prof")
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats("cumulative").print_stats(40)
+        (self.out_dir / f"{name}.txt").write_text(text.getvalue(), encoding="utf-8")
+
+    def report(self):
+        """Escribe ``<fase>.prof``/``<fase>.txt`` y ``allocations.txt``.
+
+        Devuelve filas ``(fase, llamadas, segundos, segundos_cpu, pico_bytes)``
+        para la tabla resumen (``pico_bytes`` es ``None`` en los pools de hilos).
+        """
+        while self._stack:
+            # Early exit (sys.exit inside a phase): close what is still open.
+            self.phases[self._stack.pop()]["profile"].disable()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+
+        rows = []
+        allocations = []
+        for name, entry in self.phases.items():
+            # Empty when enable() lost to another active profiler (Python 3.12+).
+            if entry["profile"].getstats():
+                self._write_stats(name, pstats.Stats(entry["profile"]))
+            rows.append((name, entry["calls"], entry["wall"], entry["cpu"], entry["peak"]))
+            if entry["allocations"]:
+                allocations.append(f"== {name} (net allocations, top {self.top}) ==")
+                allocations.extend(str(stat) for stat in entry["allocations"])
+                allocations.append("")
+        for name, entry in self.workers.items():
+            profiles = [p for p in entry["profiles"] if p.getstats()]
+            if profiles:
+                self._write_stats(name, pstats.Stats(*profiles))
+            rows.append((f"{name} (threads)", entry["calls"], entry["wall"], entry["cpu"], None))
+
+        snapshot = tracemalloc.take_snapshot()
+        allocations.append(f"== live at exit (top {self.top}) ==")
+        allocations.extend(str(stat) for stat in snapshot.statistics("lineno")[: self.top])
+        (self.out_dir / "allocations.txt").write_text("\n".join(allocations) + "\n", encoding="utf-8")
+        tracemalloc.stop()
+        return rows
+
@@ -0,0 +1,182 @@
+"""Etapas encadenadas por colas acotadas (productor/consumidor con contrapresion).
+
+``Dumper.download`` es una tuberia de cuatro etapas::
+
+    enumerar -> planificar -> descargar -> registrar
+
+Cada etapa corre en sus propios hilos y lee de la cola de la anterior. Las
+colas tienen tamano maximo, asi que una etapa lenta frena a las que van por
+delante en vez de acumular trabajo en memoria, y cada etapa se dimensiona por
+separado (``enum_jobs`` cursos a la vez, ``jobs`` descargas, una sola
+planificacion y un solo registro, que llevan el estado de la ejecucion).
+
+``Pipeline`` solo sabe de hilos y colas; que hace cada etapa lo decide quien
+la monta, de modo que la CLI, ``--profiles``, ``--watch`` y la GUI (que lanza
+``main.py``) comparten la misma tuberia a traves de ``Dumper``.
+"""
+
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Channel:
+    """Cola acotada entre dos etapas, con varios productores y consumidores.
+
+    Se recorre con ``for item in channel``, que termina cuando todos los
+    productores han llamado a ``close()``. ``cancel()`` descarta lo pendiente:
+    los consumidores terminan y ``put()`` devuelve ``False`` para que los
+    productores dejen de producir.
+    """
+
+    def __init__(self, name, maxsize=0, producers=1):
+        self.name = name
+        self.maxsize = maxsize
+        self._items = deque()
+        self._open = producers
+        self._cond = threading.Condition()
+        self.cancelled = False
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def put(self, item):
+        """Encola ``item`` esperando si la cola esta llena; ``False`` si se cancelo."""
+        with self._cond:
+            while self.maxsize and len(self._items) >= self.maxsize and not self.cancelled:
+                self._cond.wait()
+            if self.cancelled:
+                return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def close(self):
+        """Un productor ha terminado."""
+        with self._cond:
+            self._open -= 1
+            self._cond.notify_all()
+
+    def cancel(self):
+        with self._cond:
+            self.cancelled = True
+            self._items.clear()
+            self._cond.notify_all()
+
+    def __iter__(self):
+        while True:
+            with self._cond:
+                while not self._items and self._open > 0 and not self.cancelled:
+                    self._cond.wait()
+                if self.cancelled or not self._items:
+                    return
+                item = self._items.popleft()
+                self._cond.notify_all()
+            yield item
+
+
+class Pipeline:
+    """Hilos de las etapas y colas que las unen.
+
+    ``source``, ``stage`` y ``sink`` arrancan sus hilos en cuanto se llaman;
+    ``join()`` espera a que termine la ultima etapa. Si una etapa lanza una
+    excepcion se cancelan todas las colas (el resto de etapas acaba con lo que
+    tenga en curso) y ``join()`` la vuelve a lanzar en el hilo que llama.
+    """
+
+    def __init__(self, name="pipeline"):
+        self.name = name
+        self.error = None
+        self._channels = []
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self, name, workers, target):
+        for index in range(workers):
+            thread = threading.Thread(
+                target=self._guard,
+                args=(name, target),
+                name=f"{self.name}-{name}" + (f"_{index}" if workers > 1 else ""),
+                daemon=True,
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def _guard(self, name, target):
+        try:
+            target()
+        except BaseException as e:
+            logger.exception("Stage %s of %s failed: %s", name, self.name, e)
+            with self._lock:
+                if self.error is None:
+                    self.error = e
+            self.cancel()
+
+    def _channel(self, name, maxsize, producers):
+        channel = Channel(name, maxsize, producers)
+        self._channels.append(channel)
+        return channel
+
+    def source(self, name, iterable, maxsize=0):
+        """Etapa inicial: un hilo que vuelca ``iterable`` en la cola que devuelve."""
+        out = self._channel(name, maxsize, 1)
+
+        def run():
+            items = iter(iterable)
+            try:
+                for item in items:
+                    if not out.put(item):
+                        break
+            finally:
+                # Let generators release what they hold (HTTP streams, worker pools).
+                close = getattr(items, "close", None)
+                if close is not None:
+                    close()
+                out.close()
+
+        self._start(name, 1, run)
+        return out
+
+    def stage(self, name, func, inbox, maxsize=0, workers=1):
+        """Etapa intermedia: ``func(item)`` genera cero o mas elementos para la siguiente."""
+        out = self._channel(name, maxsize, workers)
+
+        def run():
+            try:
+                for item in inbox:
+                    for result in func(item):
+                        if not out.put(result):
+                            return
+            finally:
+                out.close()
+
+        self._start(name, workers, run)
+        return out
+
+    def sink(self, name, func, inbox, workers=1):
+        """Etapa final: ``func(item)`` para cada elemento de ``inbox``."""
+
+        def run():
+            for item in inbox:
+                func(item)
+
+        self._start(name, workers, run)
+
+    def cancel(self):
+        """Detiene todas las etapas (lo que ya esta en curso termina)."""
+        for channel in self._channels:
+            channel.cancel()
+
+    def join(self):
+        try:
+            for thread in self._threads:
+                thread.join()
+        except BaseException:
+            # Ctrl+C while waiting: stop the stages before propagating.
+            self.cancel()
+            raise
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,220 @@
+"""Varias cuentas y sitios en un mismo proceso (``--profiles perfiles.json``).
+
+El fichero es un JSON con opciones globales y una lista de perfiles::
+
+    {
+      "jobs": 8,
+      "max_rate": "4M",
+      "dedup": true,
+      "profiles": [
+        {"name": "ana", "site": "https://moovi.uvigo.gal", "username": "ana",
+         "password_env": "ANA_PASSWORD", "courses": [1678, 1679]},
+        {"name": "tutor", "site": "https://campus.example.org", "username": "tutor",
+         "password": "...", "dumps_dir": "dumps/tutor", "course_aliases": {"42": "Redes"}}
+      ]
+    }
+
+``jobs`` es el presupuesto global de descargas simultaneas, que comparten
+todos los perfiles, igual que ``max_rate``, ``host_rates`` (lista de
+``"HOST=RATE"``) y ``rate_schedule`` (lista de ``"HH:MM-HH:MM=RATE"``).
+Cada perfil tiene su propia sesion y su ``dumps_dir`` (por defecto
+``dumps/<name>``). Con ``dedup`` un fichero que ven varios perfiles del mismo
+sitio se descarga una sola vez y el resto lo enlaza (``SharedDedup``).
+
+Las opciones por perfil (``courses``, ``force``, ``full_sync``, ``tidy``,
+``dedup``, ``enum_jobs``, ``ws_batch_size``, ``stream_contents``,
+``attachments``, ``session_cache``, ``adaptive``, ``dump_all``,
+``full_sanitizer``, ``course_aliases``) pueden ir tambien en el nivel global
+como valor por defecto.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .dumper import Dumper, SharedDedup
+from .layout import Layout
+from .metrics import Metrics
+from .ratelimit import BandwidthLimiter, parse_host_rate, parse_rate, parse_rate_window
+from .settings import DOWNLOAD_JOBS, ENUM_JOBS, WS_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+PROFILE_OPTIONS = (
+    "courses",
+    "force",
+    "full_sync",
+    "tidy",
+    "dedup",
+    "enum_jobs",
+    "ws_batch_size",
+    "stream_contents",
+    "attachments",
+    "session_cache",
+    "adaptive",
+    "dump_all",
+    "full_sanitizer",
+    "course_aliases",
+)
+GLOBAL_OPTIONS = ("jobs", "max_rate", "host_rates", "rate_schedule")
+
+
+class ProfileError(ValueError):
+    """El fichero de perfiles no es valido."""
+
+
+class _ProfileEvents:
+    """Anade ``profile`` a los eventos de un perfil sobre un ``EventWriter`` comun."""
+
+    def __init__(self, events, name):
+        self.events = events
+        self.name = name
+
+    def emit(self, event, **fields):
+        self.events.emit(event, profile=self.name, **fields)
+
+
+def load_profiles(path, defaults=None):
+    """Lee y valida ``path``. Devuelve ``(opciones_globales, perfiles)``.
+
+    ``defaults`` (p. ej. los valores de la linea de comandos) se aplican antes
+    de las opciones globales del fichero, y estas antes de las de cada perfil.
+    """
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+    except OSError as e:
+        raise ProfileError(f"cannot read {path}: {e}") from e
+    except ValueError as e:
+        raise ProfileError(f"invalid JSON in {path}: {e}") from e
+    if not isinstance(data, dict) or not isinstance(data.get("profiles"), list) or not data["profiles"]:
+        raise ProfileError(f"{path}: expected an object with a non-empty \"profiles\" list")
+
+    unknown = set(data) - set(PROFILE_OPTIONS) - set(GLOBAL_OPTIONS) - {"profiles"}
+    if unknown:
+        raise ProfileError(f"{path}: unknown option(s): {', '.join(sorted(unknown))}")
+    options = {**(defaults or {}), **{k: v for k, v in data.items() if k != "profiles"}}
+    # Values coming from the command line are already parsed.
+    try:
+        if isinstance(options.get("max_rate"), str):
+            options["max_rate"] = parse_rate(options["max_rate"])
+        options["host_rates"] = [parse_host_rate(v) if isinstance(v, str) else tuple(v) for v in options.get("host_rates") or []]
+        options["rate_schedule"] = [
+            parse_rate_window(v) if isinstance(v, str) else tuple(v) for v in options.get("rate_schedule") or []
+        ]
+    except (argparse.ArgumentTypeError, TypeError, ValueError) as e:
+        raise ProfileError(f"{path}: {e}") from e
+
+    profiles = []
+    names = set()
+    for index, entry in enumerate(data["profiles"]):
+        if not isinstance(entry, dict):
+            raise ProfileError(f"{path}: profile #{index + 1} is not an object")
+        name = str(entry.get("name") or "").strip()
+        if not name or name in names:
+            raise ProfileError(f"{path}: profile #{index + 1} needs a unique \"name\"")
+        names.add(name)
+        unknown = set(entry) - set(PROFILE_OPTIONS) - {"name", "site", "username", "password", "password_env", "dumps_dir"}
+        if unknown:
+            raise ProfileError(f"profile {name}: unknown option(s): {', '.join(sorted(unknown))}")
+
+        password = entry.get("password")
+        if password is None and entry.get("password_env"):
+            password = os.getenv(entry["password_env"])
+        if not entry.get("site") or not entry.get("username") or not password:
+            raise ProfileError(f"profile {name}: \"site\", \"username\" and \"password\" (or \"password_env\") are required")
+
+        profile = {key: options[key] for key in PROFILE_OPTIONS if key in options}
+        profile.update({key: entry[key] for key in PROFILE_OPTIONS if key in entry})
+        courses = profile.get("courses", "all")
+        if courses != "all" and not (isinstance(courses, list) and all(str(c).isdigit() for c in courses)):
+            raise ProfileError(f"profile {name}: \"courses\" must be \"all\" or a list of course IDs")
+        profile.update(
+            name=name,
+            site=str(entry["site"]).rstrip("/"),
+            username=entry["username"],
+            password=password,
+            dumps_dir=entry.get("dumps_dir") or str(Path("dumps") / name),
+            courses=courses if courses == "all" else [int(c) for c in courses],
+            course_aliases={int(k): v for k, v in (profile.get("course_aliases") or {}).items()},
+        )
+        profiles.append(profile)
+    return options, profiles
+
+
+def run_profiles(options, profiles, dry_run=False, events=None):
+    """Ejecuta todos los perfiles a la vez; cada uno en su hilo.
+
+    Devuelve un dict por perfil con ``name``, ``ok``, ``error``, ``metrics`` y
+    ``stats`` (descarga) o ``plan`` (``dry_run``), en el orden de ``profiles``.
+    """
+    jobs = max(1, int(options.get("jobs") or DOWNLOAD_JOBS))
+    limiter = None
+    if options.get("max_rate") or options.get("host_rates") or options.get("rate_schedule"):
+        limiter = BandwidthLimiter(options.get("max_rate"), options.get("host_rates"), options.get("rate_schedule"))
+    shared_dedup = SharedDedup()
+    results = [{"name": p["name"], "ok": False, "error": None, "metrics": Metrics()} for p in profiles]
+
+    executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="download")
+    logger.info("Profiles: %d, concurrent downloads (shared): %d", len(profiles), jobs)
+
+    def run_one(profile, result):
+        dumper = Dumper(
+            profile["site"],
+            profile["username"],
+            profile["password"],
+            profile["dumps_dir"],
+            jobs=jobs,
+            enum_jobs=profile.get("enum_jobs", ENUM_JOBS),
+            ws_batch_size=profile.get("ws_batch_size", WS_BATCH_SIZE),
+            stream_contents=profile.get("stream_contents", False),
+            attachments=profile.get("attachments", True),
+            force=profile.get("force", False),
+            full_sync=profile.get("full_sync", False),
+            dedup=profile.get("dedup", False),
+            tidy=profile.get("tidy", False),
+            session_cache=profile.get("session_cache", True),
+            adaptive=profile.get("adaptive", True),
+            layout=Layout(profile.get("dump_all", False), profile.get("full_sanitizer", False), profile["course_aliases"]),
+            metrics=result["metrics"],
+            events=_ProfileEvents(events, profile["name"]) if events is not None else None,
+            executor=executor,
+            limiter=limiter,
+            shared_dedup=shared_dedup,
+        )
+        try:
+            if not dumper.login():
+                result["error"] = "login failed"
+                return
+            courses = dumper.list_courses()
+            if not courses:
+                result["error"] = "no courses"
+                return
+            if profile["courses"] != "all":
+                courses = [c for c in courses if c.get("id") in profile["courses"]]
+            logger.info("[%s] %d course(s) selected", profile["name"], len(courses))
+            if dry_run:
+                result["plan"] = dumper.plan(courses)
+                result["ok"] = result["plan"]["disk"]["fits"]
+            else:
+                result["stats"] = dumper.download(courses)
+                result["ok"] = not result["stats"]["out_of_space"]
+        except Exception as e:
+            logger.exception("[%s] Unexpected error: %s", profile["name"], e)
+            result["error"] = str(e)
+
+    threads = [
+        threading.Thread(target=run_one, args=(profile, result), name=f"profile-{profile['name']}")
+        for profile, result in zip(profiles, results)
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        executor.shutdown(wait=True)
+    return results
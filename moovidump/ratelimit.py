@@ -0,0 +1,134 @@
+"""Limitacion del ancho de banda de descarga (``--max-rate``, ``--host-rate``, ``--rate-schedule``)."""
+
+import argparse
+import re
+import threading
+import time
+
+from .settings import DOWNLOAD_CHUNK_SIZE
+
+
+def parse_rate(value):
+    """Convierte ``"500K"``, ``"2M"``, ``"1.5MB/s"`` o ``"0"`` (sin limite) a bytes/s."""
+    text = str(value).strip().upper().replace("/S", "").rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    factor = units.get(text[-1:], 1)
+    if text[-1:] in units:
+        text = text[:-1]
+    try:
+        rate = float(text) * factor
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid rate: {value!r} (use e.g. 500K, 2M)")
+    if rate < 0:
+        raise argparse.ArgumentTypeError(f"invalid rate: {value!r}")
+    return rate or None
+
+
+def parse_rate_window(value):
+    """Convierte ``"08:00-20:00=1M"`` a ``(inicio_min, fin_min, bytes/s)``."""
+    match = re.fullmatch(r"\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(\S+)\s*", str(value))
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid schedule: {value!r} (use HH:MM-HH:MM=RATE)")
+    h1, m1, h2, m2 = (int(g) for g in match.groups()[:4])
+    return h1 * 60 + m1, h2 * 60 + m2, parse_rate(match.group(5))
+
+
+def parse_host_rate(value):
+    """Convierte ``"moovi.uvigo.gal=1M"`` a ``(host, bytes/s)``."""
+    host, sep, rate = str(value).partition("=")
+    if not sep or not host.strip():
+        raise argparse.ArgumentTypeError(f"invalid host rate: {value!r} (use HOST=RATE)")
+    return host.strip().lower(), parse_rate(rate)
+
+
+class TokenBucket:
+    """Cubo de tokens (bytes) compartido entre hilos.
+
+    ``rate`` puede ser un numero (bytes/s) o una funcion sin argumentos que
+    devuelve el limite vigente (``None`` = sin limite), lo que permite cambiar
+    el limite segun la hora. Los consumidores reservan bytes aunque el saldo
+    quede negativo y duermen lo necesario para devolver la deuda, de modo que
+    no hay espera activa y el reparto entre descargas es justo.
+    """
+
+    def __init__(self, rate, burst_seconds=0.25, min_burst=DOWNLOAD_CHUNK_SIZE):
+        self._rate = rate if callable(rate) else (lambda: rate)
+        self._burst_seconds = burst_seconds
+        self._min_burst = min_burst
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._last = time.monotonic()
+
+    def current_rate(self):
+        return self._rate()
+
+    def consume(self, nbytes):
+        """Descuenta ``nbytes`` y duerme si se ha superado el limite. Devuelve los segundos esperados."""
+        rate = self._rate()
+        if not rate:
+            return 0.0
+        burst = max(rate * self._burst_seconds, self._min_burst)
+        with self._lock:
+            now = time.monotonic()
+            if self._tokens is None:
+                self._tokens = burst
+            self._tokens = min(burst, self._tokens + (now - self._last) * rate) - nbytes
+            self._last = now
+            delay = -self._tokens / rate if self._tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class BandwidthLimiter:
+    """Limita el ancho de banda de descarga global, por host y por franja horaria.
+
+    ``throttle(host, nbytes)`` se llama desde ``download_to_path`` tras cada
+    bloque recibido, desde cualquier numero de hilos. Tambien acumula los bytes
+    y el tiempo de espera para comparar el caudal conseguido con el permitido.
+    """
+
+    def __init__(self, max_rate=None, host_rates=None, schedule=None):
+        self.max_rate = max_rate
+        self.schedule = list(schedule or [])
+        self._global = TokenBucket(self.allowed_rate)
+        self._hosts = {host: TokenBucket(rate) for host, rate in (host_rates or []) if rate}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.waited = 0.0
+        self._first = None
+        self._last = None
+
+    def allowed_rate(self, now=None):
+        """Limite global vigente: el de la franja horaria actual o ``max_rate``."""
+        now = now or time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self.schedule:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return rate
+        return self.max_rate
+
+    def throttle(self, host, nbytes):
+        waited = self._global.consume(nbytes)
+        bucket = self._hosts.get((host or "").lower())
+        if bucket is not None:
+            waited += bucket.consume(nbytes)
+        now = time.monotonic()
+        with self._lock:
+            self.bytes += nbytes
+            self.waited += waited
+            if self._first is None:
+                self._first = now
+            self._last = now
+
+    def achieved_rate(self):
+        """Caudal medio (bytes/s) entre el primer y el ultimo bloque recibidos."""
+        with self._lock:
+            if self._first is None or self._last <= self._first:
+                return 0.0
+            return self.bytes / (self._last - self._first)
+
+
+def format_rate(rate):
+    return "sin limite" if not rate else f"{rate / (1024 * 1024):.2f} MB/s"
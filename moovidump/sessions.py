@@ -0,0 +1,62 @@
+"""Cache de sesiones (token y datos del usuario) por sitio y usuario."""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from .settings import SESSION_CACHE_FILE
+
+logger = logging.getLogger(__name__)
+# Varios perfiles (``--profiles``) pueden renovar su sesion a la vez
+_cache_lock = threading.Lock()
+
+
+def _read_session_cache():
+    try:
+        data = json.loads(SESSION_CACHE_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _write_session_cache(data):
+    """Escribe la cache de sesiones de forma atomica y solo legible por el usuario."""
+    SESSION_CACHE_FILE.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    tmp = SESSION_CACHE_FILE.with_suffix(".tmp")
+    fd = os.open(str(tmp), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.chmod(tmp, 0o600)
+    tmp.replace(SESSION_CACHE_FILE)
+
+
+def load_cached_session(site, username):
+    """Devuelve el token/userid/clave privada guardados para ``site`` + ``username`` o ``None``."""
+    entry = _read_session_cache().get(f"{site}|{username}")
+    if not isinstance(entry, dict) or not entry.get("token") or not entry.get("userid"):
+        return None
+    return entry
+
+
+def save_cached_session(site, username, session_data):
+    """Guarda ``session_data`` (token, userid, userprivateaccesskey) en la cache."""
+    try:
+        with _cache_lock:
+            data = _read_session_cache()
+            data[f"{site}|{username}"] = {**session_data, "saved_at": int(time.time())}
+            _write_session_cache(data)
+    except OSError as e:
+        logger.warning("Could not write session cache %s: %s", SESSION_CACHE_FILE, e)
+
+
+def clear_cached_session(site, username):
+    with _cache_lock:
+        data = _read_session_cache()
+        if data.pop(f"{site}|{username}", None) is None:
+            return
+        try:
+            _write_session_cache(data)
+        except OSError as e:
+            logger.debug("Could not update session cache %s: %s", SESSION_CACHE_FILE, e)
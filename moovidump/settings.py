@@ -0,0 +1,78 @@
+"""Valores por defecto de red, descargas y enumeracion.
+
+La CLI y ``Dumper`` reciben los valores que pueden cambiarse por argumento
+(``--jobs``...); el resto se ajusta editando este fichero.
+"""
+
+from pathlib import Path
+
+HEADERS = {"Content-Type": "application/x-www-form-urlencoded", "X-Requested-With": "com.moodle.moodlemobile"}
+
+# Network / runtime defaults
+TIMEOUT = 30
+RETRIES = 3
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Limites del tamano de lectura adaptativo y tiempo objetivo por lectura
+DOWNLOAD_MAX_CHUNK_SIZE = 4 * 1024 * 1024
+DOWNLOAD_CHUNK_TARGET_SECONDS = 0.1
+# Lee el cuerpo con readinto() sobre un buffer reutilizado en vez de iter_content()
+DOWNLOAD_READINTO = True
+# Reserva el tamano del .part al empezar para reducir la fragmentacion
+DOWNLOAD_PREALLOCATE = True
+DOWNLOAD_CONNECT_TIMEOUT = 15
+DOWNLOAD_RETRY_ATTEMPTS = 2
+DOWNLOAD_PROGRESS_EVERY_MB = 5
+DOWNLOAD_JOBS = 4
+MANIFEST_FILENAME = ".manifest.sqlite3"
+# El manifiesto confirma (fsync) cada tantos ficheros registrados o segundos, y al cerrar
+MANIFEST_COMMIT_EVERY = 500
+MANIFEST_COMMIT_SECONDS = 5
+# Historial de contenidos por curso con DUMP_ALL y registros entre bases completas
+SNAPSHOT_FILENAME = "snapshots.ndjson.gz"
+SNAPSHOT_BASE_EVERY = 50
+SESSION_CACHE_FILE = Path.home() / ".moovidump" / "sessions.json"
+# Margen al preguntar por cambios desde la ultima sincronizacion (desfase de relojes)
+SYNC_CLOCK_SKEW = 10 * 60
+# Cada cuanto se fuerza una enumeracion completa aunque Moodle no indique cambios
+FULL_SYNC_INTERVAL = 7 * 24 * 3600
+# Descargas encoladas por worker antes de esperar a que termine alguna
+DOWNLOAD_QUEUE_FACTOR = 4
+# Colas de la tuberia de descarga: secciones enumeradas pendientes de planificar
+# y descargas terminadas pendientes de registrar en el manifiesto
+PIPELINE_SECTIONS_QUEUE = 8
+PIPELINE_RESULTS_QUEUE = 64
+# Peticiones simultaneas de core_course_get_contents durante la enumeracion
+ENUM_JOBS = 4
+# Llamadas agrupadas por peticion a tool_mobile_call_external_functions (1 = sin agrupar)
+WS_BATCH_SIZE = 10
+# Cursos por llamada a mod_assign_get_assignments / mod_forum_get_forums_by_courses
+# al recoger los adjuntos de tareas y foros
+ATTACHMENT_COURSES_PER_CALL = 25
+# Secciones ya leidas (por curso) que esperan a ser procesadas al leer
+# core_course_get_contents en streaming; acota la memoria de cursos enormes
+CONTENTS_STREAM_QUEUE = 8
+# Segundos que una respuesta en streaming espera a un consumidor atascado antes
+# de leer el resto del curso a memoria (y no dejar la conexion abierta a medias)
+CONTENTS_STREAM_STALL = 10
+# Limites (segundos) del histograma de latencia de las llamadas al webservice
+METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Control adaptativo de peticiones simultaneas (AIMD): limite minimo, factor
+# de recorte ante un 429/503, segundos minimos entre aumentos, latencia (veces
+# la minima observada) y tasa de errores a partir de las que el limite deja de
+# crecer, y pausa maxima (s) que se respeta de un Retry-After
+CONCURRENCY_MIN = 1
+CONCURRENCY_DECREASE = 0.5
+CONCURRENCY_GROW_INTERVAL = 2.0
+CONCURRENCY_LATENCY_FACTOR = 2.0
+CONCURRENCY_MAX_ERROR_RATE = 0.05
+CONCURRENCY_MAX_PAUSE = 5 * 60
+# Espacio libre que se deja siempre en el volumen de destino
+DISK_FREE_MARGIN = 100 * 1024 * 1024
+# Ejecuciones recientes usadas para estimar el caudal (ETA de --dry-run)
+THROUGHPUT_HISTORY_RUNS = 10
+# --watch: intervalo por defecto entre sincronizaciones, variacion aleatoria
+# (fraccion del intervalo) y espera maxima tras ciclos fallidos seguidos
+WATCH_INTERVAL = 15 * 60
+WATCH_JITTER = 0.1
+WATCH_MAX_BACKOFF = 2 * 3600
@@ -0,0 +1,382 @@
+"""Historial compacto del contenido de cada curso (modo ``DUMP_ALL``).
+
+En vez de reescribir en cada ejecucion ``contents.json``, ``section.json`` y
+``module.json`` (los mismos datos hasta tres veces, en miles de ficheros), cada
+curso guarda un unico ``snapshots.ndjson.gz`` al que cada ejecucion anade un
+registro. El fichero es una serie de miembros gzip concatenados (uno por
+registro) con una linea JSON por elemento:
+
+- ``{"record": T, "course_id": ID, "base": true|false}`` abre el registro.
+- ``{"s": CLAVE, "section": {...}}``: una seccion nueva o modificada, con
+  ``modules`` reducido a la lista de claves de sus modulos.
+- ``{"m": CLAVE, "module": {...}}``: un modulo nuevo o modificado.
+- ``{"end": T, "order": [CLAVES]}`` cierra el registro con el orden de las
+  secciones. Un registro sin ``end`` (ejecucion interrumpida) se ignora.
+
+Los modulos se guardan como se descargaron, es decir, con los adjuntos de
+tareas y foros (``moovidump.attachments``) ya anadidos a sus ``contents``.
+
+Un registro ``base`` contiene todas las secciones y modulos; los demas solo lo
+que cambio respecto al anterior (las claves son los ``id`` de Moodle). Cada
+``SNAPSHOT_BASE_EVERY`` registros se escribe una base nueva y el fichero
+anterior se archiva como ``snapshots-AAAAMMDDHHMMSSNN.ndjson.gz``, de modo que
+leer el estado previo no cuesta mas con el tiempo.
+
+Para volver a obtener la estructura antigua (``contents.json`` y los JSON por
+seccion y modulo)::
+
+    python -m moovidump.snapshots dumps                 # ultimo estado de cada curso
+    python -m moovidump.snapshots dumps --course 1678 --at 2026-03-01 --out /tmp/fmi
+    python -m moovidump.snapshots dumps --list
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+from .settings import SNAPSHOT_BASE_EVERY, SNAPSHOT_FILENAME
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT_GLOB = "snapshots-*.ndjson.gz"
+
+
+def _digest(value):
+    text = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _section_key(section, index):
+    return str(section["id"]) if section.get("id") is not None else f"#{index}"
+
+
+def _module_key(section_key, module, index):
+    return str(module["id"]) if module.get("id") is not None else f"{section_key}#{index}"
+
+
+def _read_lines(path):
+    """Lineas JSON de ``path``; un final cortado (escritura interrumpida) lanza ``ValueError``."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    except (EOFError, OSError, zlib.error) as e:
+        raise ValueError(f"{path}: {e}") from e
+
+
+def iter_records(path, load=True):
+    """Genera ``(cabecera, elementos, fin)`` de cada registro completo de ``path``.
+
+    ``elementos`` es la lista de lineas ``s``/``m`` del registro; con
+    ``load=False`` solo se guardan sus claves y una huella, sin el contenido.
+    """
+    header = None
+    items = []
+    for entry in _read_lines(path):
+        if "record" in entry:
+            header, items = entry, []
+        elif header is None:
+            continue
+        elif "end" in entry:
+            yield header, items, entry
+            header, items = None, []
+        elif load:
+            items.append(entry)
+        else:
+            kind = "s" if "s" in entry else "m"
+            value = entry.get("section") if kind == "s" else entry.get("module")
+            items.append({kind: entry[kind], "digest": _digest(value)})
+
+
+class CourseState:
+    """Estado de un curso tras aplicar registros: secciones, modulos y orden."""
+
+    def __init__(self):
+        self.sections = {}
+        self.modules = {}
+        self.order = []
+        self.records = 0
+        self.time = None
+
+    def apply(self, header, items, end):
+        if header.get("base"):
+            self.sections, self.modules = {}, {}
+            self.records = 0
+        for item in items:
+            if "s" in item:
+                self.sections[item["s"]] = item.get("section", item.get("digest"))
+            else:
+                self.modules[item["m"]] = item.get("module", item.get("digest"))
+        self.order = list(end.get("order") or [])
+        self.records += 1
+        self.time = end["end"]
+
+    def contents(self):
+        """La respuesta de ``core_course_get_contents`` reconstruida."""
+        contents = []
+        for key in self.order:
+            section = self.sections[key]
+            contents.append({**section, "modules": [self.modules[m] for m in section.get("modules") or []]})
+        return contents
+
+
+class SnapshotLog:
+    """``snapshots.ndjson.gz`` de un curso (ver el docstring del modulo)."""
+
+    def __init__(self, course_dir):
+        self.course_dir = Path(course_dir)
+        self.path = self.course_dir / SNAPSHOT_FILENAME
+
+    def segments(self):
+        """Ficheros del historial, del mas antiguo al actual."""
+        paths = sorted(self.course_dir.glob(_SEGMENT_GLOB))
+        if self.path.exists():
+            paths.append(self.path)
+        return paths
+
+    def state(self, at=None, load=True):
+        """Estado del curso en el ultimo registro con ``end <= at`` (``None`` = el ultimo).
+
+        Devuelve ``None`` si no hay ningun registro. Con ``load=False`` solo
+        guarda huellas (lo que necesita ``open_record`` para calcular el delta).
+        """
+        segments = self.segments() if at is not None else self.segments()[-1:]
+        state = None
+        for path in segments:
+            for header, items, end in iter_records(path, load):
+                if at is not None and end["end"] > at:
+                    return state
+                if state is None:
+                    state = CourseState()
+                state.apply(header, items, end)
+        return state
+
+    def open_record(self, course_id):
+        """Empieza el registro de esta ejecucion; devuelve un ``SnapshotRecord``."""
+        previous = None
+        if self.path.exists():
+            try:
+                previous = self.state(load=False)
+            except ValueError as e:
+                # Interrupted append: keep the damaged file aside and start over.
+                logger.warning("Snapshot log damaged (%s); starting a new one", e)
+                self.archive(damaged=True)
+        base = previous is None or previous.records >= SNAPSHOT_BASE_EVERY
+        return SnapshotRecord(self, course_id, None if base else previous)
+
+    def archive(self, damaged=False):
+        """Mueve el fichero actual a ``snapshots-AAAAMMDDHHMMSSNN.ndjson.gz``.
+
+        Uno ``damaged`` se guarda con ``.damaged`` al final, fuera del historial.
+        """
+        if not self.path.exists():
+            return
+        stamp = time.strftime("%Y%m%d%H%M%S")
+        for counter in range(100):
+            target = self.course_dir / f"snapshots-{stamp}{counter:02d}.ndjson.gz{'.damaged' if damaged else ''}"
+            if not target.exists():
+                break
+        os.replace(self.path, target)
+
+
+class SnapshotRecord:
+    """Registro en curso: ``add(section)`` por cada seccion, luego ``close()`` o ``abort()``.
+
+    Las lineas se comprimen en un ``.part`` aparte y solo se anaden al historial
+    en ``close()``, asi que un curso que llega incompleto no deja un registro
+    a medias. ``previous`` (huellas del estado anterior) es ``None`` para una
+    base completa.
+    """
+
+    def __init__(self, log, course_id, previous):
+        self.log = log
+        self.course_id = course_id
+        self.previous = previous
+        self.order = []
+        self._numbers = {}
+        self.changed = 0
+        log.course_dir.mkdir(parents=True, exist_ok=True)
+        self._part = log.path.with_name(log.path.name + ".part")
+        self._file = gzip.open(self._part, "wt", encoding="utf-8")
+        self._write({"record": int(time.time()), "course_id": course_id, "base": previous is None})
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def _changed(self, kind, key, value):
+        return self.previous is None or getattr(self.previous, kind).get(key) != _digest(value)
+
+    def add(self, section):
+        section_key = _section_key(section, len(self.order))
+        module_keys = []
+        for index, module in enumerate(section.get("modules") or []):
+            module_key = _module_key(section_key, module, index)
+            module_keys.append(module_key)
+            if self._changed("modules", module_key, module):
+                self._write({"m": module_key, "module": module})
+                self.changed += 1
+        header = {**section, "modules": module_keys}
+        if self._changed("sections", section_key, header):
+            self._write({"s": section_key, "section": header})
+            self.changed += 1
+        self.order.append(section_key)
+        self._numbers[section_key] = section.get("section")
+
+    def close(self):
+        """Anade el registro al historial (archivando el anterior si es una base)."""
+        if self._file is None:
+            return
+        if all(isinstance(number, int) for number in self._numbers.values()):
+            # Sections that waited for their attachments arrive late: keep Moodle's order.
+            self.order.sort(key=self._numbers.get)
+        self._write({"end": int(time.time()), "order": self.order})
+        self._file.close()
+        self._file = None
+        if self.previous is None:
+            self.log.archive()
+        # gzip members can be concatenated: appending keeps earlier records intact.
+        with open(self._part, "rb") as src, open(self.log.path, "ab") as dst:
+            while True:
+                block = src.read(1024 * 1024)
+                if not block:
+                    break
+                dst.write(block)
+        self._part.unlink()
+
+    def abort(self):
+        """Descarta el registro (contenido incompleto)."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._part.unlink(missing_ok=True)
+
+
+def write_json_files(layout, course_dir, contents):
+    """Escribe ``contents.json`` y el ``section.json``/``module.json`` de cada seccion y modulo.
+
+    Es el formato de ``DUMP_ALL`` anterior a este historial, en las carpetas que
+    usa ``layout`` para las descargas.
+    """
+    course_dir.mkdir(parents=True, exist_ok=True)
+    with open(course_dir / "contents.json", "w", encoding="utf-8") as f:
+        json.dump(contents, f, indent=2, ensure_ascii=False)
+    for section in contents:
+        section_dir = course_dir / "sections" / layout.section_folder_name(section)
+        section_dir.mkdir(parents=True, exist_ok=True)
+        with open(section_dir / "section.json", "w", encoding="utf-8") as f:
+            json.dump(section, f, indent=2, ensure_ascii=False)
+        for module_index, module in enumerate(section.get("modules", [])):
+            module_dir = section_dir / layout.module_folder_name(module, module_index)
+            module_dir.mkdir(parents=True, exist_ok=True)
+            with open(module_dir / "module.json", "w", encoding="utf-8") as f:
+                json.dump(module, f, indent=2, ensure_ascii=False)
+
+
+def _parse_when(value):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value!r} (use a unix time or 2026-03-01[T12:00])")
+
+
+def _course_dirs(dumps_dir):
+    for path in sorted(Path(dumps_dir).iterdir()):
+        if path.is_dir() and SnapshotLog(path).segments():
+            yield path
+
+
+def _course_id(log):
+    """``course_id`` de la primera cabecera del historial (sin leer el resto)."""
+    for entry in _read_lines(log.segments()[0]):
+        return entry.get("course_id")
+    return None
+
+
+def _print_records(log):
+    header = None
+    changed = 0
+    for path in log.segments():
+        for entry in _read_lines(path):
+            if "record" in entry:
+                header, changed = entry, 0
+            elif "end" in entry and header is not None:
+                print(
+                    f"{log.course_dir.name}\t{header.get('course_id')}\t"
+                    f"{datetime.fromtimestamp(entry['end']).isoformat(sep=' ')}\t"
+                    f"{'base' if header.get('base') else 'delta'}\t{changed} changed\t"
+                    f"{len(entry.get('order') or [])} sections"
+                )
+                header = None
+            else:
+                changed += 1
+
+
+def main(argv=None):
+    """``python -m moovidump.snapshots``: lista o reconstruye los JSON por seccion/modulo."""
+    from .layout import Layout
+
+    p = argparse.ArgumentParser(description="Rebuild contents.json/section.json/module.json from snapshots.ndjson.gz")
+    p.add_argument("dumps_dir", help="Dumps folder (or a single course folder)")
+    p.add_argument("--course", type=int, action="append", default=[], help="Only this course ID (repeatable)")
+    p.add_argument("--at", type=_parse_when, default=None, help="State at this time (unix time or ISO date) instead of the latest")
+    p.add_argument("--out", default=None, help="Write into OUT/<course folder> instead of the course folder itself")
+    p.add_argument("--full-sanitizer", action="store_true", help="Same as FULL_SANITIZER = True in main.py")
+    p.add_argument("--list", action="store_true", help="List the records of each course instead of rebuilding")
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    root = Path(args.dumps_dir)
+    if SnapshotLog(root).segments():
+        course_dirs = [root]
+    else:
+        course_dirs = list(_course_dirs(root)) if root.is_dir() else []
+    if not course_dirs:
+        logger.error("No %s found under %s", SNAPSHOT_FILENAME, root)
+        return 1
+
+    layout = Layout(dump_all=True, full_sanitizer=args.full_sanitizer)
+    status = 0
+    for course_dir in course_dirs:
+        log = SnapshotLog(course_dir)
+        try:
+            if args.course and _course_id(log) not in args.course:
+                continue
+            if args.list:
+                _print_records(log)
+                continue
+            state = log.state(at=args.at)
+        except ValueError as e:
+            logger.error("%s", e)
+            status = 1
+            continue
+        if state is None:
+            logger.warning("%s: no snapshot at that time", course_dir.name)
+            continue
+        target = Path(args.out) / course_dir.name if args.out else course_dir
+        write_json_files(layout, target, state.contents())
+        logger.info(
+            "%s: %d section(s) as of %s -> %s",
+            course_dir.name,
+            len(state.order),
+            datetime.fromtimestamp(state.time).isoformat(sep=" "),
+            target,
+        )
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
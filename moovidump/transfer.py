@@ -0,0 +1,325 @@
+"""Descarga de ficheros: streaming a ``.part``, reanudacion con ``Range`` y hardlinks."""
+
+import hashlib
+import http.client
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+
+from .settings import (
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_CHUNK_TARGET_SECONDS,
+    DOWNLOAD_CONNECT_TIMEOUT,
+    DOWNLOAD_MAX_CHUNK_SIZE,
+    DOWNLOAD_PREALLOCATE,
+    DOWNLOAD_PROGRESS_EVERY_MB,
+    DOWNLOAD_READINTO,
+    DOWNLOAD_RETRY_ATTEMPTS,
+    DOWNLOAD_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(src, dst):
+    """Materializa ``dst`` como hardlink de ``src`` (o copia si no es posible).
+
+    Devuelve ``True`` si se pudo crear un hardlink (no ocupa espacio extra).
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_suffix(f"{dst.suffix}.link")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+        linked = True
+    except OSError:
+        # Cross-device or filesystem without hardlinks: at least avoid the download.
+        shutil.copy2(src, tmp)
+        linked = False
+    tmp.replace(dst)
+    return linked
+
+
+def _part_paths(target_path):
+    """Rutas del fichero parcial y de sus metadatos para ``target_path``."""
+    return (
+        target_path.with_suffix(f"{target_path.suffix}.part"),
+        target_path.with_suffix(f"{target_path.suffix}.part.json"),
+    )
+
+
+def _discard_partial(temp_path, meta_path):
+    for path in (temp_path, meta_path):
+        try:
+            path.unlink(missing_ok=True)
+        except Exception:
+            pass
+
+
+def _hash_file(path, hash_name, hexdigest=True):
+    hasher = hashlib.new(hash_name)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest() if hexdigest else hasher
+
+
+def _resume_offset(temp_path, meta_path, validator):
+    """Bytes reutilizables de un ``.part`` previo, o 0 si hay que empezar de cero.
+
+    Solo se reanuda si los metadatos guardados junto al parcial coinciden con
+    ``validator`` (``filesize``/``timemodified`` del contenido); asi un fichero
+    que ha cambiado en el servidor nunca se empalma con bytes antiguos.
+    """
+    if not temp_path.exists():
+        return 0
+    try:
+        saved = json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        saved = None
+    # A preallocated partial that was never truncated (the process died) has
+    # an unknown amount of real data followed by zeros: it cannot be resumed.
+    if (
+        not isinstance(saved, dict)
+        or saved.get("preallocated")
+        or {key: saved.get(key) for key in validator} != validator
+        or all(v is None for v in validator.values())
+    ):
+        logger.debug("Discarding stale partial download %s", temp_path)
+        _discard_partial(temp_path, meta_path)
+        return 0
+    return temp_path.stat().st_size
+
+
+def _content_range_matches(content_range, offset, expected_size):
+    """``True`` si ``Content-Range`` continua exactamente desde ``offset``."""
+    match = re.match(r"bytes (\d+)-\d+/(\d+|\*)", content_range)
+    if not match or int(match.group(1)) != offset:
+        return False
+    total = match.group(2)
+    return expected_size is None or total == "*" or int(total) == expected_size
+
+
+def iter_response_chunks(response):
+    """Genera el cuerpo de ``response`` en bloques con el minimo de copias.
+
+    Si la respuesta no esta comprimida, lee con ``readinto()`` del
+    ``urllib3.HTTPResponse`` (``response.raw``, API publica) sobre un unico
+    ``bytearray`` reutilizado y genera ``memoryview`` de el (solo validas hasta
+    el siguiente bloque). El tamano de lectura se adapta entre
+    ``DOWNLOAD_CHUNK_SIZE`` y ``DOWNLOAD_MAX_CHUNK_SIZE`` para que cada lectura
+    dure alrededor de ``DOWNLOAD_CHUNK_TARGET_SECONDS``. En cualquier otro caso
+    usa ``iter_content()``.
+    """
+    encoding = response.headers.get("Content-Encoding", "identity").strip().lower()
+    if not DOWNLOAD_READINTO or encoding not in ("", "identity") or not hasattr(response.raw, "readinto"):
+        yield from response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        return
+
+    buffer = bytearray(DOWNLOAD_MAX_CHUNK_SIZE)
+    view = memoryview(buffer)
+    size = DOWNLOAD_CHUNK_SIZE
+    while True:
+        started = time.monotonic()
+        # Same exception mapping as requests' iter_content().
+        try:
+            n = response.raw.readinto(view[:size])
+        except urllib3.exceptions.ReadTimeoutError as e:
+            raise requests.exceptions.ReadTimeout(e) from e
+        except urllib3.exceptions.SSLError as e:
+            raise requests.exceptions.SSLError(e) from e
+        except (urllib3.exceptions.ProtocolError, http.client.HTTPException, OSError) as e:
+            raise requests.exceptions.ChunkedEncodingError(e) from e
+        if not n:
+            break
+        elapsed = time.monotonic() - started
+        if n == size and size < DOWNLOAD_MAX_CHUNK_SIZE and elapsed < DOWNLOAD_CHUNK_TARGET_SECONDS / 2:
+            size *= 2
+        elif size > DOWNLOAD_CHUNK_SIZE and elapsed > DOWNLOAD_CHUNK_TARGET_SECONDS * 2:
+            size //= 2
+        yield view[:n]
+
+
+def _preallocate(f, size):
+    """Reserva ``size`` bytes para ``f``. Devuelve ``True`` si el fichero crecio."""
+    if not DOWNLOAD_PREALLOCATE or not size or size <= 0:
+        return False
+    try:
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(f.fileno(), 0, size)
+        else:
+            f.truncate(size)
+    except OSError as e:
+        logger.debug("Could not preallocate %d bytes for %s: %s", size, f.name, e)
+        return False
+    return True
+
+
+def download_to_path(session, download_url, target_path, expected_size=None, timemodified=None, hash_name=None, limiter=None):
+    """Descarga robusta a disco usando streaming y archivo temporal.
+
+    Los bytes se escriben en ``<nombre>.part``. Si la descarga se interrumpe, el
+    parcial se conserva (entre reintentos y entre ejecuciones) y se reanuda con
+    ``Range: bytes=N-`` cuando ``expected_size``/``timemodified`` siguen
+    coincidiendo con los del parcial; si el servidor responde 200 en vez de 206
+    se vuelve a descargar desde cero.
+
+    Devuelve (ok, bytes_written, digest), donde ``bytes_written`` es el tamano
+    final del fichero (incluidos los bytes reanudados) y ``digest`` el hash
+    hexadecimal del contenido si se pidio con ``hash_name`` (p. ej. ``"sha256"``).
+    ``limiter`` es el ``BandwidthLimiter`` compartido, si lo hay.
+    """
+    temp_path, meta_path = _part_paths(target_path)
+    validator = {"filesize": expected_size, "timemodified": timemodified}
+    # Folders are created lazily, only for files that are actually written.
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+
+    attempt = 0
+    restarted = False
+    while attempt < DOWNLOAD_RETRY_ATTEMPTS:
+        attempt += 1
+        try:
+            offset = _resume_offset(temp_path, meta_path, validator)
+            if offset and expected_size is not None and offset == expected_size:
+                logger.info("Partial download of %s is already complete", target_path.name)
+                digest = _hash_file(temp_path, hash_name) if hash_name else None
+                temp_path.replace(target_path)
+                _discard_partial(temp_path, meta_path)
+                return True, offset, digest
+
+            headers = {"Range": f"bytes={offset}-"} if offset else None
+            with session.get(
+                download_url,
+                headers=headers,
+                timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_TIMEOUT),
+                stream=True,
+            ) as response:
+                stale = False
+                if response.status_code == 416 and offset:
+                    # Range beyond the end: the server no longer has what we resumed from.
+                    logger.warning("Cannot resume %s (HTTP 416); restarting download", target_path.name)
+                    stale = True
+                elif response.status_code == 206 and offset:
+                    content_range = response.headers.get("Content-Range", "")
+                    if not _content_range_matches(content_range, offset, expected_size):
+                        logger.warning("Unexpected Content-Range %r for %s; restarting download", content_range, target_path.name)
+                        stale = True
+                if stale:
+                    _discard_partial(temp_path, meta_path)
+                    # Nothing failed yet: the fresh download gets this attempt back
+                    # (only once, so a misbehaving server cannot loop forever).
+                    if not restarted:
+                        restarted = True
+                        attempt -= 1
+                    continue
+
+                if response.status_code == 206 and offset:
+                    logger.info("Resuming %s from %.2f MB", target_path.name, offset / (1024 * 1024))
+                elif response.status_code == 200:
+                    if offset:
+                        logger.info("Server ignored range request for %s; downloading from scratch", target_path.name)
+                    offset = 0
+                else:
+                    logger.warning(
+                        "HTTP %s when downloading %s (attempt %d/%d)",
+                        response.status_code,
+                        target_path.name,
+                        attempt,
+                        DOWNLOAD_RETRY_ATTEMPTS,
+                    )
+                    continue
+
+                content_length = response.headers.get("Content-Length", "").strip()
+                expected_total = offset + int(content_length) if content_length.isdigit() else None
+                if expected_total is None:
+                    expected_total = expected_size
+                if expected_total is not None and expected_total > 0 and not offset:
+                    logger.info(
+                        "Starting %s (%.2f MB)",
+                        target_path.name,
+                        expected_total / (1024 * 1024),
+                    )
+
+                bytes_written = offset
+                last_progress_bytes = offset
+                start_time = time.monotonic()
+                # Resumed bytes are hashed from disk so the digest covers the whole file.
+                hasher = _hash_file(temp_path, hash_name, hexdigest=False) if hash_name and offset else None
+                if hash_name and hasher is None:
+                    hasher = hashlib.new(hash_name)
+
+                host = urlparse(download_url).hostname
+                progress_step = DOWNLOAD_PROGRESS_EVERY_MB * 1024 * 1024
+                meta_path.write_text(json.dumps(validator), encoding="utf-8")
+                with open(temp_path, "ab" if offset else "wb") as f:
+                    preallocated = not offset and _preallocate(f, expected_total)
+                    if preallocated:
+                        meta_path.write_text(json.dumps({**validator, "preallocated": True}), encoding="utf-8")
+                    try:
+                        for chunk in iter_response_chunks(response):
+                            n = len(chunk)
+                            if not n:
+                                continue
+                            f.write(chunk)
+                            bytes_written += n
+                            if hasher is not None:
+                                hasher.update(chunk)
+                            if limiter is not None:
+                                limiter.throttle(host, n)
+
+                            if bytes_written - last_progress_bytes >= progress_step:
+                                elapsed = max(time.monotonic() - start_time, 0.001)
+                                speed_mb_s = ((bytes_written - offset) / (1024 * 1024)) / elapsed
+                                logger.info(
+                                    "Downloading %s: %.2f MB written (%.2f MB/s)",
+                                    target_path.name,
+                                    bytes_written / (1024 * 1024),
+                                    speed_mb_s,
+                                )
+                                last_progress_bytes = bytes_written
+                    finally:
+                        # Drop the unused tail so the .part size is the resume offset again.
+                        if preallocated:
+                            f.truncate(bytes_written)
+                            meta_path.write_text(json.dumps(validator), encoding="utf-8")
+
+                if expected_total is not None and bytes_written != expected_total:
+                    logger.warning(
+                        "Size mismatch for %s (expected %s bytes, got %s bytes) (attempt %d/%d)",
+                        target_path.name,
+                        expected_total,
+                        bytes_written,
+                        attempt,
+                        DOWNLOAD_RETRY_ATTEMPTS,
+                    )
+                    # A short body can be resumed; anything longer is corrupt.
+                    if bytes_written > expected_total:
+                        _discard_partial(temp_path, meta_path)
+                    continue
+
+                temp_path.replace(target_path)
+                _discard_partial(temp_path, meta_path)
+                return True, bytes_written, hasher.hexdigest() if hasher is not None else None
+        except requests.exceptions.Timeout:
+            logger.warning("Timeout downloading %s (attempt %d/%d)", target_path.name, attempt, DOWNLOAD_RETRY_ATTEMPTS)
+        except requests.exceptions.ConnectionError:
+            logger.warning("Connection error downloading %s (attempt %d/%d)", target_path.name, attempt, DOWNLOAD_RETRY_ATTEMPTS)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Request error downloading %s (attempt %d/%d): %s", target_path.name, attempt, DOWNLOAD_RETRY_ATTEMPTS, e)
+        except OSError as e:
+            logger.warning("Filesystem error writing %s: %s", target_path, e)
+            break
+        except Exception as e:
+            logger.exception("Unexpected error downloading %s: %s", target_path.name, e)
+            _discard_partial(temp_path, meta_path)
+
+    if temp_path.exists():
+        logger.info("Keeping partial download for the next attempt: %s", temp_path)
+    return False, 0, None
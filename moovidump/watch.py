@@ -0,0 +1,187 @@
+"""Modo ``--watch``: sincronizaciones incrementales periodicas en un solo proceso.
+
+En vez de lanzar ``main.py`` desde cron, ``Watcher`` mantiene el mismo
+``Dumper`` (sesion HTTP con conexiones abiertas, token y clave privada) y
+repite cada ``interval`` segundos la lista de cursos y ``download()``, que ya
+solo enumera los cursos con cambios y solo descarga ficheros nuevos o
+modificados. El intervalo varia al azar un ``jitter`` (fraccion) para no
+coincidir con otros clientes; tras un ciclo fallido la espera se duplica
+hasta ``max_backoff``.
+
+Cada ciclo deja un resumen en el log, un evento ``cycle`` en
+``--events-file`` y, con ``summary_path``, una linea JSON en ese fichero.
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from pathlib import Path
+
+from .settings import WATCH_JITTER, WATCH_MAX_BACKOFF
+
+logger = logging.getLogger(__name__)
+
+
+def parse_interval(value):
+    """Convierte ``"900"``, ``"30s"``, ``"15m"`` o ``"1h"`` a segundos."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*", str(value).lower())
+    if not match or float(match.group(1)) <= 0:
+        raise argparse.ArgumentTypeError(f"invalid interval: {value!r} (use e.g. 900, 30s, 15m, 1h)")
+    return float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+
+
+def parse_jitter(value):
+    """Convierte ``"0.1"`` o ``"10%"`` a una fraccion entre 0 y 1."""
+    text = str(value).strip()
+    try:
+        jitter = float(text[:-1]) / 100 if text.endswith("%") else float(text)
+    except ValueError:
+        jitter = -1
+    if not 0 <= jitter < 1:
+        raise argparse.ArgumentTypeError(f"invalid jitter: {value!r} (use a fraction like 0.1 or 10%)")
+    return jitter
+
+
+def next_delay(interval, failures, jitter=WATCH_JITTER, max_backoff=WATCH_MAX_BACKOFF, rng=random):
+    """Espera hasta el siguiente ciclo: backoff exponencial tras fallos y jitter."""
+    delay = interval
+    if failures:
+        delay = min(interval * 2 ** failures, max(interval, max_backoff))
+    return max(1.0, delay * rng.uniform(1 - jitter, 1 + jitter))
+
+
+def format_delay(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class Watcher:
+    """Repite la sincronizacion de ``dumper`` hasta ``stop()`` o ``max_cycles``.
+
+    ``select_courses(courses)`` recibe la lista de cursos de cada ciclo y
+    devuelve los que hay que sincronizar. ``on_cycle(summary)`` se llama al
+    terminar cada ciclo (p. ej. para reescribir ``--metrics-json``).
+    """
+
+    def __init__(
+        self,
+        dumper,
+        select_courses,
+        interval,
+        *,
+        jitter=WATCH_JITTER,
+        max_backoff=WATCH_MAX_BACKOFF,
+        max_cycles=0,
+        summary_path=None,
+        on_cycle=None,
+    ):
+        self.dumper = dumper
+        self.select_courses = select_courses
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.max_cycles = max_cycles
+        self.summary_path = Path(summary_path) if summary_path else None
+        self.on_cycle = on_cycle
+        self.failures = 0
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Termina tras el ciclo en curso (o interrumpe la espera)."""
+        self._stop.set()
+
+    def run_cycle(self, number, courses=None):
+        """Un ciclo: lista de cursos (salvo ``courses``) y descarga incremental."""
+        dumper = self.dumper
+        if number > 1:
+            # Metrics describe the last cycle; the first one keeps login/site info.
+            dumper.metrics.reset()
+        started = time.time()
+        summary = {"cycle": number, "started_at": int(started), "ok": False, "error": None, "courses": 0}
+        try:
+            if courses is None:
+                courses = dumper.list_courses()
+            if courses is None:
+                summary["error"] = "could not list courses"
+            else:
+                selected = self.select_courses(courses)
+                summary["courses"] = len(selected)
+                stats = dumper.download(selected) if selected else None
+                if stats is not None:
+                    summary.update(dumper._totals(stats), out_of_space=stats["out_of_space"])
+                    if stats["out_of_space"]:
+                        summary["error"] = "out of space"
+                summary["ok"] = summary["error"] is None
+        except Exception as e:
+            # A daemon outlives network errors: log, back off and try again.
+            logger.exception("Cycle %d failed: %s", number, e)
+            summary["error"] = str(e) or type(e).__name__
+        dumper.metrics.gauges.setdefault("success", summary["ok"])
+        dumper.metrics.gauges["watch_cycle"] = number
+        summary["seconds"] = round(time.time() - started, 3)
+        return summary
+
+    def run(self, courses=None):
+        """Bucle principal. ``courses`` evita repetir la lista en el primer ciclo.
+
+        Devuelve ``0`` si el ultimo ciclo fue bien y ``1`` si fallo.
+        """
+        number = 0
+        summary = None
+        while not self._stop.is_set():
+            number += 1
+            summary = self.run_cycle(number, courses)
+            courses = None
+            self.failures = 0 if summary["ok"] else self.failures + 1
+            last = self.max_cycles and number >= self.max_cycles
+            delay = None if last else next_delay(self.interval, self.failures, self.jitter, self.max_backoff)
+            summary["next_in"] = round(delay, 1) if delay is not None else None
+            self._report(summary)
+            if last:
+                break
+            self._stop.wait(delay)
+        if self._stop.is_set():
+            logger.info("Watch mode stopped.")
+        if summary is None:
+            return 0
+        return 0 if summary["ok"] else 1
+
+    def _report(self, summary):
+        if summary["ok"]:
+            logger.info(
+                "Cycle %d (%.1f s): %d course(s), downloaded: %d, skipped: %d, failed: %d, %.2f MB%s",
+                summary["cycle"],
+                summary["seconds"],
+                summary["courses"],
+                summary.get("downloaded", 0),
+                summary.get("skipped", 0),
+                summary.get("failed", 0),
+                summary.get("bytes_downloaded", 0) / (1024 * 1024),
+                f"; next in {format_delay(summary['next_in'])}" if summary["next_in"] is not None else "",
+            )
+        else:
+            logger.warning(
+                "Cycle %d failed (%s), %d in a row%s",
+                summary["cycle"],
+                summary["error"],
+                self.failures,
+                f"; retrying in {format_delay(summary['next_in'])}" if summary["next_in"] is not None else "",
+            )
+        self.dumper._emit("cycle", **summary)
+        if self.summary_path is not None:
+            try:
+                self.summary_path.parent.mkdir(parents=True, exist_ok=True)
+                with self.summary_path.open("a", encoding="utf-8") as f:
+                    f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.warning("Could not write cycle summary to %s: %s", self.summary_path, e)
+        if self.on_cycle is not None:
+            self.on_cycle(summary)
@@ -8,6 +8,9 @@ import os
 from pathlib import Path
 import getpass
 import logging
+# The launcher may be started from another directory: import the package next to it.
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from moovidump.deps import reinstall_requested, record_requirements, requirements_satisfied
 # Module-level logger so helper functions can log before `main()` runs
 logger = logging.getLogger("run")
 def prompt_credentials(default_site="https://moovi.uvigo.gal"):
@@ -56,11 +59,11 @@ def main():
     logger.info("\n[1/3] Checking .env file and credential mode...")
     env_file = script_dir / ".env"
 
-    logger.info("Elige modo de credenciales:")
-    logger.info("  1) Usar credenciales almacenadas en .env (si existe).")
-    logger.info("  2) Introducir credenciales para esta ejecución (no guardar).")
-    logger.info("  3) Introducir credenciales y guardarlas en .env.")
-    mode = input("Modo [1/2/3]: ").strip() or "1"
+    logger.info("Choose the credentials mode:")
+    logger.info("  1) Use the credentials stored in .env (if it exists).")
+    logger.info("  2) Enter credentials for this run only (not saved).")
+    logger.info("  3) Enter credentials and save them to .env.")
+    mode = input("Mode [1/2/3]: ").strip() or "1"
 
     pw_for_run = None
     env_vars = None
@@ -69,12 +72,12 @@ def main():
         if env_file.exists():
             logger.info("✓ .env file found; using stored credentials.")
         else:
-            logger.info(".env no encontrada. Vamos a crearla ahora.")
+            logger.info("No .env found; creating it now.")
             creds = prompt_credentials()
             if not creds:
                 sys.exit(1)
             site, username, password = creds
-            save = input("Guardar credenciales en .env? [y/N]: ").strip().lower() == "y"
+            save = input("Save credentials to .env? [y/N]: ").strip().lower() == "y"
             if save:
                 if not write_env_file(env_file, site, username, password):
                     sys.exit(1)
@@ -102,23 +105,28 @@ def main():
             sys.exit(1)
         logger.info("\n✓ .env file created and credentials saved.")
     else:
-        logger.error("Modo inválido.")
+        logger.error("Invalid mode.")
         sys.exit(1)
 
-    # Step 2: Install requirements
+    # Step 2: Install requirements (skipped when requirements.txt and the interpreter did not change)
     logger.info("\n[2/3] Installing dependencies...")
+    reinstall = "--reinstall" in sys.argv[1:] or reinstall_requested()
     try:
-        result = subprocess.run(
-            [sys.executable, "-m", "pip", "install", "-r", "requirements.txt"],
-            capture_output=True,
-            text=True,
-            check=False
-        )
-        if result.returncode == 0:
-            logger.info("✓ Dependencies installed successfully")
+        if not reinstall and requirements_satisfied("requirements.txt"):
+            logger.info("✓ Dependencies unchanged since the last install; skipping pip (use --reinstall to force)")
         else:
-            logger.warning("Some dependencies may have failed to install")
-            logger.debug(result.stderr)
+            result = subprocess.run(
+                [sys.executable, "-m", "pip", "install", "-r", "requirements.txt"],
+                capture_output=True,
+                text=True,
+                check=False
+            )
+            if result.returncode == 0:
+                record_requirements("requirements.txt")
+                logger.info("✓ Dependencies installed successfully")
+            else:
+                logger.warning("Some dependencies may have failed to install")
+                logger.debug(result.stderr)
     except Exception as e:
         logger.error("❌ Error installing dependencies: %s", e)
         sys.exit(1)
@@ -134,7 +142,7 @@ def main():
         if pw_for_run:
             env["MOODLE_PASSWORD"] = pw_for_run
 
-        force = input("Forzar redescarga de archivos existentes? [y/N]: ").strip().lower() == "y"
+        force = input("Force re-download of existing files? [y/N]: ").strip().lower() == "y"
         cmd = [sys.executable, "main.py"]
         if force:
             cmd.append("--force")
@@ -3,24 +3,40 @@
 
 This UI lets users provide credentials, choose whether to save them in .env,
 and run main.py without opening a terminal window manually.
+
+The worker's output is shown in a bounded log view (only the last
+``LOG_MAX_LINES`` lines) and written in full to ``logs/``; progress comes from
+the structured events main.py writes with ``--events-file`` and is rendered
+at most once per ``FRAME_INTERVAL_MS``.
 """
 
 from __future__ import annotations
 
+import json
 import os
 import queue
 import runpy
 import subprocess
 import sys
 import threading
+import time
 from pathlib import Path
 import tkinter as tk
 from tkinter import messagebox, ttk
 
+# The launcher may be started from another directory: import the package next to it.
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from moovidump.deps import reinstall_requested, record_requirements, requirements_satisfied
+
 
 APP_TITLE = "MooviDump Enhanced"
 DEFAULT_SITE = "https://moovi.uvigo.gal"
 APP_SUBTITLE = "Interfaz limpia para lanzar descargas sin terminal"
+# Refresco de la interfaz: la salida y los eventos se acumulan y se pintan por lotes
+FRAME_INTERVAL_MS = 100
+# Lineas que conserva el log en pantalla; el log completo va a logs/
+LOG_MAX_LINES = 2000
+LOGS_DIRNAME = "logs"
 
 
 class MooviDumpApp:
@@ -40,6 +56,13 @@ class MooviDumpApp:
         self.env_file = self.app_dir / ".env"
         self.output_queue: queue.Queue[str] = queue.Queue()
         self.process: subprocess.Popen[str] | None = None
+        self.log_file = None
+        self.events_path: Path | None = None
+        self.events_fp = None
+        self.events_buffer = ""
+        self.course_stats: dict[int, dict] = {}
+        self.totals: dict[str, float] = {"queued": 0, "done": 0, "failed": 0, "bytes": 0, "started": 0, "last": 0}
+        self.progress_dirty = False
 
         self.site_var = tk.StringVar(value=DEFAULT_SITE)
         self.user_var = tk.StringVar(value="")
@@ -47,14 +70,16 @@ class MooviDumpApp:
         self.save_password_var = tk.BooleanVar(value=False)
         self.force_var = tk.BooleanVar(value=False)
         self.install_deps_var = tk.BooleanVar(value=not getattr(sys, "frozen", False))
+        self.reinstall_deps_var = tk.BooleanVar(value=reinstall_requested())
         self.course_mode_var = tk.StringVar(value="all")
         self.course_ids_var = tk.StringVar(value="")
         self.status_var = tk.StringVar(value="Preparado")
+        self.progress_var = tk.StringVar(value="Sin descargas en curso")
 
         self._build_styles()
         self._build_ui()
         self._load_existing_env()
-        self.root.after(120, self._poll_output_queue)
+        self.root.after(FRAME_INTERVAL_MS, self._poll_output_queue)
 
     def _build_styles(self) -> None:
         style = ttk.Style()
@@ -156,10 +181,15 @@ class MooviDumpApp:
         ttk.Label(options_box, text="Opciones", style="CardTitle.TLabel").pack(anchor="w", pady=(0, 6))
         ttk.Checkbutton(options_box, text="Guardar contraseña en .env", variable=self.save_password_var).pack(anchor="w")
         ttk.Checkbutton(options_box, text="Forzar redescarga (--force)", variable=self.force_var).pack(anchor="w", pady=(2, 0))
-        deps_check = ttk.Checkbutton(options_box, text="Instalar dependencias antes de ejecutar", variable=self.install_deps_var)
+        deps_check = ttk.Checkbutton(
+            options_box, text="Instalar dependencias si cambió requirements.txt", variable=self.install_deps_var
+        )
         deps_check.pack(anchor="w", pady=(2, 0))
+        reinstall_check = ttk.Checkbutton(options_box, text="Forzar reinstalación de dependencias", variable=self.reinstall_deps_var)
+        reinstall_check.pack(anchor="w", pady=(2, 0))
         if getattr(sys, "frozen", False):
             deps_check.configure(state="disabled")
+            reinstall_check.configure(state="disabled")
 
         actions = ttk.Frame(credentials_card, style="Card.TFrame")
         actions.grid(row=7, column=0, columnspan=2, sticky="ew", pady=(6, 0))
@@ -210,6 +240,21 @@ class MooviDumpApp:
         status_box.pack(fill="x", pady=(14, 0))
         ttk.Label(status_box, text="Estado", style="CardTitle.TLabel").pack(anchor="w")
         ttk.Label(status_box, textvariable=self.status_var, style="Status.TLabel").pack(anchor="w", pady=(4, 0))
+        self.progress_bar = ttk.Progressbar(status_box, mode="determinate", maximum=1)
+        self.progress_bar.pack(fill="x", pady=(8, 4))
+        ttk.Label(status_box, textvariable=self.progress_var, style="Status.TLabel").pack(anchor="w")
+
+        self.course_table = ttk.Treeview(
+            course_card,
+            columns=("files", "done", "failed", "mb"),
+            height=4,
+        )
+        self.course_table.heading("#0", text="Curso")
+        self.course_table.column("#0", width=200, stretch=True)
+        for column, title in (("files", "Ficheros"), ("done", "Hechos"), ("failed", "Fallidos"), ("mb", "MB")):
+            self.course_table.heading(column, text=title)
+            self.course_table.column(column, width=70, anchor="e", stretch=False)
+        self.course_table.pack(fill="both", expand=True, pady=(14, 0))
 
         log_card = ttk.Frame(root_frame, style="Card.TFrame", padding=14)
         log_card.pack(fill="both", expand=True, pady=(0, 0))
@@ -217,7 +262,11 @@ class MooviDumpApp:
         log_header = ttk.Frame(log_card, style="Card.TFrame")
         log_header.pack(fill="x", pady=(0, 10))
         ttk.Label(log_header, text="Log de ejecución", style="CardTitle.TLabel").pack(side="left")
-        ttk.Label(log_header, text="La actividad aparece aquí en tiempo real.", style="SectionText.TLabel").pack(side="right")
+        ttk.Label(
+            log_header,
+            text=f"Últimas {LOG_MAX_LINES} líneas; el log completo se guarda en {LOGS_DIRNAME}/.",
+            style="SectionText.TLabel",
+        ).pack(side="right")
 
         self.log_text = tk.Text(
             log_card,
@@ -271,6 +320,10 @@ class MooviDumpApp:
     def _append_log(self, text: str) -> None:
         self.log_text.configure(state="normal")
         self.log_text.insert("end", text)
+        # Keep only the newest LOG_MAX_LINES lines so long runs stay responsive.
+        lines = int(self.log_text.index("end-1c").split(".")[0])
+        if lines > LOG_MAX_LINES:
+            self.log_text.delete("1.0", f"{lines - LOG_MAX_LINES + 1}.0")
         self.log_text.see("end")
         self.log_text.configure(state="disabled")
 
@@ -318,6 +371,7 @@ class MooviDumpApp:
         self._set_status("Preparando ejecución...")
         self._append_log("\n=== Nueva ejecución ===\n")
         self._append_log(f"Site: {site}\n")
+        self._reset_progress()
 
         thread = threading.Thread(target=self._run_pipeline, args=(site, username, password), daemon=True)
         thread.start()
@@ -325,17 +379,28 @@ class MooviDumpApp:
     def _run_pipeline(self, site: str, username: str, password: str) -> None:
         try:
             os.chdir(self.app_dir)
-
-            if self.install_deps_var.get():
-                self._set_status("Instalando dependencias...")
-                self._run_command([
-                    sys.executable,
-                    "-m",
-                    "pip",
-                    "install",
-                    "-r",
-                    "requirements.txt",
-                ], "Instalando dependencias...")
+            logs_dir = self.app_dir / LOGS_DIRNAME
+            logs_dir.mkdir(exist_ok=True)
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            log_path = logs_dir / f"moovidump-{stamp}.log"
+            self.log_file = open(log_path, "w", encoding="utf-8")
+            self.output_queue.put(f"Log completo: {log_path}\n")
+
+            if self.install_deps_var.get() or self.reinstall_deps_var.get():
+                if not self.reinstall_deps_var.get() and requirements_satisfied("requirements.txt"):
+                    self.output_queue.put("Dependencias sin cambios desde la última instalación; se omite pip.\n")
+                else:
+                    self._set_status("Instalando dependencias...")
+                    pip_code = self._run_command([
+                        sys.executable,
+                        "-m",
+                        "pip",
+                        "install",
+                        "-r",
+                        "requirements.txt",
+                    ], "Instalando dependencias...")
+                    if pip_code == 0:
+                        record_requirements("requirements.txt")
 
             env = os.environ.copy()
             env.update(
@@ -359,12 +424,19 @@ class MooviDumpApp:
             if self.force_var.get():
                 cmd.append("--force")
 
+            events_path = logs_dir / f"moovidump-{stamp}.events.jsonl"
+            cmd.extend(["--events-file", str(events_path)])
+            self.events_path = events_path
+
             self._set_status("Ejecutando descarga...")
             exit_code = self._run_command(cmd, "Ejecutando main.py...", env=env)
             self.output_queue.put(f"\nProceso finalizado con código {exit_code}.\n")
         except Exception as exc:
             self.output_queue.put(f"\nError inesperado: {exc}\n")
         finally:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
             self.output_queue.put("__PROCESS_FINISHED__")
 
     def _run_command(self, cmd: list[str], header: str, env: dict[str, str] | None = None) -> int:
@@ -385,6 +457,8 @@ class MooviDumpApp:
 
         assert self.process.stdout is not None
         for line in self.process.stdout:
+            if self.log_file is not None:
+                self.log_file.write(line)
             self.output_queue.put(line)
 
         self.process.wait()
@@ -402,6 +476,9 @@ class MooviDumpApp:
             self._append_log(f"\nNo se pudo detener el proceso: {exc}\n")
 
     def _poll_output_queue(self) -> None:
+        """Pinta de una vez todo lo recibido desde el ultimo frame."""
+        pending: list[str] = []
+        finished = False
         while True:
             try:
                 line = self.output_queue.get_nowait()
@@ -409,14 +486,117 @@ class MooviDumpApp:
                 break
 
             if line == "__PROCESS_FINISHED__":
-                self.run_button.configure(state="normal")
-                self.stop_button.configure(state="disabled")
-                self._set_status("Listo")
+                finished = True
+                continue
+            pending.append(line)
+
+        if pending:
+            # Lines that would be trimmed right away are never inserted.
+            self._append_log("".join(pending[-LOG_MAX_LINES:]))
+
+        self._read_events()
+        if self.progress_dirty:
+            self._render_progress()
+
+        if finished:
+            self._close_events()
+            self.run_button.configure(state="normal")
+            self.stop_button.configure(state="disabled")
+            self._set_status("Listo")
+
+        self.root.after(FRAME_INTERVAL_MS, self._poll_output_queue)
+
+    def _reset_progress(self) -> None:
+        self._close_events()
+        self.events_path = None
+        self.course_stats.clear()
+        self.totals = {"queued": 0, "done": 0, "failed": 0, "bytes": 0, "started": 0, "last": 0}
+        self.course_table.delete(*self.course_table.get_children())
+        self.progress_bar.configure(maximum=1, value=0)
+        self.progress_var.set("Enumerando cursos...")
+        self.progress_dirty = False
+
+    def _close_events(self) -> None:
+        # Pick up whatever the worker wrote after the last frame.
+        self._read_events()
+        if self.progress_dirty:
+            self._render_progress()
+        if self.events_fp is not None:
+            self.events_fp.close()
+            self.events_fp = None
+        self.events_buffer = ""
+
+    def _read_events(self) -> None:
+        """Lee los eventos nuevos de ``--events-file`` (el worker lo crea al arrancar)."""
+        if self.events_fp is None:
+            if self.events_path is None or not self.events_path.exists():
+                return
+            self.events_fp = open(self.events_path, encoding="utf-8")
+
+        chunk = self.events_fp.read()
+        if not chunk:
+            return
+        self.events_buffer += chunk
+        *lines, self.events_buffer = self.events_buffer.split("\n")
+        for line in lines:
+            try:
+                self._apply_event(json.loads(line))
+            except (ValueError, KeyError, TypeError):
                 continue
 
-            self._append_log(line)
-
-        self.root.after(120, self._poll_output_queue)
+    def _apply_event(self, event: dict) -> None:
+        kind = event["event"]
+        totals = self.totals
+        totals["last"] = event.get("t", totals["last"])
+        if kind == "run_started":
+            totals["started"] = totals["last"]
+        elif kind == "course":
+            course = self.course_stats.setdefault(event["course_id"], {"done": 0, "failed": 0, "bytes": 0})
+            course.update(name=event["name"], files=event["files"], skipped=event["skipped"], dirty=True)
+            course["failed"] += event["failed"]
+            totals["failed"] += event["failed"]
+            totals["queued"] += event["queued"]
+        elif kind == "file_finished":
+            course = self.course_stats.setdefault(event["course_id"], {"done": 0, "failed": 0, "bytes": 0})
+            course["dirty"] = True
+            totals["done"] += 1
+            if event["ok"]:
+                course["done"] += 1
+                course["bytes"] += event["bytes"]
+                if not event["reused"]:
+                    totals["bytes"] += event["bytes"]
+            else:
+                course["failed"] += 1
+                totals["failed"] += 1
+        elif kind != "run_finished":
+            return
+        self.progress_dirty = True
+
+    def _render_progress(self) -> None:
+        totals = self.totals
+        self.progress_bar.configure(maximum=max(totals["queued"], 1), value=totals["done"])
+        elapsed = totals["last"] - totals["started"] if totals["started"] else 0
+        rate = totals["bytes"] / elapsed / (1024 * 1024) if elapsed > 0 else 0
+        self.progress_var.set(
+            f"{totals['done']}/{totals['queued']} ficheros · {totals['bytes'] / (1024 * 1024):.1f} MB"
+            f" · {rate:.2f} MB/s · fallidos: {totals['failed']}"
+        )
+        for course_id, course in self.course_stats.items():
+            if not course.pop("dirty", False):
+                continue
+            values = (
+                course.get("files", "-"),
+                course["done"] + course.get("skipped", 0),
+                course["failed"],
+                f"{course['bytes'] / (1024 * 1024):.1f}",
+            )
+            iid = str(course_id)
+            if self.course_table.exists(iid):
+                # Files may finish before the "course" event names the row.
+                self.course_table.item(iid, text=course.get("name", iid), values=values)
+            else:
+                self.course_table.insert("", "end", iid=iid, text=course.get("name", iid), values=values)
+        self.progress_dirty = False
 
 
 def main() -> None:
@@ -445,6 +625,8 @@ def run_cli_worker(extra_args: list[str]) -> None:
 
     # Ensure output folders like dumps/ are created next to the launcher (.exe).
     os.chdir(app_dir)
+    # runpy does not put the script folder on sys.path; main.py imports the moovidump package.
+    sys.path.insert(0, str(runtime_dir))
     sys.argv = [str(main_script)] + extra_args
     runpy.run_path(str(main_script), run_name="__main__")
 
@@ -0,0 +1,42 @@
+from moovidump.attachments import AttachmentSections, merge_attachments
+
+ATTACHMENT = {"type": "file", "filename": "enunciado.pdf", "fileurl": "https://moovi/enunciado.pdf"}
+
+
+def section(number, modname="resource"):
+    return {"id": number, "section": number, "modules": [{"id": number * 10, "modname": modname}]}
+
+
+def test_sections_without_assignments_do_not_wait_for_the_harvest():
+    files = {10: [ATTACHMENT]}
+    done = []
+    sections = AttachmentSections(
+        [section(1, "assign"), section(2), section(3)], lambda: done.append(1) or files, lambda: False
+    )
+    items = iter(sections)
+    assert next(items)["id"] == 2
+    assert next(items)["id"] == 3
+    assert not done
+    late = next(items)
+    assert late["id"] == 1 and done
+    assert late["modules"][0]["contents"] == [ATTACHMENT]
+    assert list(items) == []
+
+
+def test_deferred_sections_follow_as_soon_as_the_harvest_is_ready():
+    ready = []
+
+    def sections():
+        yield section(1, "forum")
+        ready.append(True)
+        yield section(2)
+
+    ids = [s["id"] for s in AttachmentSections(sections(), lambda: {}, lambda: bool(ready))]
+    assert ids == [1, 2]
+
+
+def test_merge_keeps_known_files_once():
+    module = {"id": 10, "contents": [ATTACHMENT]}
+    extra = {10: [ATTACHMENT, {**ATTACHMENT, "fileurl": "https://moovi/b"}]}
+    merged = merge_attachments({"modules": [module]}, extra)
+    assert [c["fileurl"] for c in merged["modules"][0]["contents"]] == ["https://moovi/enunciado.pdf", "https://moovi/b"]
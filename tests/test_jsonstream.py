@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from moovidump.jsonstream import JSONArrayExpected, iter_json_array
+
+DOCUMENT = [
+    {"id": 1, "name": "Tema 0", "summary": "<p>ñandú €</p>", "modules": [{"id": 10}, {"id": 11}]},
+    [1, 2, [3]],
+    12.5e3,
+    -7,
+    "texto, con ] y [",
+    True,
+    None,
+]
+
+
+def chunked(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 1 << 20])
+def test_elements_survive_any_chunk_boundary(size):
+    data = json.dumps(DOCUMENT, ensure_ascii=False).encode("utf-8")
+    assert list(iter_json_array(chunked(data, size))) == DOCUMENT
+
+
+def test_whitespace_and_empty_array():
+    assert list(iter_json_array([b"  \n[ \t", b" ]\n"])) == []
+    assert list(iter_json_array([b" [ 1 ,\n 2 ] "])) == [1, 2]
+
+
+def test_number_cut_by_chunk_boundary():
+    assert list(iter_json_array([b"[12", b".5e", b"3]"])) == [12.5e3]
+
+
+def test_non_array_document_is_reported_with_its_value():
+    error = {"exception": "moodle_exception", "errorcode": "invalidtoken"}
+    with pytest.raises(JSONArrayExpected) as raised:
+        list(iter_json_array(chunked(json.dumps(error).encode(), 5)))
+    assert raised.value.value == error
+
+
+def test_truncated_document_yields_complete_elements_then_fails():
+    items = iter_json_array([b'[{"id": 1}, {"id": 2}, {"id"'])
+    assert next(items) == {"id": 1}
+    assert next(items) == {"id": 2}
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_missing_delimiter_fails():
+    with pytest.raises(ValueError):
+        list(iter_json_array([b"[1 2]"]))
@@ -0,0 +1,95 @@
+import sqlite3
+
+from moovidump.manifest import DownloadManifest
+from moovidump.settings import MANIFEST_FILENAME
+
+
+def old_manifest(root):
+    """Manifiesto de una version que solo tenia la tabla ``files``."""
+    conn = sqlite3.connect(root / MANIFEST_FILENAME)
+    conn.execute(DownloadManifest.SCHEMA[0])
+    conn.execute(
+        "INSERT INTO files (course_id, module_id, fileurl, path, remote_size, remote_mtime, local_size, "
+        "local_mtime_ns, updated_at) VALUES (1, 2, 'https://moovi/f.pdf', 'Curso/f.pdf', 3, 4, 3, 5, 0)"
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_old_manifest_is_upgraded_in_place(tmp_path):
+    old_manifest(tmp_path)
+    manifest = DownloadManifest(tmp_path)
+    assert manifest.lookup((1, 2, "https://moovi/f.pdf"))["path"] == tmp_path / "Curso/f.pdf"
+    assert manifest.course_sync_state() == {}
+    manifest.mark_course_synced(1, 100, full=True)
+    manifest.mark_course_synced(1, 200, full=False)
+    assert manifest.course_sync_state() == {1: (200, 100)}
+    manifest.record_run(10, 1000, 2.0)
+    assert manifest.throughput() == (500.0, 5.0)
+    manifest.close()
+
+
+def test_old_manifest_read_only(tmp_path):
+    old_manifest(tmp_path)
+    manifest = DownloadManifest(tmp_path, readonly=True)
+    assert manifest.course_sync_state() == {}
+    assert manifest.find_blob("0" * 64, 3) is None
+    assert manifest.throughput() is None
+    assert manifest.lookup((1, 2, "https://moovi/f.pdf")) is not None
+    manifest.close()
+    # Nothing was created or changed on disk.
+    conn = sqlite3.connect(tmp_path / MANIFEST_FILENAME)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    assert tables == {"files"}
+
+
+def test_missing_manifest_read_only_uses_memory(tmp_path):
+    manifest = DownloadManifest(tmp_path, readonly=True)
+    assert manifest.course_sync_state() == {}
+    manifest.close()
+    assert not (tmp_path / MANIFEST_FILENAME).exists()
+
+
+def test_record_and_move(tmp_path):
+    path = tmp_path / "Curso" / "f.pdf"
+    path.parent.mkdir()
+    path.write_bytes(b"abc")
+    manifest = DownloadManifest(tmp_path)
+    key = DownloadManifest.file_key(1, 2, "https://moovi/f.pdf?forcedownload=1")
+    manifest.record(key, path, 3, 4)
+    manifest.record_blob("a" * 64, path)
+    entry = manifest.lookup(key)
+    assert DownloadManifest.is_current(entry, 3, 4)
+    assert manifest.find_copy("https://moovi/f.pdf?token=x", 3, 4) == path
+
+    moved = tmp_path / "f.pdf"
+    path.rename(moved)
+    manifest.move(path, moved)
+    assert manifest.lookup(key)["path"] == moved
+    assert manifest.find_blob("a" * 64, 3) == moved
+    manifest.close()
+
+
+def test_records_are_committed_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr("moovidump.manifest.MANIFEST_COMMIT_EVERY", 3)
+    monkeypatch.setattr("moovidump.manifest.MANIFEST_COMMIT_SECONDS", 3600)
+    manifest = DownloadManifest(tmp_path)
+    other = sqlite3.connect(tmp_path / MANIFEST_FILENAME)
+
+    def committed():
+        return other.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    for i in range(5):
+        path = tmp_path / f"f{i}.pdf"
+        path.write_bytes(b"x")
+        manifest.record(DownloadManifest.file_key(1, i, f"https://moovi/f{i}.pdf"), path, 1, 1)
+    assert committed() == 3
+    manifest.flush()
+    assert committed() == 5
+    path = tmp_path / "f5.pdf"
+    path.write_bytes(b"x")
+    manifest.record(DownloadManifest.file_key(1, 5, "https://moovi/f5.pdf"), path, 1, 1)
+    manifest.close()
+    assert committed() == 6
+    other.close()
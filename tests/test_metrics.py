@@ -0,0 +1,38 @@
+import threading
+
+from moovidump.metrics import PhaseProfiler
+
+
+def test_phase_without_profile_does_not_break_report(tmp_path, monkeypatch):
+    profiler = PhaseProfiler(tmp_path)
+    with profiler.phase("courses"):
+        sum(range(1000))
+    # Python 3.12+ refuses a second active profiler: enable() fails for this phase.
+    monkeypatch.setattr(PhaseProfiler, "_enable", staticmethod(lambda profile: False))
+    with profiler.phase("download"):
+        sum(range(1000))
+    monkeypatch.undo()
+
+    rows = {row[0]: row for row in profiler.report()}
+    assert rows["courses"][1] == 1
+    assert rows["download"][1] == 1
+    assert (tmp_path / "courses.prof").exists()
+    assert not (tmp_path / "download.prof").exists()
+    assert (tmp_path / "allocations.txt").exists()
+
+
+def test_phases_of_other_threads_are_profiled_per_thread(tmp_path):
+    profiler = PhaseProfiler(tmp_path)
+
+    def enumerate_courses():
+        for _ in range(3):
+            with profiler.phase("enumeration"):
+                sum(range(1000))
+
+    thread = threading.Thread(target=enumerate_courses)
+    thread.start()
+    thread.join()
+    rows = {row[0]: row for row in profiler.report()}
+    assert rows["enumeration (threads)"][1] == 3
+    assert "enumeration" not in profiler.phases
+    assert (tmp_path / "enumeration.prof").exists()
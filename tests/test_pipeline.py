@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from moovidump.pipeline import Channel, Pipeline
+
+
+def test_channel_ends_when_every_producer_closes():
+    channel = Channel("test", producers=2)
+    channel.put(1)
+    channel.close()
+    channel.put(2)
+    channel.close()
+    assert list(channel) == [1, 2]
+
+
+def test_cancel_wakes_blocked_producer_and_consumer():
+    full = Channel("full", maxsize=1)
+    full.put(1)
+    empty = Channel("empty")
+    results = {}
+
+    def produce():
+        results["put"] = full.put(2)
+
+    def consume():
+        results["items"] = list(empty)
+
+    threads = [threading.Thread(target=produce), threading.Thread(target=consume)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    full.cancel()
+    empty.cancel()
+    for thread in threads:
+        thread.join(timeout=2)
+        assert not thread.is_alive()
+    assert results == {"put": False, "items": []}
+    assert len(full) == 0
+
+
+def test_pipeline_runs_stages_in_order():
+    pipeline = Pipeline("test")
+    numbers = pipeline.source("numbers", range(100), maxsize=4)
+    doubled = pipeline.stage("double", lambda n: [n * 2], numbers, maxsize=4, workers=3)
+    seen = []
+    lock = threading.Lock()
+
+    def record(n):
+        with lock:
+            seen.append(n)
+
+    pipeline.sink("record", record, doubled)
+    pipeline.join()
+    assert sorted(seen) == [n * 2 for n in range(100)]
+
+
+def test_stage_error_cancels_pipeline_and_closes_source():
+    closed = threading.Event()
+
+    def endless():
+        try:
+            n = 0
+            while True:
+                yield n
+                n += 1
+        finally:
+            closed.set()
+
+    def plan(n):
+        if n == 10:
+            raise RuntimeError("boom")
+        return [n]
+
+    pipeline = Pipeline("test")
+    numbers = pipeline.source("numbers", endless(), maxsize=2)
+    planned = pipeline.stage("plan", plan, numbers, maxsize=2)
+    pipeline.sink("sink", lambda n: None, planned)
+    with pytest.raises(RuntimeError, match="boom"):
+        pipeline.join()
+    assert closed.wait(2)
+    assert pipeline.error is not None
@@ -0,0 +1,83 @@
+import gzip
+
+from moovidump import snapshots
+from moovidump.snapshots import SnapshotLog
+
+
+def course(summary="Intro", extra_module=False):
+    modules = [{"id": 10, "name": "Apuntes", "contents": [{"filename": "tema1.pdf"}]}]
+    if extra_module:
+        modules.append({"id": 11, "name": "Practica"})
+    return [
+        {"id": 1, "name": "General", "summary": summary, "modules": [{"id": 5, "name": "Foro"}]},
+        {"id": 2, "name": "Tema 1", "modules": modules},
+    ]
+
+
+def write(log, contents):
+    record = log.open_record(1678)
+    for section in contents:
+        record.add(section)
+    record.close()
+    return record
+
+
+def test_round_trip_and_deltas(tmp_path):
+    log = SnapshotLog(tmp_path)
+    first = write(log, course())
+    assert log.state().contents() == course()
+
+    # Only the changed section and the new module are written again.
+    second = write(log, course(summary="Intro nueva", extra_module=True))
+    assert first.changed == 4
+    assert second.changed == 3
+    state = log.state()
+    assert state.records == 2
+    assert state.contents() == course(summary="Intro nueva", extra_module=True)
+
+    unchanged = write(log, course(summary="Intro nueva", extra_module=True))
+    assert unchanged.changed == 0
+    assert log.state().contents() == course(summary="Intro nueva", extra_module=True)
+
+
+def test_aborted_record_leaves_no_trace(tmp_path):
+    log = SnapshotLog(tmp_path)
+    write(log, course())
+    record = log.open_record(1678)
+    record.add(course(summary="a medias")[0])
+    record.abort()
+    assert log.state().records == 1
+    assert log.state().contents() == course()
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_new_base_archives_previous_segment(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_BASE_EVERY", 2)
+    log = SnapshotLog(tmp_path)
+    write(log, course())
+    write(log, course(summary="v2"))
+    write(log, course(summary="v3"))
+    assert len(log.segments()) == 2
+    assert log.state().records == 1
+    assert log.state().contents() == course(summary="v3")
+    # Reading at a given time walks the archived segments too.
+    assert log.state(at=log.state().time).contents() == course(summary="v3")
+
+
+def test_damaged_log_is_set_aside(tmp_path):
+    log = SnapshotLog(tmp_path)
+    write(log, course())
+    data = log.path.read_bytes()
+    log.path.write_bytes(data[: len(data) // 2])
+    write(log, course(summary="v2"))
+    assert list(tmp_path.glob("*.damaged"))
+    assert log.state().contents() == course(summary="v2")
+    with gzip.open(log.path, "rt", encoding="utf-8") as f:
+        assert '"base":true' in f.readline()
+
+
+def test_sections_recorded_out_of_order_keep_moodle_order(tmp_path):
+    contents = [{**s, "section": number} for number, s in enumerate(course())]
+    log = SnapshotLog(tmp_path)
+    write(log, reversed(contents))
+    assert log.state().contents() == contents